@@ -0,0 +1,583 @@
+'''
+	Benchmarks for the hot paths in this repository.
+
+	There are two kinds of benchmarks:
+	* Cases: reproducible (seeded) timings of a single function swept over K, n_tbins, the number of pixels and the dtype.
+	  They are listed in BENCHMARK_CASES, and their results can be saved as JSON to track regressions across releases
+	* Comparisons: the bench_* functions compare alternative implementations of the same operation (accuracy and speed)
+
+	Run `python benchmarks.py --help` to see the options. For example:
+		python benchmarks.py --quick --json results.json
+		python benchmarks.py --cases zncc_decoding circular_corr
+		python benchmarks.py --comparisons
+'''
+## Standard Library Imports
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import itertools
+import subprocess
+import tracemalloc
+
+## Library Imports
+import numpy as np
+
+## Local Imports
+from coding_gray import uint_to_gray_code, uint_to_gray_code_batch, generate_gray_coding_matrix, generate_zero_mean_gray_coding_matrix, generate_packed_gray_coding_matrix, generate_n_tbins_zero_mean_gray_coding_matrix, get_gray_code_len, GRAY_CODE_MODES
+from coding_trunc_fourier import uint_to_trunc_fourier_code, uint_to_trunc_fourier_code_batch, generate_trunc_fourier_coding_matrix
+from decoding import zncc, ncc, zncc_decoding, zncc_decoding_chunked, ncc_decoding_chunked, hamming_decoding, gray_decode_n_tbins, gray_decode, fourier_decode, Decoder, SUBBIN_METHODS, get_topk_n_candidates, non_maximum_suppression
+from itof import ITOF_CODING_FUNCTIONS_DIR
+from tof_utils import bin2depth, circular_corr, CircularCorrelator
+
+def time_func(func, n_repeats=3):
+	'''
+		Run func n_repeats times and return the best wall time in seconds
+	'''
+	best_time = np.inf
+	for _ in range(n_repeats):
+		start_time = time.perf_counter()
+		func()
+		best_time = min(best_time, time.perf_counter() - start_time)
+	return best_time
+
+def peak_memory_func(func):
+	'''
+		Run func once and return the peak memory (in bytes) allocated by numpy while it runs
+	'''
+	tracemalloc.start()
+	func()
+	(_, peak_bytes) = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return peak_bytes
+
+def simulate_histograms(gt_tbins, n_tbins, n_signal_photons, n_ambient_photons, pulse_sigma=1., rng=None):
+	'''
+		Simulate noisy (Poisson) histograms with a gaussian pulse at each ground truth time bin plus uniform ambient light
+		Returns a (n_pixels, n_tbins) array
+	'''
+	if(rng is None): rng = np.random.default_rng(0)
+	tbins = np.arange(0, n_tbins)
+	## circular distance between each time bin and the pulse location
+	dists = np.abs(tbins[np.newaxis, :] - gt_tbins[:, np.newaxis])
+	dists = np.minimum(dists, n_tbins - dists)
+	pulses = np.exp(-0.5*np.square(dists / pulse_sigma))
+	pulses /= pulses.sum(axis=-1, keepdims=True)
+	return rng.poisson(n_signal_photons*pulses + (n_ambient_photons / n_tbins)).astype(np.float64)
+
+def bench_batch_encoders(n_tbins=1024, n_freqs=4, n_tstamps=1000000, n_loop_tstamps=10000):
+	'''
+		Compare the per-int encoders against the batch encoders (timestamps/s)
+	'''
+	gray_code_len = int(np.log2(n_tbins))
+	rng = np.random.default_rng(0)
+	tstamps = rng.integers(0, n_tbins, size=(n_tstamps,))
+	loop_tstamps = [int(t) for t in tstamps[0:n_loop_tstamps]]
+	## Validate that both encoders agree before timing them
+	assert(np.all(uint_to_gray_code_batch(tstamps[0:100], gray_code_len) == np.array([uint_to_gray_code(t, gray_code_len) for t in loop_tstamps[0:100]])))
+	assert(np.allclose(uint_to_trunc_fourier_code_batch(tstamps[0:100], n_tbins, n_freqs), np.array([uint_to_trunc_fourier_code(t, n_tbins, n_freqs) for t in loop_tstamps[0:100]]), atol=1e-6))
+	results = {}
+	results['uint_to_gray_code'] = n_loop_tstamps / time_func(lambda: [uint_to_gray_code(t, gray_code_len) for t in loop_tstamps], n_repeats=1)
+	for dtype in [np.float32, np.int8]:
+		results['uint_to_gray_code_batch_{}'.format(np.dtype(dtype).name)] = n_tstamps / time_func(lambda: uint_to_gray_code_batch(tstamps, gray_code_len, dtype=dtype))
+	results['uint_to_trunc_fourier_code'] = n_loop_tstamps / time_func(lambda: [uint_to_trunc_fourier_code(t, n_tbins, n_freqs) for t in loop_tstamps], n_repeats=1)
+	for dtype in [np.float32, np.int8]:
+		results['uint_to_trunc_fourier_code_batch_{}'.format(np.dtype(dtype).name)] = n_tstamps / time_func(lambda: uint_to_trunc_fourier_code_batch(tstamps, n_tbins, n_freqs, dtype=dtype))
+	print("Encoders (n_tbins = {}, gray_code_len = {}, n_freqs = {})".format(n_tbins, gray_code_len, n_freqs))
+	for (name, tstamps_per_sec) in results.items():
+		print("    {:<45} {:>14.0f} tstamps/s".format(name, tstamps_per_sec))
+	return results
+
+def bench_gray_decoding(k_bits=10, n_pixels=10000, n_signal_photons=(5, 20, 100), n_ambient_photons=50):
+	'''
+		Compare gray_decode against zncc_decoding for zero-mean gray codes under poisson noise (accuracy and pixels/s)
+	'''
+	n_tbins = 2**k_bits
+	rng = np.random.default_rng(0)
+	C = generate_zero_mean_gray_coding_matrix(k_bits)
+	gt_tbins = rng.integers(0, n_tbins, size=(n_pixels,))
+	print("Gray decoding (k_bits = {}, n_pixels = {}, n_ambient_photons = {})".format(k_bits, n_pixels, n_ambient_photons))
+	results = {}
+	for n_signal in n_signal_photons:
+		x = np.matmul(simulate_histograms(gt_tbins, n_tbins, n_signal, n_ambient_photons, rng=rng), C).T
+		decoders = {
+			'zncc_decoding': lambda: zncc_decoding(x, C),
+			'gray_decode': lambda: gray_decode(x),
+			'gray_decode_hard': lambda: gray_decode(x, n_soft_bits=0),
+		}
+		for (name, decoder) in decoders.items():
+			decoded_tbins = decoder()
+			mae = np.mean(np.abs(decoded_tbins - gt_tbins))
+			pixels_per_sec = n_pixels / time_func(decoder)
+			results['{}_signal-{}'.format(name, n_signal)] = {'mae': mae, 'pixels_per_sec': pixels_per_sec}
+			print("    signal = {:<5} {:<20} MAE = {:>8.2f} bins  {:>12.0f} pixels/s".format(n_signal, name, mae, pixels_per_sec))
+	return results
+
+def bench_fourier_decoding(n_tbins=1024, n_freqs=4, n_pixels=10000, n_signal_photons=50, n_ambient_photons=200):
+	'''
+		Compare fourier_decode against zncc_decoding for truncated fourier codes (agreement and pixels/s)
+	'''
+	rng = np.random.default_rng(0)
+	C = generate_trunc_fourier_coding_matrix(n_tbins, n_freqs, include_zeroth_harmonic=True)
+	gt_tbins = rng.integers(0, n_tbins, size=(n_pixels,))
+	x = np.matmul(simulate_histograms(gt_tbins, n_tbins, n_signal_photons, n_ambient_photons, pulse_sigma=3., rng=rng), C).T
+	print("Fourier decoding (n_tbins = {}, n_freqs = {}, n_pixels = {})".format(n_tbins, n_freqs, n_pixels))
+	zncc_tbins = zncc_decoding(x, C)
+	results = {}
+	results['zncc_decoding'] = {'pixels_per_sec': n_pixels / time_func(lambda: zncc_decoding(x, C)), 'max_diff_vs_zncc': 0.}
+	for upsample in [1, 4]:
+		decoded_tbins = fourier_decode(x, n_tbins, n_freqs, upsample=upsample, include_zeroth_harmonic=True)
+		diffs = np.abs(decoded_tbins - zncc_tbins)
+		max_diff = np.max(np.minimum(diffs, n_tbins - diffs))
+		pixels_per_sec = n_pixels / time_func(lambda: fourier_decode(x, n_tbins, n_freqs, upsample=upsample, include_zeroth_harmonic=True))
+		results['fourier_decode_upsample-{}'.format(upsample)] = {'pixels_per_sec': pixels_per_sec, 'max_diff_vs_zncc': max_diff}
+	for (name, result) in results.items():
+		print("    {:<30} max diff vs zncc = {:>5.2f} bins  {:>12.0f} pixels/s".format(name, result['max_diff_vs_zncc'], result['pixels_per_sec']))
+	return results
+
+def bench_chunked_decoding(n_tbins=4096, n_freqs=8, n_pixels=20000, max_bytes=2**24):
+	'''
+		Compare zncc_decoding against zncc_decoding_chunked (pixels/s and peak memory) for float64 and float32 inputs
+	'''
+	rng = np.random.default_rng(0)
+	print("Chunked ZNCC decoding (n_tbins = {}, n_freqs = {}, n_pixels = {}, max_bytes = {})".format(n_tbins, n_freqs, n_pixels, max_bytes))
+	results = {}
+	for dtype in [np.float64, np.float32]:
+		C = generate_trunc_fourier_coding_matrix(n_tbins, n_freqs).astype(dtype)
+		x = rng.random((2*n_freqs, n_pixels)).astype(dtype)
+		decoders = {
+			'zncc_decoding': lambda: zncc_decoding(x, C),
+			'zncc_decoding_chunked': lambda: zncc_decoding_chunked(x, C, max_bytes=max_bytes),
+		}
+		for (name, decoder) in decoders.items():
+			result = {'pixels_per_sec': n_pixels / time_func(decoder), 'peak_bytes': peak_memory_func(decoder)}
+			results['{}_{}'.format(name, np.dtype(dtype).name)] = result
+			print("    {:<25} {:<8} {:>12.0f} pixels/s  peak memory = {:>8.1f} MB".format(name, np.dtype(dtype).name, result['pixels_per_sec'], result['peak_bytes'] / 2**20))
+	return results
+
+def bench_subbin_refinement(n_tbins=4096, upsample_factor=16, n_freqs=4, n_pixels=5000, repetition_tau=100e-9):
+	'''
+		Compare decoding with the full (n_tbins x K) fourier coding matrix against decoding with a coarse matrix that has
+		upsample_factor times fewer rows followed by sub-bin refinement (depth MAE and pixels/s)
+	'''
+	rng = np.random.default_rng(0)
+	n_coarse_tbins = n_tbins // upsample_factor
+	gt_tbins = rng.integers(0, n_tbins, size=(n_pixels,))
+	x = np.matmul(simulate_histograms(gt_tbins, n_tbins, 500, 100, pulse_sigma=upsample_factor / 2., rng=rng), generate_trunc_fourier_coding_matrix(n_tbins, n_freqs)).T
+	gt_depths = bin2depth(gt_tbins, n_tbins, repetition_tau)
+	fine_decoder = Decoder(generate_trunc_fourier_coding_matrix(n_tbins, n_freqs), zero_mean=False)
+	coarse_decoder = Decoder(generate_trunc_fourier_coding_matrix(n_coarse_tbins, n_freqs), zero_mean=False)
+	decoders = {
+		'fine_decode': lambda: bin2depth(fine_decoder.decode(x), n_tbins, repetition_tau),
+		'coarse_decode': lambda: bin2depth(coarse_decoder.decode(x), n_coarse_tbins, repetition_tau),
+	}
+	for method in SUBBIN_METHODS:
+		decoders['coarse_decode_subbin_{}'.format(method)] = lambda method=method: bin2depth(coarse_decoder.decode_subbin(x, method=method), n_coarse_tbins, repetition_tau)
+	print("Sub-bin refinement (n_tbins = {}, coarse n_tbins = {}, n_freqs = {}, n_pixels = {})".format(n_tbins, n_coarse_tbins, n_freqs, n_pixels))
+	results = {}
+	for (name, decoder) in decoders.items():
+		depth_errors = np.abs(decoder() - gt_depths)
+		max_depth = bin2depth(n_tbins, n_tbins, repetition_tau)
+		mae = np.mean(np.minimum(depth_errors, max_depth - depth_errors))
+		results[name] = {'depth_mae': mae, 'pixels_per_sec': n_pixels / time_func(decoder)}
+		print("    {:<35} depth MAE = {:>8.4f} m  {:>12.0f} pixels/s".format(name, mae, results[name]['pixels_per_sec']))
+	return results
+
+def simulate_itof_measurements(corrfs, gt_tbins, n_signal_photons, n_ambient_photons, rng=None):
+	'''
+		Simulate noisy (Poisson) iToF measurements for each ground truth time bin. corrfs is the NxK matrix of correlation functions
+		Returns a KxM matrix
+	'''
+	if(rng is None): rng = np.random.default_rng(0)
+	return rng.poisson((n_signal_photons*corrfs[gt_tbins] / corrfs.max()) + n_ambient_photons).T.astype(np.float64)
+
+def bench_coarse_to_fine(n_pixels=20000, decimations=(2, 4, 8, 16), n_candidates=(1, 2, 4), large_n_tbins=8192):
+	'''
+		Accuracy vs. speed of Decoder.decode_coarse_to_fine compared to the full zncc search for the coding functions in
+		itof_coding_functions/ and for a large fourier coding matrix. Accuracy is the fraction of pixels decoded within one
+		bin of the full search (exact agreement is not meaningful for the flat regions of the hamiltonian correlation functions)
+	'''
+	rng = np.random.default_rng(0)
+	coding_matrices = {os.path.basename(fpath)[:-4]: np.load(fpath)['corrfs'] for fpath in sorted(glob.glob(os.path.join(ITOF_CODING_FUNCTIONS_DIR, '*.npz')))}
+	## A large fourier matrix shifted to be non-negative so that it can be used with the same noise model
+	coding_matrices['k-8_n-{}_fourier'.format(large_n_tbins)] = generate_trunc_fourier_coding_matrix(large_n_tbins, 4) + 1.
+	print("Coarse-to-fine ZNCC decoding (n_pixels = {})".format(n_pixels))
+	results = {}
+	for (name, C) in coding_matrices.items():
+		n_tbins = C.shape[0]
+		gt_tbins = rng.integers(0, n_tbins, size=(n_pixels,))
+		x = simulate_itof_measurements(C, gt_tbins, 1000, 100, rng=rng)
+		decoder = Decoder(C, zero_mean=True)
+		full_decoded = decoder.decode(x)
+		full_pixels_per_sec = n_pixels / time_func(lambda: decoder.decode(x))
+		results[name] = {'full': {'pixels_per_sec': full_pixels_per_sec, 'accuracy': 1.}}
+		print("    {:<35} full search: {:>12.0f} pixels/s".format(name, full_pixels_per_sec))
+		for decimation in decimations:
+			if(decimation >= n_tbins): continue
+			for n_candidate in n_candidates:
+				decoded = decoder.decode_coarse_to_fine(x, decimation=decimation, n_candidates=n_candidate)
+				diffs = np.abs(decoded - full_decoded)
+				accuracy = np.mean(np.minimum(diffs, n_tbins - diffs) <= 1)
+				pixels_per_sec = n_pixels / time_func(lambda: decoder.decode_coarse_to_fine(x, decimation=decimation, n_candidates=n_candidate))
+				results[name]['decimation-{}_candidates-{}'.format(decimation, n_candidate)] = {'pixels_per_sec': pixels_per_sec, 'accuracy': accuracy}
+				print("        decimation = {:<3} candidates = {:<3} accuracy = {:>6.2f}%  {:>12.0f} pixels/s  ({:.2f}x)".format(decimation, n_candidate, 100*accuracy, pixels_per_sec, pixels_per_sec / full_pixels_per_sec))
+	return results
+
+def bench_circular_corr(n_samples=(1024, 4096), n_codes=(4, 10, 16), n_repeats=10):
+	'''
+		Compare the complex fft/ifft circular correlation (the original implementation) against the rfft-based circular_corr,
+		a CircularCorrelator that reuses the rfft of the demodulation functions, and scipy.fft with multiple workers.
+		Uses the N x K shapes of the files in itof_coding_functions/ plus every (n_samples, n_codes) pair for larger N.
+	'''
+	def complex_circular_corr(v1, v2, axis=-1):
+		return np.fft.ifft(np.fft.fft(v1, axis=axis).conj()*np.fft.fft(v2, axis=axis), axis=axis).real
+	rng = np.random.default_rng(0)
+	print("Circular correlation (calls/s, {} calls per timing)".format(n_repeats))
+	shapes = set([np.load(fpath)['demodfs'].shape for fpath in glob.glob(os.path.join(ITOF_CODING_FUNCTIONS_DIR, '*.npz'))])
+	shapes = sorted(shapes | set(itertools.product(n_samples, n_codes)))
+	results = {}
+	for (n, k) in shapes:
+		modfs = rng.random((n, k))
+		demodfs = rng.random((n, k))
+		correlator = CircularCorrelator(demodfs, axis=0)
+		assert(np.allclose(circular_corr(modfs, demodfs, axis=0), complex_circular_corr(modfs, demodfs, axis=0)))
+		funcs = {
+			'complex_fft': lambda: complex_circular_corr(modfs, demodfs, axis=0),
+			'circular_corr': lambda: circular_corr(modfs, demodfs, axis=0),
+			'circular_corr_scipy_workers': lambda: circular_corr(modfs, demodfs, axis=0, workers=-1),
+			'CircularCorrelator': lambda: correlator(modfs),
+		}
+		case_results = {name: n_repeats / time_func(lambda: [func() for _ in range(n_repeats)]) for (name, func) in funcs.items()}
+		results['n-{}_k-{}'.format(n, k)] = case_results
+		print("    N = {:<6} K = {:<4}".format(n, k) + "  ".join(["{} = {:>9.0f}".format(name, calls_per_sec) for (name, calls_per_sec) in case_results.items()]))
+	return results
+
+def bench_packed_gray(k_bits=(8, 10, 12), n_pixels=20000, row_fraction=0.5):
+	'''
+		Compare NCC decoding of sign-quantized measurements with the float64 zero-mean gray coding matrix against
+		hamming_decoding with the packed matrix (pixels/s and matrix bytes). Only a random subset of the rows is used as
+		candidates, otherwise every sign pattern is a code and the search is trivial
+	'''
+	rng = np.random.default_rng(0)
+	print("Packed gray decoding (n_pixels = {}, {:.0%} of the rows)".format(n_pixels, row_fraction))
+	results = {}
+	for k in k_bits:
+		rows = np.sort(rng.choice(2**k, size=int(row_fraction*2**k), replace=False))
+		C = generate_zero_mean_gray_coding_matrix(k)[rows]
+		packed_C = generate_packed_gray_coding_matrix(k)[rows]
+		x = rng.standard_normal((k, n_pixels))
+		sign_x = np.where(x > 0, 1., -1.)
+		decoders = {
+			'ncc_decoding_chunked': (lambda: ncc_decoding_chunked(sign_x, C), C.nbytes),
+			'ncc_decoding_chunked_float32': (lambda: ncc_decoding_chunked(sign_x.astype(np.float32), C.astype(np.float32)), C.nbytes // 2),
+			'hamming_decoding': (lambda: hamming_decoding(x, packed_C), packed_C.nbytes),
+		}
+		for (name, (decoder, matrix_bytes)) in decoders.items():
+			result = {'pixels_per_sec': n_pixels / time_func(decoder), 'matrix_bytes': matrix_bytes}
+			results['{}_k-{}'.format(name, k)] = result
+			print("    K = {:<3} {:<30} {:>12.0f} pixels/s  matrix = {:>9} bytes".format(k, name, result['pixels_per_sec'], matrix_bytes))
+	return results
+
+def bench_n_tbins_gray(n_tbins_list=(285, 600, 1100, 3000), n_pixels=10000, n_signal_photons=200, n_ambient_photons=50):
+	'''
+		Gray codes for n_tbins that are not powers of 2: padding to the next power of 2 vs. the balanced and truncated
+		n_tbins codes (matrix bytes, pixels/s and MAE). The measurements are the same for all of them because they use the
+		same number of bits and, for the truncated mode, the same codes
+	'''
+	rng = np.random.default_rng(0)
+	print("Gray codes for any n_tbins (n_pixels = {})".format(n_pixels))
+	results = {}
+	for n_tbins in n_tbins_list:
+		k_bits = get_gray_code_len(n_tbins)
+		gt_tbins = rng.integers(0, n_tbins, size=(n_pixels,))
+		hists = simulate_histograms(gt_tbins, n_tbins, n_signal_photons, n_ambient_photons, rng=rng)
+		coding_matrices = {'padded': generate_zero_mean_gray_coding_matrix(k_bits)}
+		for mode in GRAY_CODE_MODES:
+			coding_matrices[mode] = generate_n_tbins_zero_mean_gray_coding_matrix(n_tbins, mode=mode)
+		for (name, C) in coding_matrices.items():
+			## the padded matrix uses its first n_tbins rows to encode
+			x = np.matmul(hists, C[0:n_tbins]).T
+			decoders = {'zncc_decoding_chunked': lambda: zncc_decoding_chunked(x, C)}
+			if(name != 'padded'): decoders['gray_decode_n_tbins'] = lambda: gray_decode_n_tbins(x, n_tbins, mode=name)
+			for (decoder_name, decoder) in decoders.items():
+				mae = np.mean(np.abs(decoder() - gt_tbins))
+				result = {'pixels_per_sec': n_pixels / time_func(decoder), 'mae': mae, 'matrix_bytes': C.nbytes}
+				results['n_tbins-{}_{}_{}'.format(n_tbins, name, decoder_name)] = result
+				print("    n_tbins = {:<5} {:<10} {:<22} MAE = {:>7.2f} bins  {:>12.0f} pixels/s  matrix = {:>8} bytes".format(n_tbins, name, decoder_name, mae, result['pixels_per_sec'], C.nbytes))
+	return results
+
+## Modules that the encoders and decoders should be able to import without the heavy optional dependencies
+IMPORT_TIME_MODULES = ['coding_gray', 'coding_trunc_fourier', 'tof_utils', 'utils', 'coding_cache', 'itof', 'decoding',
+	'compressive_histogram', 'parallel_decoding', 'spad_simulator', 'quantization', 'itof_coding_gray', 'itof_coding_hamiltonian',
+	'evaluation', 'coded_frame_store', 'pipeline', 'instrumentation', 'code_design', 'sliding_window']
+HEAVY_MODULES = ['IPython', 'scipy', 'matplotlib']
+
+def bench_topk_decoding(n_tbins=1024, n_freqs=16, n_pixels=20000, n_signal_photons=(2000, 1000), n_ambient_photons=200, min_separation=32, tolerance=2):
+	'''
+		Decode two returns per pixel (e.g., a transparent surface in front of a wall) with Decoder.decode_topk, and compare
+		its throughput with single-peak decoding and with the full correlation table followed by a sort.
+		A return is recovered if one of the two peaks is within tolerance bins of it
+	'''
+	rng = np.random.default_rng(0)
+	C = generate_trunc_fourier_coding_matrix(n_tbins, n_freqs)
+	gt_tbins = rng.integers(0, n_tbins, size=(2, n_pixels))
+	## the second return is at least 2*min_separation bins away from the first one
+	gt_tbins[1] = (gt_tbins[0] + rng.integers(2*min_separation, n_tbins - 2*min_separation, size=(n_pixels,))) % n_tbins
+	hists = sum(simulate_histograms(gt_tbins[i], n_tbins, n_signal_photons[i], n_ambient_photons if(i == 0) else 0, rng=rng) for i in range(2))
+	x = np.matmul(C.T, hists.T)
+	decoder = Decoder(C)
+	n_candidates = get_topk_n_candidates(2, min_separation)
+	def full_table_topk():
+		corr = zncc(x, C).T
+		candidates = np.argsort(-corr, axis=1, kind='stable')[:, :n_candidates]
+		return non_maximum_suppression(candidates, np.take_along_axis(corr, candidates, axis=1), 2, min_separation, n_rows=n_tbins)
+	decoders = {
+		'decode (1 peak)': lambda: (decoder.decode(x)[:, np.newaxis], None),
+		'decode_topk (2 peaks)': lambda: decoder.decode_topk(x, n_peaks=2, min_separation=min_separation),
+		'zncc table + sort (2 peaks)': full_table_topk,
+	}
+	print("Top-k decoding of two returns (n_tbins = {}, n_freqs = {}, n_pixels = {}, min_separation = {})".format(n_tbins, n_freqs, n_pixels, min_separation))
+	results = {}
+	for (name, decode_func) in decoders.items():
+		(peak_indeces, _) = decode_func()
+		dists = np.abs(peak_indeces[np.newaxis, :, :] - gt_tbins[:, :, np.newaxis])
+		dists = np.minimum(dists, n_tbins - dists).min(axis=-1)
+		result = {
+			'pixels_per_sec': n_pixels / time_func(decode_func),
+			'first_return_recovered': float(np.mean(dists[0] <= tolerance)),
+			'second_return_recovered': float(np.mean(dists[1] <= tolerance)),
+		}
+		results[name] = result
+		print("    {:<30} {:>12.0f} pixels/s  first return = {:>7.2%}  second return = {:>7.2%}".format(name, result['pixels_per_sec'], result['first_return_recovered'], result['second_return_recovered']))
+	return results
+
+def bench_import_time(modules=IMPORT_TIME_MODULES, n_repeats=5):
+	'''
+		Import time of each module in a fresh interpreter (like a newly spawned worker). numpy is imported before the timer
+		starts, so the times do not include it (the time to import numpy alone is also reported).
+		Also checks that importing them does not load any of the HEAVY_MODULES
+	'''
+	script = '\n'.join([
+		'import sys, time, json',
+		'{preload}',
+		'start_time = time.perf_counter()',
+		'import {module}',
+		'seconds = time.perf_counter() - start_time',
+		'print(json.dumps({{"seconds": seconds, "heavy_modules": [name for name in {heavy_modules} if name in sys.modules]}}))',
+	])
+	repo_dir = os.path.dirname(os.path.abspath(__file__))
+	def import_module(module, preload='import numpy'):
+		output = subprocess.run([sys.executable, '-c', script.format(module=module, preload=preload, heavy_modules=HEAVY_MODULES)], cwd=repo_dir, capture_output=True, text=True, check=True)
+		return json.loads(output.stdout)
+	results = {'numpy': {'seconds': min([import_module('numpy', preload='')['seconds'] for _ in range(n_repeats)]), 'heavy_modules': []}}
+	print("Import time after numpy is loaded (numpy = {:.1f} ms), best of {}".format(1000*results['numpy']['seconds'], n_repeats))
+	for module in modules:
+		imports = [import_module(module) for _ in range(n_repeats)]
+		results[module] = {'seconds': min([result['seconds'] for result in imports]), 'heavy_modules': imports[0]['heavy_modules']}
+		print("    {:<30} {:>8.1f} ms  {}".format(module, 1000*results[module]['seconds'], ' '.join(['loads ' + name for name in results[module]['heavy_modules']])))
+	return results
+
+## Each case has:
+## * setup(rng, **params): builds the inputs and returns (func, n_items), where func runs the operation once on n_items items
+## * unit: what the items are (the throughput is reported as items/s)
+## * sweep: the parameter values to benchmark. All their combinations are run
+## * quick_sweep: a smaller sweep used with --quick
+def _setup_uint_to_gray_code(rng, k, n_tstamps):
+	tstamps = [int(t) for t in rng.integers(0, 2**k, size=(n_tstamps,))]
+	return (lambda: [uint_to_gray_code(t, k) for t in tstamps], n_tstamps)
+
+def _setup_uint_to_gray_code_batch(rng, k, n_tstamps, dtype):
+	tstamps = rng.integers(0, 2**k, size=(n_tstamps,))
+	return (lambda: uint_to_gray_code_batch(tstamps, k, dtype=dtype), n_tstamps)
+
+def _setup_uint_to_trunc_fourier_code(rng, n_tbins, k, n_tstamps):
+	tstamps = [int(t) for t in rng.integers(0, n_tbins, size=(n_tstamps,))]
+	return (lambda: [uint_to_trunc_fourier_code(t, n_tbins, k // 2) for t in tstamps], n_tstamps)
+
+def _setup_uint_to_trunc_fourier_code_batch(rng, n_tbins, k, n_tstamps, dtype):
+	tstamps = rng.integers(0, n_tbins, size=(n_tstamps,))
+	return (lambda: uint_to_trunc_fourier_code_batch(tstamps, n_tbins, k // 2, dtype=dtype), n_tstamps)
+
+def _setup_generate_gray_coding_matrix(rng, k):
+	return (lambda: generate_gray_coding_matrix(k), 2**k)
+
+def _setup_generate_zero_mean_gray_coding_matrix(rng, k):
+	return (lambda: generate_zero_mean_gray_coding_matrix(k), 2**k)
+
+def _setup_generate_trunc_fourier_coding_matrix(rng, n_tbins, k):
+	return (lambda: generate_trunc_fourier_coding_matrix(n_tbins, k // 2), n_tbins)
+
+def _get_decoding_inputs(rng, n_tbins, k, n_pixels, dtype):
+	C = generate_trunc_fourier_coding_matrix(n_tbins, k // 2).astype(dtype)
+	x = rng.random((k, n_pixels)).astype(dtype)
+	return (x, C)
+
+def _setup_zncc(rng, n_tbins, k, n_pixels, dtype):
+	(x, C) = _get_decoding_inputs(rng, n_tbins, k, n_pixels, dtype)
+	return (lambda: zncc(x, C), n_pixels)
+
+def _setup_ncc(rng, n_tbins, k, n_pixels, dtype):
+	(x, C) = _get_decoding_inputs(rng, n_tbins, k, n_pixels, dtype)
+	return (lambda: ncc(x, C), n_pixels)
+
+def _setup_zncc_decoding(rng, n_tbins, k, n_pixels, dtype):
+	(x, C) = _get_decoding_inputs(rng, n_tbins, k, n_pixels, dtype)
+	return (lambda: zncc_decoding(x, C), n_pixels)
+
+def _setup_zncc_decoding_chunked(rng, n_tbins, k, n_pixels, dtype):
+	(x, C) = _get_decoding_inputs(rng, n_tbins, k, n_pixels, dtype)
+	return (lambda: zncc_decoding_chunked(x, C), n_pixels)
+
+def _setup_circular_corr(rng, n_tbins, k, dtype):
+	modfs = rng.random((n_tbins, k)).astype(dtype)
+	demodfs = rng.random((n_tbins, k)).astype(dtype)
+	return (lambda: circular_corr(modfs, demodfs, axis=0), 1)
+
+def _setup_get_pretty_C(rng, n_tbins, k):
+	## utils is only imported when this case runs
+	from utils import get_pretty_C
+	C = generate_trunc_fourier_coding_matrix(n_tbins, k // 2)
+	return (lambda: get_pretty_C(C), 1)
+
+DTYPES = [np.float32, np.float64]
+
+BENCHMARK_CASES = {
+	'uint_to_gray_code': {'setup': _setup_uint_to_gray_code, 'unit': 'tstamps',
+		'sweep': {'k': [8, 12, 16], 'n_tstamps': [10000]},
+		'quick_sweep': {'k': [10], 'n_tstamps': [2000]}},
+	'uint_to_gray_code_batch': {'setup': _setup_uint_to_gray_code_batch, 'unit': 'tstamps',
+		'sweep': {'k': [8, 12, 16], 'n_tstamps': [10**5, 10**6], 'dtype': [np.int8, np.float32, np.float64]},
+		'quick_sweep': {'k': [10], 'n_tstamps': [10**5], 'dtype': [np.float32]}},
+	'uint_to_trunc_fourier_code': {'setup': _setup_uint_to_trunc_fourier_code, 'unit': 'tstamps',
+		'sweep': {'n_tbins': [1024, 8192], 'k': [8, 16], 'n_tstamps': [10000]},
+		'quick_sweep': {'n_tbins': [1024], 'k': [8], 'n_tstamps': [2000]}},
+	'uint_to_trunc_fourier_code_batch': {'setup': _setup_uint_to_trunc_fourier_code_batch, 'unit': 'tstamps',
+		'sweep': {'n_tbins': [1024, 8192], 'k': [8, 16], 'n_tstamps': [10**5, 10**6], 'dtype': [np.int16, np.float32, np.float64]},
+		'quick_sweep': {'n_tbins': [1024], 'k': [8], 'n_tstamps': [10**5], 'dtype': [np.float32]}},
+	'generate_gray_coding_matrix': {'setup': _setup_generate_gray_coding_matrix, 'unit': 'rows',
+		'sweep': {'k': [8, 12, 16, 20]},
+		'quick_sweep': {'k': [10]}},
+	'generate_zero_mean_gray_coding_matrix': {'setup': _setup_generate_zero_mean_gray_coding_matrix, 'unit': 'rows',
+		'sweep': {'k': [8, 12, 16, 20]},
+		'quick_sweep': {'k': [10]}},
+	'generate_trunc_fourier_coding_matrix': {'setup': _setup_generate_trunc_fourier_coding_matrix, 'unit': 'rows',
+		'sweep': {'n_tbins': [1024, 8192, 65536], 'k': [8, 16]},
+		'quick_sweep': {'n_tbins': [1024], 'k': [8]}},
+	'zncc': {'setup': _setup_zncc, 'unit': 'pixels',
+		'sweep': {'n_tbins': [1024, 4096], 'k': [8, 16], 'n_pixels': [1000, 10000], 'dtype': DTYPES},
+		'quick_sweep': {'n_tbins': [1024], 'k': [8], 'n_pixels': [1000], 'dtype': [np.float32]}},
+	'ncc': {'setup': _setup_ncc, 'unit': 'pixels',
+		'sweep': {'n_tbins': [1024, 4096], 'k': [8, 16], 'n_pixels': [1000, 10000], 'dtype': DTYPES},
+		'quick_sweep': {'n_tbins': [1024], 'k': [8], 'n_pixels': [1000], 'dtype': [np.float32]}},
+	'zncc_decoding': {'setup': _setup_zncc_decoding, 'unit': 'pixels',
+		'sweep': {'n_tbins': [1024, 4096], 'k': [8, 16], 'n_pixels': [1000, 10000], 'dtype': DTYPES},
+		'quick_sweep': {'n_tbins': [1024], 'k': [8], 'n_pixels': [1000], 'dtype': [np.float32]}},
+	'zncc_decoding_chunked': {'setup': _setup_zncc_decoding_chunked, 'unit': 'pixels',
+		'sweep': {'n_tbins': [1024, 4096], 'k': [8, 16], 'n_pixels': [1000, 10000, 100000], 'dtype': DTYPES},
+		'quick_sweep': {'n_tbins': [1024], 'k': [8], 'n_pixels': [1000], 'dtype': [np.float32]}},
+	'circular_corr': {'setup': _setup_circular_corr, 'unit': 'calls',
+		'sweep': {'n_tbins': [64, 1024, 8192], 'k': [4, 16], 'dtype': DTYPES},
+		'quick_sweep': {'n_tbins': [1024], 'k': [4], 'dtype': [np.float64]}},
+	'get_pretty_C': {'setup': _setup_get_pretty_C, 'unit': 'calls',
+		'sweep': {'n_tbins': [1024, 8192], 'k': [8, 16]},
+		'quick_sweep': {'n_tbins': [1024], 'k': [8]}},
+}
+
+def _param_to_json(value):
+	if(isinstance(value, type) and issubclass(value, np.generic)): return np.dtype(value).name
+	return value
+
+def run_case(name, params, n_repeats=3, measure_memory=True, seed=0):
+	'''
+		Run one benchmark case with one set of parameters. The inputs come from a seeded RNG, so every run times the same data.
+		Returns a dict with the parameters, the best time, the throughput (items/s) and the peak memory in bytes (None if
+		measure_memory is False)
+	'''
+	case = BENCHMARK_CASES[name]
+	(func, n_items) = case['setup'](np.random.default_rng(seed), **params)
+	seconds = time_func(func, n_repeats=n_repeats)
+	return {
+		'case': name,
+		'params': {key: _param_to_json(value) for (key, value) in params.items()},
+		'seconds': seconds,
+		'unit': case['unit'],
+		'throughput': n_items / seconds,
+		'peak_bytes': (peak_memory_func(func) if measure_memory else None),
+	}
+
+def get_case_params(name, quick=False):
+	'''
+		All the parameter combinations in the sweep of a case
+	'''
+	sweep = BENCHMARK_CASES[name]['quick_sweep' if quick else 'sweep']
+	return [dict(zip(sweep.keys(), values)) for values in itertools.product(*sweep.values())]
+
+def run_cases(case_names=None, quick=False, n_repeats=3, measure_memory=True):
+	'''
+		Run the sweeps of the given cases (all of them by default). Returns a list with the result of each run (see run_case)
+	'''
+	if(case_names is None): case_names = list(BENCHMARK_CASES.keys())
+	for name in case_names:
+		assert(name in BENCHMARK_CASES), "unknown benchmark case {}. Available: {}".format(name, list(BENCHMARK_CASES.keys()))
+	results = []
+	for name in case_names:
+		for params in get_case_params(name, quick=quick):
+			result = run_case(name, params, n_repeats=n_repeats, measure_memory=measure_memory)
+			results.append(result)
+			params_str = " ".join(["{}={}".format(key, value) for (key, value) in result['params'].items()])
+			memory_str = "" if(result['peak_bytes'] is None) else "  peak memory = {:>9.2f} MB".format(result['peak_bytes'] / 2**20)
+			print("{:<38} {:<45} {:>14.0f} {}/s{}".format(name, params_str, result['throughput'], result['unit'], memory_str))
+	return results
+
+def get_environment_info():
+	'''
+		Versions and hardware saved with the JSON results, so that runs on different machines are not compared by mistake
+	'''
+	return {
+		'python': sys.version.split()[0],
+		'numpy': np.__version__,
+		'platform': platform.platform(),
+		'cpu_count': os.cpu_count(),
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+	}
+
+COMPARISONS = {
+	'batch_encoders': bench_batch_encoders,
+	'gray_decoding': bench_gray_decoding,
+	'fourier_decoding': bench_fourier_decoding,
+	'chunked_decoding': bench_chunked_decoding,
+	'subbin_refinement': bench_subbin_refinement,
+	'coarse_to_fine': bench_coarse_to_fine,
+	'circular_corr': bench_circular_corr,
+	'packed_gray': bench_packed_gray,
+	'n_tbins_gray': bench_n_tbins_gray,
+	'topk_decoding': bench_topk_decoding,
+	'import_time': bench_import_time,
+}
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Benchmark the encode, decode and correlation hot paths')
+	parser.add_argument('--cases', nargs='+', default=None, choices=list(BENCHMARK_CASES.keys()), help='cases to run (defaults to all)')
+	parser.add_argument('--quick', action='store_true', help='use the smaller sweeps')
+	parser.add_argument('--repeats', type=int, default=3, help='number of timings of each run. The best one is reported')
+	parser.add_argument('--no-memory', action='store_true', help='do not measure the peak memory (it runs each case one more time)')
+	parser.add_argument('--json', default=None, help='save the results to this JSON file')
+	parser.add_argument('--comparisons', nargs='*', default=None, choices=list(COMPARISONS.keys()), help='run the comparison benchmarks instead of the cases (all of them if none are given)')
+	args = parser.parse_args(argv)
+	output = {'environment': get_environment_info()}
+	if(args.comparisons is not None):
+		comparison_names = args.comparisons if(len(args.comparisons) > 0) else list(COMPARISONS.keys())
+		output['comparisons'] = {name: COMPARISONS[name]() for name in comparison_names}
+	else:
+		output['quick'] = args.quick
+		output['results'] = run_cases(args.cases, quick=args.quick, n_repeats=args.repeats, measure_memory=(not args.no_memory))
+	if(args.json is not None):
+		with open(args.json, 'w') as f:
+			json.dump(output, f, indent=1, default=float)
+		print("Saved results to {}".format(args.json))
+
+if __name__=='__main__':
+	main()
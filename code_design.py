@@ -0,0 +1,279 @@
+'''
+	Search for iToF demodulation functions that minimize the expected depth error.
+
+	The design variable is the NxK demodulation matrix (demodfs). The modulation functions are fixed (a perfect pulse
+	or a square pulse with a given duty cycle), and the correlation functions are computed as in itof.compute_corrfs.
+	* evaluate_demodfs: expected ZNCC decoding error over every time bin for a batch of candidate matrices at once. The
+	  noise is the gaussian approximation of the Poisson noise of evaluation.simulate_measurements, drawn from the same
+	  standard normal samples for every candidate (common random numbers), so candidates are compared without the
+	  noise of different draws. With a temperature the argmax is replaced by a softmax, which makes the error a smooth
+	  function of the demodulation functions
+	* optimize_demodfs: derivative-free (1+lambda) evolutionary search. Each iteration evaluates the current best matrix
+	  and a population of mutations of it in one batch
+	* Constraints: binary demodulation functions with a minimum on/off segment length, or continuous functions in
+	  [0, 1] with a max number of harmonics. Both limit the bandwidth the hardware needs
+	* run_code_design: runs the search for several seeds in parallel, and save_optimized_coding_functions stores the
+	  best result in the itof_coding_functions/ .npz layout (e.g., k-4_n-64_optimized.npz), so evaluation.py compares
+	  it with the other schemes
+
+	Run `python code_design.py --help` to see the options.
+'''
+## Standard Library Imports
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+## Library Imports
+import numpy as np
+
+## Local Imports
+from itof import ITOF_CODING_FUNCTIONS_DIR, HAMILTONIAN_SPECS, get_itof_coding_functions_fname, generate_coding_functions, pulse_functions, variable_duty_cycle_functions, compute_corrfs
+from decoding import zero_norm_t
+from tof_utils import circular_corr
+
+OPTIMIZED_CODING = 'optimized'
+
+def get_modfs(n: int, k: int, mod_duty: float=None) -> np.ndarray:
+	'''
+		NxK modulation functions: perfect pulses if mod_duty is None, else square pulses (see itof.variable_duty_cycle_functions)
+	'''
+	if(mod_duty is None): return pulse_functions(n, k)
+	return variable_duty_cycle_functions(n, k, mod_duty)
+
+def complete_demodfs(demodfs: np.ndarray, complementary: bool=False) -> np.ndarray:
+	'''
+		Append the negated demodulation functions (see itof.make_complementary) to a (..., N, K) batch
+	'''
+	if(not complementary): return demodfs
+	return np.concatenate((demodfs, 1. - demodfs), axis=-1)
+
+def evaluate_demodfs(demodfs: np.ndarray, modfs: np.ndarray, n_photons: float, sbr: float, n_samples: int=16, seed: int=0, temperature: float=None, max_bytes: int=2**27) -> np.ndarray:
+	'''
+		Expected absolute decoding error (in time bins, taking the wrap around into account) of a batch of demodulation
+		matrices, averaged over every time bin.
+		Arguments:
+			* demodfs: (B, N, K) batch of demodulation matrices (or a single NxK matrix)
+			* modfs: NxK modulation functions, shared by the whole batch
+			* n_photons, sbr: photon budget and signal-to-background ratio (see evaluation.simulate_measurements)
+			* n_samples: noisy measurements per time bin
+			* seed: seed of the standard normal noise. The same seed gives the same noise for every candidate
+			* temperature: if set, the decoded bin is the softmax(zncc / temperature) weighted error instead of the argmax
+			* max_bytes: max size of the correlation tables of each group of candidates
+		Returns a (B,) array
+	'''
+	demodfs = np.asarray(demodfs, dtype=np.float64)
+	if(demodfs.ndim == 2): return evaluate_demodfs(demodfs[np.newaxis], modfs, n_photons, sbr, n_samples, seed, temperature, max_bytes)[0]
+	(n_candidates, n, k) = demodfs.shape
+	corrfs = circular_corr(modfs, demodfs, axis=-2) / n
+	## Gaussian approximation of evaluation.simulate_measurements with integer time bins
+	signal = n_photons*corrfs / (corrfs.mean(axis=-2).sum(axis=-1)[:, np.newaxis, np.newaxis] + 1e-12)
+	demodf_means = demodfs.mean(axis=-2)
+	ambient = (n_photons / sbr)*demodf_means / (demodf_means.sum(axis=-1, keepdims=True) + 1e-12)
+	means = signal + ambient[:, np.newaxis, :]
+	gt_tbins = np.repeat(np.arange(n), n_samples)
+	noise = np.random.default_rng(seed).standard_normal((gt_tbins.size, k))
+	## (B, K, N*n_samples) measurements
+	x = np.swapaxes(means[:, gt_tbins, :] + np.sqrt(means[:, gt_tbins, :])*noise, 1, 2)
+	norm_corrfs = zero_norm_t(corrfs, axis=-1)
+	norm_x = zero_norm_t(x, axis=-2)
+	bin_errors = np.abs(np.arange(n)[:, np.newaxis] - gt_tbins[np.newaxis, :])
+	bin_errors = np.minimum(bin_errors, n - bin_errors)
+	errors = np.zeros((n_candidates,))
+	candidates_per_group = int(max(1, max_bytes // (8*n*gt_tbins.size)))
+	for start in range(0, n_candidates, candidates_per_group):
+		## (b, N, N*n_samples) zncc tables
+		corr = np.matmul(norm_corrfs[start:start+candidates_per_group], norm_x[start:start+candidates_per_group])
+		if(temperature is None):
+			decoded = np.argmax(corr, axis=1)
+			errors[start:start+candidates_per_group] = bin_errors[decoded, np.arange(gt_tbins.size)].mean(axis=-1)
+		else:
+			weights = np.exp((corr - corr.max(axis=1, keepdims=True)) / temperature)
+			weights /= weights.sum(axis=1, keepdims=True)
+			errors[start:start+candidates_per_group] = (weights*bin_errors).sum(axis=1).mean(axis=-1)
+	return errors
+
+def _get_runs(column: np.ndarray):
+	'''
+		(starts, lengths) of the circular runs of equal values of a binary vector
+	'''
+	n = column.size
+	changes = np.flatnonzero(column != np.roll(column, 1))
+	if(changes.size == 0): return (np.array([0]), np.array([n]))
+	lengths = np.diff(np.append(changes, changes[0] + n))
+	return (changes, lengths)
+
+def enforce_min_segment_len(demodfs: np.ndarray, min_segment_len: int) -> np.ndarray:
+	'''
+		Flip the shortest on/off segments of each binary (circular) demodulation function until every segment is at least
+		min_segment_len samples long. Flipping a segment merges it with its neighbors
+	'''
+	if(min_segment_len <= 1): return demodfs.copy()
+	## one row per demodulation function
+	columns = np.swapaxes(demodfs, -1, -2).reshape((-1, demodfs.shape[-2])).copy()
+	for column in columns:
+		(starts, lengths) = _get_runs(column)
+		while((lengths.size > 1) and (lengths.min() < min_segment_len)):
+			shortest = np.argmin(lengths)
+			column[(starts[shortest] + np.arange(lengths[shortest])) % column.size] = 1. - column[starts[shortest]]
+			(starts, lengths) = _get_runs(column)
+	return np.swapaxes(columns.reshape(demodfs.shape[:-2] + (demodfs.shape[-1], demodfs.shape[-2])), -1, -2)
+
+def lowpass_demodfs(demodfs: np.ndarray, max_freq: int) -> np.ndarray:
+	'''
+		Keep the first max_freq harmonics of each continuous demodulation function and clip it to [0, 1]
+	'''
+	if(max_freq is None): return np.clip(demodfs, 0., 1.)
+	spectrum = np.fft.rfft(demodfs, axis=-2)
+	spectrum[..., (max_freq+1):, :] = 0.
+	return np.clip(np.fft.irfft(spectrum, n=demodfs.shape[-2], axis=-2), 0., 1.)
+
+def apply_constraints(demodfs: np.ndarray, binary: bool=True, min_segment_len: int=1, max_freq: int=None) -> np.ndarray:
+	'''
+		Project demodulation functions onto the constraints. Binary functions are rounded and their short segments
+		removed. Continuous functions are low-passed and clipped
+	'''
+	if(binary): return enforce_min_segment_len(np.round(np.clip(demodfs, 0., 1.)), min_segment_len)
+	return lowpass_demodfs(demodfs, max_freq)
+
+def mutate_demodfs(demodfs: np.ndarray, n_mutations: int, rng, binary: bool=True, min_segment_len: int=1, max_freq: int=None, step: float=0.1) -> np.ndarray:
+	'''
+		n_mutations random variations of an NxK demodulation matrix that satisfy the constraints. Returns a (n_mutations, N, K) array
+		* binary: a segment of one of the functions, at least min_segment_len samples long, is set to on or off
+		* continuous: gaussian noise with std step is added to the low frequency harmonics of one of the functions
+	'''
+	(n, k) = demodfs.shape
+	mutations = np.repeat(demodfs[np.newaxis], n_mutations, axis=0)
+	columns = rng.integers(0, k, size=(n_mutations,))
+	if(binary):
+		starts = rng.integers(0, n, size=(n_mutations,))
+		## segments of min_segment_len to max(min_segment_len, n // 2) samples (both included)
+		min_len = max(1, min_segment_len)
+		lengths = rng.integers(min_len, max(min_len, n // 2) + 1, size=(n_mutations,))
+		vals = rng.integers(0, 2, size=(n_mutations,))
+		for i in range(n_mutations):
+			mutations[i, (starts[i] + np.arange(lengths[i])) % n, columns[i]] = vals[i]
+	else:
+		n_freqs = (n // 2) if(max_freq is None) else max_freq
+		coeffs = step*(rng.standard_normal((n_mutations, n_freqs + 1)) + 1j*rng.standard_normal((n_mutations, n_freqs + 1)))
+		spectrum = np.zeros((n_mutations, (n // 2) + 1), dtype=np.complex128)
+		spectrum[:, :(n_freqs + 1)] = coeffs
+		mutations[np.arange(n_mutations), :, columns] += np.fft.irfft(spectrum, n=n, axis=-1)*n / 2.
+	return apply_constraints(mutations, binary=binary, min_segment_len=min_segment_len, max_freq=max_freq)
+
+def get_initial_demodfs(k: int, n: int, rng, init: str='random', binary: bool=True, min_segment_len: int=1, max_freq: int=None) -> np.ndarray:
+	'''
+		NxK starting point of the search: random functions that satisfy the constraints, or the demodulation functions of
+		one of the itof coding schemes (e.g., 'hamilt' or 'fourier') projected onto the constraints
+	'''
+	if(init == 'random'):
+		if(binary): demodfs = (rng.random((n, k)) < 0.5).astype(np.float64)
+		else: demodfs = 0.5 + 0.5*rng.standard_normal((n, k))
+	else:
+		demodfs = generate_coding_functions(init, k, n)['demodfs']
+	return apply_constraints(demodfs, binary=binary, min_segment_len=min_segment_len, max_freq=max_freq)
+
+def optimize_demodfs(k: int, n: int, n_photons: float=1000., sbr: float=1., binary: bool=True, min_segment_len: int=1, max_freq: int=None, complementary: bool=False, mod_duty: float=None,
+	n_iters: int=200, population: int=32, n_samples: int=8, temperature: float=None, step: float=0.1, init: str='random', seed: int=0) -> dict:
+	'''
+		(1+lambda) evolutionary search of the NxK demodulation functions. Every iteration draws new noise, evaluates the
+		current best matrix together with population mutations of it, and keeps the best one.
+		Arguments:
+			* k, n: number of demodulation functions (before adding the complementary ones) and samples per period
+			* n_photons, sbr: noise model (see evaluate_demodfs)
+			* binary, min_segment_len, max_freq: constraints (see apply_constraints)
+			* complementary: also measure the negated functions (the design has 2K measurements)
+			* mod_duty: duty cycle of the modulation functions. None for perfect pulses
+			* n_iters, population: number of iterations and mutations evaluated per iteration
+			* n_samples, temperature: see evaluate_demodfs
+			* step: size of the mutations of continuous functions
+			* init: 'random' or one of the itof coding schemes
+			* seed: seed of the initialization, the mutations and the noise
+		Returns a dict with the demodfs and the error (in time bins) of the best matrix at every iteration
+	'''
+	assert(min_segment_len <= n), "min_segment_len should be at most n"
+	rng = np.random.default_rng(seed)
+	modfs = get_modfs(n, 2*k if(complementary) else k, mod_duty)
+	demodfs = get_initial_demodfs(k, n, rng, init=init, binary=binary, min_segment_len=min_segment_len, max_freq=max_freq)
+	errors = []
+	for _ in range(n_iters):
+		candidates = np.concatenate((demodfs[np.newaxis], mutate_demodfs(demodfs, population, rng, binary=binary, min_segment_len=min_segment_len, max_freq=max_freq, step=step)), axis=0)
+		candidate_errors = evaluate_demodfs(complete_demodfs(candidates, complementary), modfs, n_photons, sbr, n_samples=n_samples, seed=int(rng.integers(2**31)), temperature=temperature)
+		## ties keep the current matrix (index 0)
+		best = int(np.argmin(candidate_errors))
+		demodfs = candidates[best]
+		errors.append(float(candidate_errors[best]))
+	return {'demodfs': demodfs, 'errors': errors, 'seed': seed}
+
+def _optimize_demodfs_kwargs(kwargs):
+	return optimize_demodfs(**kwargs)
+
+def run_code_design(k: int, n: int, seeds=(0, 1, 2, 3), workers: int=None, n_validation_samples: int=64, validation_seed: int=12345, **kwargs) -> dict:
+	'''
+		Run optimize_demodfs for each seed in parallel and keep the design with the lowest error on a common validation
+		noise sample (more samples than the search, and a different seed).
+		Arguments:
+			* workers: number of worker processes. Defaults to the number of CPUs
+			* kwargs: passed to optimize_demodfs
+		Returns a dict with the modfs, demodfs and corrfs (in the itof layout) and the validation errors of every seed
+	'''
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		results = list(executor.map(_optimize_demodfs_kwargs, [dict(kwargs, k=k, n=n, seed=seed) for seed in seeds]))
+	complementary = kwargs.get('complementary', False)
+	modfs = get_modfs(n, 2*k if(complementary) else k, kwargs.get('mod_duty', None))
+	demodfs = complete_demodfs(np.stack([result['demodfs'] for result in results]), complementary)
+	validation_errors = evaluate_demodfs(demodfs, modfs, kwargs.get('n_photons', 1000.), kwargs.get('sbr', 1.), n_samples=n_validation_samples, seed=validation_seed)
+	best = int(np.argmin(validation_errors))
+	return {
+		'modfs': modfs,
+		'demodfs': demodfs[best],
+		'corrfs': compute_corrfs(modfs, demodfs[best]),
+		'seed': results[best]['seed'],
+		'validation_errors': {int(result['seed']): float(error) for (result, error) in zip(results, validation_errors)},
+		'search_errors': results[best]['errors'],
+	}
+
+def save_optimized_coding_functions(coding_functions: dict, out_dir: str=ITOF_CODING_FUNCTIONS_DIR, complementary: bool=False) -> str:
+	'''
+		Save the modfs, demodfs and corrfs of a design with the k-*_n-*_optimized naming. Returns the path of the file
+	'''
+	(n, k) = coding_functions['demodfs'].shape
+	if(complementary): k = k // 2
+	os.makedirs(out_dir, exist_ok=True)
+	fpath = os.path.join(out_dir, get_itof_coding_functions_fname(OPTIMIZED_CODING, k, n, complementary) + '.npz')
+	np.savez(fpath, **{key: coding_functions[key] for key in ['modfs', 'demodfs', 'corrfs']})
+	return fpath
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Search for iToF demodulation functions that minimize the expected depth error')
+	parser.add_argument('--k', type=int, default=4, help='number of demodulation functions (K)')
+	parser.add_argument('--n', type=int, default=64, help='number of samples per period (N)')
+	parser.add_argument('--n-photons', type=float, default=1000., help='mean signal photons per pixel')
+	parser.add_argument('--sbr', type=float, default=1., help='signal-to-background ratio')
+	parser.add_argument('--continuous', action='store_true', help='continuous demodulation functions in [0, 1] instead of binary')
+	parser.add_argument('--min-segment-len', type=int, default=1, help='min on/off segment length of binary functions')
+	parser.add_argument('--max-freq', type=int, default=None, help='max harmonic of continuous functions')
+	parser.add_argument('--complementary', action='store_true', help='also measure the negated demodulation functions')
+	parser.add_argument('--mod-duty', type=float, default=None, help='duty cycle of the modulation functions (defaults to a perfect pulse)')
+	parser.add_argument('--init', default='random', help="'random' or an itof coding scheme to start from (e.g., hamilt)")
+	parser.add_argument('--iters', type=int, default=200, help='iterations of each search')
+	parser.add_argument('--population', type=int, default=32, help='mutations evaluated per iteration')
+	parser.add_argument('--seeds', nargs='+', type=int, default=[0, 1, 2, 3], help='one search is run per seed')
+	parser.add_argument('--workers', type=int, default=None, help='number of worker processes (defaults to the number of CPUs)')
+	parser.add_argument('--out-dir', default=ITOF_CODING_FUNCTIONS_DIR, help='output directory')
+	args = parser.parse_args(argv)
+	start_time = time.perf_counter()
+	coding_functions = run_code_design(args.k, args.n, seeds=args.seeds, workers=args.workers, n_photons=args.n_photons, sbr=args.sbr,
+		binary=(not args.continuous), min_segment_len=args.min_segment_len, max_freq=args.max_freq, complementary=args.complementary,
+		mod_duty=args.mod_duty, init=args.init, n_iters=args.iters, population=args.population)
+	print("Search finished in {:.1f} s. Validation error of each seed (in time bins): {}".format(time.perf_counter() - start_time,
+		', '.join("{}: {:.3f}".format(seed, error) for (seed, error) in coding_functions['validation_errors'].items())))
+	## the hamiltonian demodulation functions with the same modulation functions as the search
+	if(args.k in HAMILTONIAN_SPECS):
+		baseline_demodfs = complete_demodfs(generate_coding_functions('hamilt', args.k, args.n)['demodfs'], args.complementary)
+		baseline_error = evaluate_demodfs(baseline_demodfs, coding_functions['modfs'], args.n_photons, args.sbr, n_samples=64, seed=12345)
+		print("Hamiltonian K = {} validation error: {:.3f}".format(args.k, baseline_error))
+	print("Saved {}".format(save_optimized_coding_functions(coding_functions, args.out_dir, args.complementary)))
+
+if __name__=='__main__':
+	main()
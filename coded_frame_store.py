@@ -0,0 +1,346 @@
+'''
+	On-disk store for long captures of (H, W, K) coded frames and their decoded depth maps.
+
+	A store is a directory with:
+	* header.json: frame shape, dtype, the coding scheme and its parameters (the same ones passed to
+	  coding_cache.get_coding_matrix), its name (k-*_n-*_scheme, like the files in itof_coding_functions/), and the
+	  number of frames of the capture and of each decoded sequence
+	* frames.bin: the frames. Either raw (memory-mapped for random access) or zlib-compressed chunks of
+	  chunk_frames frames (only the chunk of the requested frame is decompressed)
+	* decoded-<name>.bin: raw (n_frames, H, W) float32 sequences with the decoded row of the coding matrix of each pixel
+
+	Frames and decoded maps are only appended, so a capture of any length can be written, decoded, and re-decoded with
+	a different decoder as streaming passes that hold a few frames in memory at a time.
+
+	Look at the main script here to see how it is used
+'''
+## Standard Library Imports
+import os
+import json
+import zlib
+
+## Library Imports
+import numpy as np
+
+## Local Imports
+from coding_cache import get_coding_matrix, save_atomic
+from tof_utils import bin2depth
+
+STORE_VERSION = 1
+COMPRESSIONS = [None, 'zlib']
+HEADER_FNAME = 'header.json'
+FRAMES_FNAME = 'frames.bin'
+
+def get_coding_name(scheme: str, params: dict, n_codes: int, n_tbins: int) -> str:
+	'''
+		Name of a coding scheme following the itof_coding_functions/ naming (e.g., k-4_n-64_hamilt or k-16_n-1024_trunc_fourier)
+	'''
+	if(scheme == 'itof'):
+		## itof is only imported for iToF schemes (see coding_cache.load_itof_corrfs)
+		from itof import get_itof_coding_functions_fname
+		return get_itof_coding_functions_fname(**params)
+	return 'k-{}_n-{}_{}'.format(n_codes, n_tbins, scheme)
+
+def get_decoded_fname(name: str) -> str:
+	return 'decoded-{}.bin'.format(name)
+
+def _append_bytes(fpath: str, offset: int, data_list):
+	'''
+		Write data_list (a list of bytes) at offset, after dropping whatever is past offset. offset is the size the header
+		records, so the bytes of a write that was interrupted before its header was saved are overwritten instead of
+		shifting everything that is appended later. Returns the offset of each item of data_list
+	'''
+	offsets = []
+	with open(fpath, 'r+b' if(os.path.exists(fpath)) else 'wb') as f:
+		f.truncate(offset)
+		f.seek(offset)
+		for data in data_list:
+			offsets.append(f.tell())
+			f.write(data)
+	return offsets
+
+def _save_header(fpath: str, header: dict):
+	## written to a temporary file and renamed, so that readers never see a partial header
+	save_atomic(fpath, lambda f: json.dump(header, f, indent=1), mode='w')
+
+class CodedFrameStore:
+	'''
+		Append-only store of (H, W, K) coded frames. Use CodedFrameStore.create to start a new capture and
+		CodedFrameStore(path) to open an existing one. Frames are read with store[i], store[start:stop] or iter_chunks.
+		Arguments:
+			* path: directory of the store
+			* mode: 'r' to read, or 'a' to also append frames and decoded maps
+	'''
+	def __init__(self, path: str, mode: str='r'):
+		assert(mode in ['r', 'a']), "mode should be 'r' or 'a'"
+		self.path = path
+		self.mode = mode
+		with open(os.path.join(path, HEADER_FNAME), 'r') as f:
+			self.header = json.load(f)
+		assert(self.header['version'] == STORE_VERSION), "unsupported store version {}".format(self.header['version'])
+		self.frame_shape = tuple(self.header['frame_shape'])
+		self.dtype = np.dtype(self.header['dtype'])
+		self.compression = self.header['compression']
+		self.chunk_frames = self.header['chunk_frames']
+		## frames of the last compressed chunk that have not been written yet
+		self._pending = []
+		self._frames_memmap = None
+		## last decompressed chunk, so reading consecutive frames only decompresses each chunk once
+		self._cached_chunk = (None, None)
+
+	@classmethod
+	def create(cls, path: str, frame_shape, scheme: str, params: dict, dtype=np.float32, compression: str=None, chunk_frames: int=16, repetition_tau: float=None, overwrite: bool=False):
+		'''
+			Create an empty store and open it for appending.
+			Arguments:
+				* frame_shape: (H, W, K). K should match the number of codes of the coding matrix
+				* scheme, params: coding scheme and parameters passed to coding_cache.get_coding_matrix
+				  (e.g., 'itof' with {'coding': 'hamilt', 'k': 4, 'n': 64, 'complementary': False})
+				* dtype: data type of the stored frames
+				* compression: one of COMPRESSIONS. Raw frames are memory-mapped, compressed ones are stored in chunks
+				* chunk_frames: number of frames in each compressed chunk
+				* repetition_tau: duration of each laser cycle (in seconds). Needed to convert the decoded maps to meters
+				* overwrite: replace the store if it already exists. Only the files of the old store (its frames and decoded
+				  sequences) are removed, other files in path are kept
+		'''
+		assert(compression in COMPRESSIONS), "compression should be one of {}".format(COMPRESSIONS)
+		assert(len(frame_shape) == 3), "frame_shape should be (H, W, K)"
+		assert(chunk_frames >= 1), "chunk_frames should be positive"
+		header_fpath = os.path.join(path, HEADER_FNAME)
+		assert(overwrite or not os.path.exists(header_fpath)), "{} already exists".format(path)
+		C = get_coding_matrix(scheme, **params)
+		(n_tbins, n_codes) = C.shape
+		assert(frame_shape[-1] == n_codes), "frames should have the {} codes of the coding matrix".format(n_codes)
+		os.makedirs(path, exist_ok=True)
+		if(os.path.exists(header_fpath)):
+			with open(header_fpath, 'r') as f:
+				old_header = json.load(f)
+			for fname in [FRAMES_FNAME] + [get_decoded_fname(name) for name in old_header.get('decoded', {})]:
+				if(os.path.exists(os.path.join(path, fname))): os.remove(os.path.join(path, fname))
+		open(os.path.join(path, FRAMES_FNAME), 'wb').close()
+		header = {
+			'version': STORE_VERSION,
+			'frame_shape': [int(s) for s in frame_shape],
+			'dtype': np.dtype(dtype).str,
+			'compression': compression,
+			'chunk_frames': int(chunk_frames),
+			'coding': {'scheme': scheme, 'params': params, 'name': get_coding_name(scheme, params, n_codes, n_tbins), 'n_tbins': int(n_tbins)},
+			'repetition_tau': repetition_tau,
+			'n_frames': 0,
+			## (offset, nbytes, n_frames) of each compressed chunk in frames.bin
+			'chunks': [],
+			'decoded': {},
+		}
+		_save_header(header_fpath, header)
+		return cls(path, mode='a')
+
+	@property
+	def n_frames(self) -> int:
+		return self.header['n_frames']
+
+	@property
+	def coding_name(self) -> str:
+		return self.header['coding']['name']
+
+	@property
+	def n_tbins(self) -> int:
+		return self.header['coding']['n_tbins']
+
+	def __len__(self):
+		return self.n_frames
+
+	def get_coding_matrix(self) -> np.ndarray:
+		'''
+			NxK coding matrix of the capture (built or loaded through coding_cache)
+		'''
+		return get_coding_matrix(self.header['coding']['scheme'], **self.header['coding']['params'])
+
+	def _frames_fpath(self) -> str:
+		return os.path.join(self.path, FRAMES_FNAME)
+
+	def _save_header(self):
+		_save_header(os.path.join(self.path, HEADER_FNAME), self.header)
+
+	def append(self, frames: np.ndarray):
+		'''
+			Append one (H, W, K) frame or a (n_frames, H, W, K) stack of frames
+		'''
+		assert(self.mode == 'a'), "the store was opened read-only"
+		frames = np.asarray(frames, dtype=self.dtype)
+		if(frames.shape == self.frame_shape): frames = frames[np.newaxis]
+		assert(frames.shape[1:] == self.frame_shape), "frames should have shape {}".format(self.frame_shape)
+		if(self.compression is None):
+			frame_nbytes = int(np.prod(self.frame_shape))*self.dtype.itemsize
+			_append_bytes(self._frames_fpath(), self.n_frames*frame_nbytes, [np.ascontiguousarray(frames).tobytes()])
+			self.header['n_frames'] += frames.shape[0]
+			self._frames_memmap = None
+			self._save_header()
+		else:
+			self._pending.append(frames)
+			n_pending = sum(pending.shape[0] for pending in self._pending)
+			if(n_pending >= self.chunk_frames): self._write_chunks(flush=False)
+
+	def _write_chunks(self, flush: bool):
+		'''
+			Compress and write the pending frames in chunks of chunk_frames. The last partial chunk is only written if flush is True
+		'''
+		if(len(self._pending) == 0): return
+		pending = np.concatenate(self._pending, axis=0)
+		n_written = pending.shape[0] if(flush) else (pending.shape[0] // self.chunk_frames)*self.chunk_frames
+		chunks = [np.ascontiguousarray(pending[start:min(start + self.chunk_frames, n_written)]) for start in range(0, n_written, self.chunk_frames)]
+		compressed_chunks = [zlib.compress(chunk.tobytes()) for chunk in chunks]
+		## the new chunks go right after the last chunk in the header
+		end_offset = (self.header['chunks'][-1][0] + self.header['chunks'][-1][1]) if(len(self.header['chunks']) > 0) else 0
+		offsets = _append_bytes(self._frames_fpath(), end_offset, compressed_chunks)
+		for (offset, compressed, chunk) in zip(offsets, compressed_chunks, chunks):
+			self.header['chunks'].append([offset, len(compressed), chunk.shape[0]])
+		self._pending = [pending[n_written:]] if(n_written < pending.shape[0]) else []
+		self.header['n_frames'] += n_written
+		self._save_header()
+
+	def flush(self):
+		'''
+			Write the frames that are still buffered (only compressed stores buffer frames)
+		'''
+		if(self.mode == 'a'): self._write_chunks(flush=True)
+
+	def close(self):
+		self.flush()
+		self._frames_memmap = None
+		self._cached_chunk = (None, None)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def _get_memmap(self):
+		if(self._frames_memmap is None):
+			self._frames_memmap = np.memmap(self._frames_fpath(), dtype=self.dtype, mode='r', shape=(self.n_frames,) + self.frame_shape)
+		return self._frames_memmap
+
+	def _read_chunk(self, chunk_id: int) -> np.ndarray:
+		if(self._cached_chunk[0] != chunk_id):
+			(offset, nbytes, n_chunk_frames) = self.header['chunks'][chunk_id]
+			with open(self._frames_fpath(), 'rb') as f:
+				f.seek(offset)
+				chunk = np.frombuffer(zlib.decompress(f.read(nbytes)), dtype=self.dtype)
+			self._cached_chunk = (chunk_id, chunk.reshape((n_chunk_frames,) + self.frame_shape))
+		return self._cached_chunk[1]
+
+	def get_frames(self, start: int, stop: int) -> np.ndarray:
+		'''
+			Frames [start, stop) as a (stop - start, H, W, K) array. Raw stores return a read-only memory-mapped view
+		'''
+		assert((0 <= start <= stop <= self.n_frames)), "frames [{}, {}) out of range. The store has {} frames".format(start, stop, self.n_frames)
+		if(start == stop): return np.zeros((0,) + self.frame_shape, dtype=self.dtype)
+		if(self.compression is None): return self._get_memmap()[start:stop]
+		chunk_starts = np.cumsum([0] + [n_chunk_frames for (_, _, n_chunk_frames) in self.header['chunks']])
+		first_chunk = int(np.searchsorted(chunk_starts, start, side='right')) - 1
+		last_chunk = int(np.searchsorted(chunk_starts, stop, side='left')) - 1
+		frames = np.concatenate([self._read_chunk(chunk_id) for chunk_id in range(first_chunk, last_chunk + 1)], axis=0)
+		return frames[(start - chunk_starts[first_chunk]):(stop - chunk_starts[first_chunk])]
+
+	def __getitem__(self, index):
+		if(isinstance(index, slice)):
+			(start, stop, step) = index.indices(self.n_frames)
+			return self.get_frames(start, max(start, stop))[::step]
+		index = int(index)
+		if(index < 0): index += self.n_frames
+		return self.get_frames(index, index + 1)[0]
+
+	def iter_chunks(self, frames_per_chunk: int=None):
+		'''
+			Yields (start_frame, frames) for consecutive blocks of frames. Defaults to chunk_frames frames per block
+		'''
+		if(frames_per_chunk is None): frames_per_chunk = self.chunk_frames
+		for start in range(0, self.n_frames, frames_per_chunk):
+			yield (start, self.get_frames(start, min(start + frames_per_chunk, self.n_frames)))
+
+	def _decoded_fpath(self, name: str) -> str:
+		return os.path.join(self.path, get_decoded_fname(name))
+
+	def get_decoded(self, name: str) -> np.ndarray:
+		'''
+			Memory-mapped (n_decoded_frames, H, W) float32 decoded rows of the coding matrix of the decoded sequence name
+		'''
+		assert(name in self.header['decoded']), "no decoded sequence named {}. Available: {}".format(name, list(self.header['decoded'].keys()))
+		n_decoded_frames = self.header['decoded'][name]['n_frames']
+		if(n_decoded_frames == 0): return np.zeros((0,) + self.frame_shape[:-1], dtype=np.float32)
+		return np.memmap(self._decoded_fpath(name), dtype=np.float32, mode='r', shape=(n_decoded_frames,) + self.frame_shape[:-1])
+
+	def get_depths(self, name: str, start: int=0, stop: int=None) -> np.ndarray:
+		'''
+			Depth maps (in meters) of the decoded frames [start, stop) of the decoded sequence name
+		'''
+		assert(self.header['repetition_tau'] is not None), "the store was created without repetition_tau"
+		return bin2depth(self.get_decoded(name)[start:stop], self.n_tbins, self.header['repetition_tau'])
+
+	def decode(self, name: str, decode_fn, frames_per_chunk: int=None, description: str=None, overwrite: bool=False) -> np.ndarray:
+		'''
+			Streaming decoding pass. Each block of frames is decoded and appended to the decoded sequence name, so
+			re-decoding with a different decoder just writes a new sequence next to the frames.
+			Arguments:
+				* name: name of the decoded sequence (e.g., 'zncc' or 'subbin')
+				* decode_fn: function that maps a KxM matrix of coded values to M decoded rows of the coding matrix
+				  (e.g., Decoder(store.get_coding_matrix()).decode or decode_subbin)
+				* frames_per_chunk: frames decoded at a time (see iter_chunks)
+				* description: stored in the header to remember how the sequence was decoded
+				* overwrite: replace the sequence if it already exists. Otherwise only the frames that were not decoded
+				  yet are decoded (e.g., after more frames were appended, or when a previous pass was interrupted)
+			Returns the memory-mapped decoded sequence (see get_decoded)
+		'''
+		assert(self.mode == 'a'), "the store was opened read-only"
+		self.flush()
+		if(overwrite or (name not in self.header['decoded'])):
+			open(self._decoded_fpath(name), 'wb').close()
+			self.header['decoded'][name] = {'n_frames': 0, 'description': description}
+		info = self.header['decoded'][name]
+		if(frames_per_chunk is None): frames_per_chunk = self.chunk_frames
+		n_codes = self.frame_shape[-1]
+		decoded_frame_nbytes = int(np.prod(self.frame_shape[:-1]))*np.dtype(np.float32).itemsize
+		for start in range(info['n_frames'], self.n_frames, frames_per_chunk):
+			frames = self.get_frames(start, min(start + frames_per_chunk, self.n_frames))
+			decoded = np.asarray(decode_fn(frames.reshape((-1, n_codes)).T), dtype=np.float32)
+			_append_bytes(self._decoded_fpath(name), info['n_frames']*decoded_frame_nbytes, [decoded.tobytes()])
+			info['n_frames'] += frames.shape[0]
+			self._save_header()
+		return self.get_decoded(name)
+
+if __name__=='__main__':
+	import time
+	import tempfile
+	from decoding import Decoder
+	from itof import load_coding_functions
+	from evaluation import simulate_measurements
+
+	## Set parameters
+	(n_frames, height, width) = (64, 120, 160)
+	(coding, k, n) = ('hamilt', 4, 64)
+	repetition_tau = 50e-9
+	rng = np.random.default_rng(0)
+	coding_functions = load_coding_functions(coding, k, n)
+	params = {'coding': coding, 'k': k, 'n': n, 'complementary': False}
+
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		for compression in COMPRESSIONS:
+			path = os.path.join(tmp_dir, 'capture-{}'.format(compression))
+			## Capture: a plane that moves away from the camera, one frame at a time
+			start_time = time.perf_counter()
+			with CodedFrameStore.create(path, (height, width, k), 'itof', params, compression=compression, repetition_tau=repetition_tau) as store:
+				for i in range(n_frames):
+					gt_tbins = np.full((height*width,), (n*i / n_frames) % n) + rng.random((height*width,))
+					frame = simulate_measurements(coding_functions, gt_tbins, n_photons=1000, sbr=1., rng=rng).T
+					store.append(frame.reshape((height, width, k)))
+			capture_seconds = time.perf_counter() - start_time
+			## Decode and re-decode with sub-bin refinement as streaming passes
+			store = CodedFrameStore(path, mode='a')
+			decoder = Decoder(store.get_coding_matrix())
+			start_time = time.perf_counter()
+			store.decode('zncc', decoder.decode, description='Decoder.decode')
+			store.decode('subbin', decoder.decode_subbin, description='Decoder.decode_subbin')
+			decode_seconds = time.perf_counter() - start_time
+			n_bytes = sum(os.path.getsize(os.path.join(path, fname)) for fname in os.listdir(path))
+			print("{} ({} frames, compression = {}): {:.1f} MB on disk, capture {:.2f} s, 2 decoding passes {:.2f} s, frame 10 depth = {:.3f} m".format(
+				store.coding_name, len(store), compression, n_bytes / 2**20, capture_seconds, decode_seconds, store.get_depths('subbin', 10, 11).mean()))
@@ -0,0 +1,208 @@
+'''
+	Cached access to coding matrices.
+
+	get_coding_matrix(scheme, **params) builds a coding matrix once per machine and reuses it afterwards:
+	* An in-process LRU cache keeps recently used matrices up to a byte budget
+	* An on-disk store keeps every matrix as a .npy file named by the hash of its scheme and parameters
+	* Matrices loaded from disk are memory-mapped, so only the rows that are used get paged in
+
+	The store lives in ~/.cache/tof_coding unless the TOF_CODING_CACHE_DIR environment variable is set.
+'''
+## Standard Library Imports
+import os
+import json
+import hashlib
+import collections
+
+## Library Imports
+import numpy as np
+
+## Local Imports
+from coding_gray import generate_gray_coding_matrix, generate_zero_mean_gray_coding_matrix, generate_n_tbins_gray_coding_matrix, generate_n_tbins_zero_mean_gray_coding_matrix
+from coding_trunc_fourier import generate_trunc_fourier_coding_matrix
+
+## Bump this when a builder changes its output so that old files in the store are not used
+CACHE_VERSION = 1
+DEFAULT_MEMORY_BUDGET = 2**30
+
+def load_itof_corrfs(coding: str, k: int, n: int, complementary: bool=False) -> np.ndarray:
+	'''
+		NxK correlation functions for one of the iToF coding schemes. They are loaded from itof_coding_functions/ if they
+		are there, and generated otherwise
+	'''
+	## itof is only imported when the iToF matrices are used, so that decoding (which uses LRUCache) does not load it
+	from itof import generate_coding_functions
+	fpath = get_itof_corrfs_fpath(coding, k, n, complementary)
+	if(os.path.exists(fpath)): return np.load(fpath)['corrfs']
+	return generate_coding_functions(coding, k, n, complementary)['corrfs']
+
+def get_itof_corrfs_fpath(coding: str, k: int, n: int, complementary: bool=False) -> str:
+	from itof import ITOF_CODING_FUNCTIONS_DIR, get_itof_coding_functions_fname
+	return os.path.join(ITOF_CODING_FUNCTIONS_DIR, get_itof_coding_functions_fname(coding, k, n, complementary) + '.npz')
+
+## Functions that build each coding matrix from its parameters
+CODING_MATRIX_BUILDERS = {
+	'gray': generate_gray_coding_matrix,
+	'zero_mean_gray': generate_zero_mean_gray_coding_matrix,
+	'n_tbins_gray': generate_n_tbins_gray_coding_matrix,
+	'n_tbins_zero_mean_gray': generate_n_tbins_zero_mean_gray_coding_matrix,
+	'trunc_fourier': generate_trunc_fourier_coding_matrix,
+	'itof': load_itof_corrfs,
+}
+## Functions that return the path of the file a builder reads its matrix from (if any). The size and modification time
+## of that file are part of the cache key, so that regenerating the file invalidates the cached matrix
+CODING_MATRIX_SOURCES = {
+	'itof': get_itof_corrfs_fpath,
+}
+
+def register_coding_scheme(scheme: str, builder, source_fn=None):
+	'''
+		Add a new coding scheme. builder(**params) should return the coding matrix as a numpy array.
+		If the builder reads the matrix from a file, source_fn(**params) should return the path of that file
+	'''
+	CODING_MATRIX_BUILDERS[scheme] = builder
+	if(source_fn is not None): CODING_MATRIX_SOURCES[scheme] = source_fn
+	else: CODING_MATRIX_SOURCES.pop(scheme, None)
+
+def _to_builtin(value):
+	'''
+		Convert numpy scalars, dtypes and arrays (also inside lists, tuples and dicts) to plain python values, so that
+		e.g. np.int64(10) and 10 give the same cache key
+	'''
+	if(isinstance(value, np.generic)): return value.item()
+	if(isinstance(value, np.ndarray)): return value.tolist()
+	if(isinstance(value, np.dtype) or (isinstance(value, type) and issubclass(value, np.generic))): return np.dtype(value).str
+	if(isinstance(value, (list, tuple))): return [_to_builtin(v) for v in value]
+	if(isinstance(value, dict)): return {str(k): _to_builtin(v) for (k, v) in value.items()}
+	return value
+
+def normalize_params(scheme: str, params: dict) -> dict:
+	'''
+		Parameters of a coding matrix as plain python values, with the defaults of the builder filled in. Calls that
+		build the same matrix (e.g., with and without a default argument) get the same parameters
+	'''
+	## inspect is slow to import, so it is only imported when a coding matrix is requested
+	import inspect
+	bound = inspect.signature(CODING_MATRIX_BUILDERS[scheme]).bind(**params)
+	bound.apply_defaults()
+	params = _to_builtin(dict(bound.arguments))
+	source_fn = CODING_MATRIX_SOURCES.get(scheme)
+	if(source_fn is not None):
+		fpath = source_fn(**params)
+		if(os.path.exists(fpath)):
+			file_stats = os.stat(fpath)
+			params['_source'] = {'fpath': os.path.abspath(fpath), 'size': file_stats.st_size, 'mtime_ns': file_stats.st_mtime_ns}
+	return params
+
+def get_cache_key(scheme: str, params: dict) -> str:
+	'''
+		Content address of a coding matrix. Two calls with the same scheme and parameters get the same key
+	'''
+	description = json.dumps({'version': CACHE_VERSION, 'scheme': scheme, 'params': params}, sort_keys=True, default=str)
+	return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+def get_cache_dir() -> str:
+	return os.environ.get('TOF_CODING_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'tof_coding'))
+
+class LRUCache:
+	'''
+		Least recently used cache of numpy arrays that evicts old entries when the total bytes go over max_bytes
+	'''
+	def __init__(self, max_bytes: int=DEFAULT_MEMORY_BUDGET):
+		self.max_bytes = max_bytes
+		self.n_bytes = 0
+		self.entries = collections.OrderedDict()
+
+	def get(self, key):
+		if(key not in self.entries): return None
+		self.entries.move_to_end(key)
+		return self.entries[key]
+
+	def put(self, key, arr: np.ndarray):
+		if(key in self.entries): self.n_bytes -= self.entries.pop(key).nbytes
+		## arrays larger than the whole budget are not cached
+		if(arr.nbytes > self.max_bytes): return
+		self.entries[key] = arr
+		self.n_bytes += arr.nbytes
+		self.evict()
+
+	def evict(self):
+		while(self.n_bytes > self.max_bytes):
+			(_, arr) = self.entries.popitem(last=False)
+			self.n_bytes -= arr.nbytes
+
+	def clear(self):
+		self.entries.clear()
+		self.n_bytes = 0
+
+_memory_cache = LRUCache()
+
+def set_memory_budget(max_bytes: int):
+	'''
+		Change the byte budget of the in-process cache
+	'''
+	_memory_cache.max_bytes = max_bytes
+	_memory_cache.evict()
+
+def clear_memory_cache():
+	_memory_cache.clear()
+
+def save_atomic(fpath: str, write_fn, mode: str='wb'):
+	'''
+		Write to a temporary file in the same folder and rename it, so that concurrent processes never read a partial file.
+		Arguments:
+			* fpath: final path of the file
+			* write_fn: function that writes the contents to the open file object it gets (e.g., lambda f: np.save(f, arr))
+			* mode: 'wb' for binary files or 'w' for text files
+	'''
+	## tempfile is slow to import and only needed when a file is written
+	import tempfile
+	(fd, tmp_fpath) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fpath)), prefix=os.path.basename(fpath) + '.', suffix='.tmp')
+	try:
+		with os.fdopen(fd, mode) as f:
+			write_fn(f)
+		os.replace(tmp_fpath, fpath)
+	except BaseException:
+		if(os.path.exists(tmp_fpath)): os.remove(tmp_fpath)
+		raise
+
+def get_coding_matrix(scheme: str, use_disk_cache: bool=True, mmap: bool=True, **params) -> np.ndarray:
+	'''
+		Returns the coding matrix for the given scheme and parameters. It is only built if it is not in memory or on disk.
+		The returned array is read-only because it is shared by every caller.
+		Arguments:
+			* scheme: one of the keys of CODING_MATRIX_BUILDERS (e.g., 'gray', 'trunc_fourier', 'itof')
+			* use_disk_cache: look for (and save) the matrix in the on-disk store
+			* mmap: memory-map the matrices loaded from disk instead of reading them into memory
+			* params: keyword arguments passed to the builder (e.g., k_bits=10 for gray). numpy scalars are the same as
+			  python ones, and missing arguments are the same as their defaults. For schemes that read a file (e.g.,
+			  'itof'), the size and modification time of the file are part of the key
+		Example:
+			get_coding_matrix('trunc_fourier', domain_len=1024, n_freqs=4, include_zeroth_harmonic=False)
+	'''
+	assert(scheme in CODING_MATRIX_BUILDERS), "unknown coding scheme {}. Available: {}".format(scheme, list(CODING_MATRIX_BUILDERS.keys()))
+	key = get_cache_key(scheme, normalize_params(scheme, params))
+	C = _memory_cache.get(key)
+	if(C is not None): return C
+	fpath = os.path.join(get_cache_dir(), key + '.npy')
+	if(use_disk_cache and os.path.exists(fpath)):
+		C = np.load(fpath, mmap_mode=('r' if mmap else None))
+	else:
+		C = np.asarray(CODING_MATRIX_BUILDERS[scheme](**params))
+		if(use_disk_cache):
+			os.makedirs(os.path.dirname(fpath), exist_ok=True)
+			save_atomic(fpath, lambda f: np.save(f, C))
+			if(mmap): C = np.load(fpath, mmap_mode='r')
+	C.flags.writeable = False
+	_memory_cache.put(key, C)
+	return C
+
+if __name__=='__main__':
+	import time
+
+	for i in range(3):
+		start_time = time.perf_counter()
+		C = get_coding_matrix('gray', k_bits=20)
+		print("Call {}: got {} gray coding matrix in {:.4f} seconds".format(i, C.shape, time.perf_counter() - start_time))
+		## The second call hits the in-process cache, the third one the on-disk store
+		if(i == 1): clear_memory_cache()
@@ -6,11 +6,10 @@
 	Look at the main script here to see how these functions are used
 '''
 ## Standard Library Imports
+import math
 
 ## Library Imports
 import numpy as np
-from IPython.core import debugger
-breakpoint = debugger.set_trace
 
 ## Local Imports
 
@@ -62,20 +61,98 @@ def uint_to_zero_mean_gray_code(nonneg_int: int, gray_code_len: int) -> np.array
 	'''
 	return make_zero_mean(uint_to_gray_code(nonneg_int, gray_code_len))
 
+def uint_to_gray_code_batch(tstamps: np.ndarray, gray_code_len: int, dtype=np.float32) -> np.ndarray:
+	'''
+		Vectorized version of uint_to_gray_code. Encodes an array of timestamps at once using bit shifts and masks.
+		Arguments:
+			* tstamps: array of non-negative integers of any shape
+			* gray_code_len: Max length of the gray code we want
+			* dtype: output data type (e.g., np.float32 or np.int8)
+		Returns:
+			* gray_codes: (..., gray_code_len) array of binary numbers. The last dimension is ordered from MSB to LSB like uint_to_gray_code
+	'''
+	tstamps = np.asarray(tstamps)
+	## Validate inputs
+	assert(np.issubdtype(tstamps.dtype, np.integer)), "input should be an integer array"
+	assert((gray_code_len >= 1) and (gray_code_len <= 63)), "gray_code_len should be between 1 and 63"
+	if(tstamps.size > 0):
+		assert(tstamps.min() >= 0), "input should be non-negative"
+		assert(tstamps.max() < 2**gray_code_len), "can't represent {} with a {}-bit gray code".format(tstamps.max(), gray_code_len)
+	tstamps = tstamps.astype(np.uint64, copy=False)
+	gray_uints = tstamps ^ (tstamps >> np.uint64(1))
+	## Shift each bit into the LSB position and mask it
+	shifts = np.arange(gray_code_len-1, -1, -1, dtype=np.uint64)
+	gray_codes = (gray_uints[..., np.newaxis] >> shifts) & np.uint64(1)
+	return gray_codes.astype(dtype)
+
+def uint_to_zero_mean_gray_code_batch(tstamps: np.ndarray, gray_code_len: int, dtype=np.float32) -> np.ndarray:
+	'''
+		Vectorized version of uint_to_zero_mean_gray_code (i.e., 0's are replaced by -1)
+	'''
+	assert(not np.issubdtype(dtype, np.unsignedinteger)), "zero-mean gray codes need a signed dtype"
+	return make_zero_mean(uint_to_gray_code_batch(tstamps, gray_code_len, dtype=dtype))
+
+def gray_to_uint_batch(gray_uints: np.ndarray) -> np.ndarray:
+	'''
+		Inverse of uint_to_gray for an array of gray codes stored as integers.
+		Computes the prefix XOR of all the higher bits with log2(n_bits) shift and XOR steps
+	'''
+	nonneg_ints = np.array(gray_uints, dtype=np.uint64)
+	shift = 1
+	while(shift < 64):
+		nonneg_ints ^= (nonneg_ints >> np.uint64(shift))
+		shift *= 2
+	return nonneg_ints
+
+def get_packed_uint_dtype(n_bits: int) -> np.dtype:
+	'''
+		Smallest unsigned integer type with at least n_bits bits
+	'''
+	assert((n_bits >= 1) and (n_bits <= 64)), "n_bits should be between 1 and 64"
+	for dtype in [np.uint8, np.uint16, np.uint32, np.uint64]:
+		if(n_bits <= 8*np.dtype(dtype).itemsize): return np.dtype(dtype)
+
+def pack_code_bits(codes: np.ndarray) -> np.ndarray:
+	'''
+		Pack binary codes into unsigned integer bitfields.
+		Arguments:
+			* codes: (..., n_bits) array of binary numbers (0/1 or booleans) ordered from MSB to LSB (like uint_to_gray_code_batch)
+		Returns:
+			* packed_codes: (...) array of the smallest unsigned type that holds n_bits bits (see get_packed_uint_dtype)
+	'''
+	n_bits = codes.shape[-1]
+	shifts = np.arange(n_bits-1, -1, -1, dtype=np.uint64)
+	packed_codes = np.bitwise_or.reduce(codes.astype(np.uint64) << shifts, axis=-1)
+	return packed_codes.astype(get_packed_uint_dtype(n_bits))
+
+def gray_code_to_uint_batch(gray_codes: np.ndarray) -> np.ndarray:
+	'''
+		Inverse of uint_to_gray_code_batch.
+		Arguments:
+			* gray_codes: (..., gray_code_len) array of binary numbers (0/1 or booleans) ordered from MSB to LSB
+		Returns:
+			* nonneg_ints: (...) array of the integers that the gray codes encode
+	'''
+	assert(gray_codes.shape[-1] <= 63), "gray_code_len should be smaller than 64"
+	return gray_to_uint_batch(pack_code_bits(gray_codes))
+
 def generate_gray_coding_matrix(k_bits: int) -> np.array:
 	'''
 		Generates all possible k_bits gray codes (binary reflected mode)
 	'''
 	assert(k_bits >= 1), "invalid k_bits"
 	assert(np.issubdtype(type(k_bits), np.integer)), "k_bits shoudl be an integer"
-	## Number of possible binary values for gray a gray code with k_bits
-	n_binary_codes = int(np.power(2, k_bits))
-	## Allocate matrix for codes
-	codes = np.zeros((n_binary_codes, k_bits))
-	## generate a gray code for each possible code
-	for i in range(n_binary_codes):
-		codes[i, :] = uint_to_gray_code(i, gray_code_len=k_bits)
-	return codes
+	## Encode all possible values for a gray code with k_bits at once
+	return uint_to_gray_code_batch(np.arange(0, 2**k_bits), gray_code_len=k_bits, dtype=np.float64)
+
+def generate_packed_gray_coding_matrix(k_bits: int) -> np.array:
+	'''
+		Same codes as generate_gray_coding_matrix but each row is stored as a k_bits bitfield (MSB is the first column)
+		in the smallest unsigned type, instead of k_bits float64 values. Use it with decoding.hamming_decoding
+	'''
+	assert((k_bits >= 1) and (k_bits <= 63)), "k_bits should be between 1 and 63"
+	nonneg_ints = np.arange(0, 2**k_bits, dtype=np.uint64)
+	return (nonneg_ints ^ (nonneg_ints >> np.uint64(1))).astype(get_packed_uint_dtype(k_bits))
 
 def generate_zero_mean_gray_coding_matrix(k_bits: int) -> np.array:
 	'''
@@ -83,6 +160,73 @@ def generate_zero_mean_gray_coding_matrix(k_bits: int) -> np.array:
 	'''
 	return make_zero_mean(generate_gray_coding_matrix(k_bits))
 
+## Gray codes for any number of time bins n_tbins use K = ceil(log2(n_tbins)) bits and a window of n_tbins consecutive
+## codes of the K-bit (binary reflected) gray code sequence, so neighboring time bins still differ in a single bit:
+## * balanced: the window is centered in the sequence, which balances the MSB. Because the sequence is reflected around
+##   its center, the lower bits of the window are symmetric, and for even n_tbins the last and first codes differ in a
+##   single bit (i.e., the code is cyclic like the power of 2 ones)
+## * truncated: the first n_tbins codes of the sequence
+## For powers of 2 both modes are the same as the regular gray codes
+GRAY_CODE_MODES = ['balanced', 'truncated']
+
+def get_gray_code_len(n_tbins: int) -> int:
+	'''
+		Number of bits of the gray codes for n_tbins time bins
+	'''
+	assert(n_tbins >= 2), "need at least 2 time bins"
+	return int(math.ceil(math.log2(n_tbins)))
+
+def get_gray_code_offset(n_tbins: int, mode: str='balanced') -> int:
+	'''
+		Position in the gray code sequence of the code used for time bin 0
+	'''
+	assert(mode in GRAY_CODE_MODES), "mode should be one of {}".format(GRAY_CODE_MODES)
+	if(mode == 'truncated'): return 0
+	return (2**get_gray_code_len(n_tbins) - n_tbins) // 2
+
+def tbin_to_gray_code_batch(tbins: np.ndarray, n_tbins: int, mode: str='balanced', dtype=np.float32) -> np.ndarray:
+	'''
+		Gray codes for time bins in [0, n_tbins), for any n_tbins (see GRAY_CODE_MODES).
+		Arguments:
+			* tbins: array of non-negative integers of any shape. Each should be smaller than n_tbins
+			* n_tbins: number of time bins
+			* mode: one of GRAY_CODE_MODES
+			* dtype: output data type
+		Returns:
+			* gray_codes: (..., ceil(log2(n_tbins))) array of binary numbers ordered from MSB to LSB
+	'''
+	tbins = np.asarray(tbins)
+	assert(np.issubdtype(tbins.dtype, np.integer)), "input should be an integer array"
+	if(tbins.size > 0): assert(tbins.max() < n_tbins), "input should be smaller than n_tbins"
+	return uint_to_gray_code_batch(tbins + get_gray_code_offset(n_tbins, mode), get_gray_code_len(n_tbins), dtype=dtype)
+
+def tbin_to_zero_mean_gray_code_batch(tbins: np.ndarray, n_tbins: int, mode: str='balanced', dtype=np.float32) -> np.ndarray:
+	'''
+		Same as tbin_to_gray_code_batch but 0's are replaced by -1
+	'''
+	assert(not np.issubdtype(dtype, np.unsignedinteger)), "zero-mean gray codes need a signed dtype"
+	return make_zero_mean(tbin_to_gray_code_batch(tbins, n_tbins, mode=mode, dtype=dtype))
+
+def gray_code_to_tbin_batch(gray_codes: np.ndarray, n_tbins: int, mode: str='balanced') -> np.ndarray:
+	'''
+		Inverse of tbin_to_gray_code_batch. Codes that are not used by any time bin are mapped to the closest end of [0, n_tbins)
+	'''
+	assert(gray_codes.shape[-1] == get_gray_code_len(n_tbins)), "gray codes for {} time bins have {} bits".format(n_tbins, get_gray_code_len(n_tbins))
+	tbins = gray_code_to_uint_batch(gray_codes).astype(np.int64) - get_gray_code_offset(n_tbins, mode)
+	return np.clip(tbins, 0, n_tbins - 1)
+
+def generate_n_tbins_gray_coding_matrix(n_tbins: int, mode: str='balanced') -> np.array:
+	'''
+		Generates the n_tbins x ceil(log2(n_tbins)) gray coding matrix for any n_tbins (see GRAY_CODE_MODES)
+	'''
+	return tbin_to_gray_code_batch(np.arange(0, n_tbins), n_tbins, mode=mode, dtype=np.float64)
+
+def generate_n_tbins_zero_mean_gray_coding_matrix(n_tbins: int, mode: str='balanced') -> np.array:
+	'''
+		Same as generate_n_tbins_gray_coding_matrix but 0's are replaced by -1
+	'''
+	return make_zero_mean(generate_n_tbins_gray_coding_matrix(n_tbins, mode=mode))
+
 if __name__=='__main__':
 	import matplotlib.pyplot as plt
 
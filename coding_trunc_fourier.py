@@ -6,6 +6,7 @@
 	Look at the main script here to see how these functions are used
 '''
 ## Standard Library Imports
+import functools
 
 ## Library Imports
 import numpy as np
@@ -22,24 +23,81 @@ def uint_to_trunc_fourier_code(nonneg_int: int, domain_len: int, n_freqs: int, i
 	## allocate fourier code
 	fourier_code_len = 2*n_freqs 
 	fourier_code = np.zeros((fourier_code_len,))
-	if(include_zeroth_harmonic): freqs = np.arange(0, n_freqs)
-	else: freqs = np.arange(1, n_freqs+1)
+	freqs = get_trunc_fourier_freqs(n_freqs, include_zeroth_harmonic)
 	## Query sinusoid for each frequency
 	fourier_code[0::2] = np.cos(freqs*bounded_int)
 	fourier_code[1::2] = -1*np.sin(freqs*bounded_int)
 	return fourier_code
 
+def get_trunc_fourier_freqs(n_freqs: int, include_zeroth_harmonic: bool=False) -> np.array:
+	'''
+		Frequencies (in cycles per domain length) used by the truncated fourier codes
+	'''
+	if(include_zeroth_harmonic): return np.arange(0, n_freqs)
+	else: return np.arange(1, n_freqs+1)
+
+def get_cos_sin_table(domain_len: int, dtype=np.float32):
+	'''
+		Precomputes cos and -sin for one period sampled at domain_len points.
+		If dtype is an integer type the values are scaled by the max value of that type and rounded.
+		The tables are memoized per (domain_len, dtype), so encoding many small chunks only builds them once.
+		Arguments:
+			* domain_len: number of samples in one period
+			* dtype: output data type of the tables
+		Returns:
+			* (cos_table, neg_sin_table): each a read-only (domain_len,) array
+	'''
+	return _get_cos_sin_table(int(domain_len), np.dtype(dtype))
+
+@functools.lru_cache(maxsize=16)
+def _get_cos_sin_table(domain_len, dtype):
+	phases = 2*np.pi*np.arange(0, domain_len) / float(domain_len)
+	cos_table = np.cos(phases)
+	neg_sin_table = -1*np.sin(phases)
+	if(np.issubdtype(dtype, np.integer)):
+		scale = np.iinfo(dtype).max
+		cos_table = np.round(scale*cos_table)
+		neg_sin_table = np.round(scale*neg_sin_table)
+	(cos_table, neg_sin_table) = (cos_table.astype(dtype), neg_sin_table.astype(dtype))
+	## shared by every caller
+	cos_table.flags.writeable = False
+	neg_sin_table.flags.writeable = False
+	return (cos_table, neg_sin_table)
+
+def uint_to_trunc_fourier_code_batch(tstamps: np.ndarray, domain_len: int, n_freqs: int, include_zeroth_harmonic: bool=False, dtype=np.float32) -> np.ndarray:
+	'''
+		Vectorized version of uint_to_trunc_fourier_code. Instead of evaluating cos/sin per timestamp, it uses a precomputed table
+		over one period and looks up the index (freq*tstamp) mod domain_len for each frequency.
+		Arguments:
+			* tstamps: array of non-negative integers of any shape. Each should be smaller than domain_len
+			* domain_len: number of time bins
+			* n_freqs: number of frequencies in the code
+			* include_zeroth_harmonic: if true the frequencies are 0,...,n_freqs-1, else 1,...,n_freqs
+			* dtype: output data type. For integer types (e.g., np.int8) the codes are scaled by the max value of the type
+		Returns:
+			* fourier_codes: (..., 2*n_freqs) array with the interleaved [cos, -sin] values for each frequency
+	'''
+	tstamps = np.asarray(tstamps)
+	## Validate inputs
+	assert(np.issubdtype(tstamps.dtype, np.integer)), "input should be an integer array"
+	if(tstamps.size > 0):
+		assert(tstamps.min() >= 0), "input should be non-negative"
+		assert(tstamps.max() < domain_len), "input should be smaller than the domain length"
+	(cos_table, neg_sin_table) = get_cos_sin_table(domain_len, dtype=dtype)
+	freqs = get_trunc_fourier_freqs(n_freqs, include_zeroth_harmonic)
+	## index into the table for each timestamp and frequency
+	table_indeces = (tstamps.astype(np.int64, copy=False)[..., np.newaxis]*freqs) % domain_len
+	fourier_codes = np.empty(tstamps.shape + (2*n_freqs,), dtype=dtype)
+	fourier_codes[..., 0::2] = cos_table[table_indeces]
+	fourier_codes[..., 1::2] = neg_sin_table[table_indeces]
+	return fourier_codes
+
 def generate_trunc_fourier_coding_matrix(domain_len: int, n_freqs: int, include_zeroth_harmonic: bool=False) -> np.array:
 	'''
 		Generates a truncated fourier matrix of size domain_len x n_freqs*2 
 	'''
-	## Allocate matrix for codes
-	fourier_code_len = 2*n_freqs
-	fourier_codes = np.zeros((domain_len, fourier_code_len))
-	## generate a gray code for each possible code
-	for i in range(domain_len):
-		fourier_codes[i,:] = uint_to_trunc_fourier_code(i, domain_len, n_freqs, include_zeroth_harmonic)
-	return fourier_codes
+	## Encode all time bins at once
+	return uint_to_trunc_fourier_code_batch(np.arange(0, domain_len), domain_len, n_freqs, include_zeroth_harmonic, dtype=np.float64)
 
 
 if __name__=='__main__':
@@ -0,0 +1,198 @@
+'''
+	Compressive histograms: accumulate SPAD timestamps directly into coded values.
+
+	Instead of building a histogram with n_tbins bins per pixel, each timestamp is encoded with a K-dimensional code
+	(see coding_gray.py and coding_trunc_fourier.py) and added to a (n_pixels, K) coded sum.
+
+	Look at the main script here to see how it is used
+'''
+## Standard Library Imports
+
+## Library Imports
+import numpy as np
+
+## Local Imports
+from coding_gray import tbin_to_zero_mean_gray_code_batch, tbin_to_gray_code_batch, get_gray_code_len, GRAY_CODE_MODES
+from coding_trunc_fourier import uint_to_trunc_fourier_code_batch
+from coding_cache import get_coding_matrix
+
+CODING_SCHEMES = ['gray', 'zero_mean_gray', 'trunc_fourier']
+
+class CompressiveHistogram:
+	'''
+		Stores the coded sum of all the timestamps seen by each pixel.
+		Arguments:
+			* n_pixels: number of pixels
+			* n_tbins: number of time bins. Timestamps should be integers in [0, n_tbins). Gray codes work with any n_tbins
+			  (see coding_gray.tbin_to_gray_code_batch)
+			* coding_scheme: one of CODING_SCHEMES
+			* n_freqs: number of frequencies. Only used by the trunc_fourier scheme
+			* include_zeroth_harmonic: only used by the trunc_fourier scheme
+			* gray_mode: one of coding_gray.GRAY_CODE_MODES. Only used by the gray schemes when n_tbins is not a power of 2
+			* dtype: data type of the coded sums (e.g., np.float32, np.float16 or np.int32)
+			* code_dtype: data type of the codes of each timestamp. Defaults to dtype. With an integer type the gray codes are
+			  exact (0/1 or +-1) and the fourier codes are quantized to [-max, max] of that type (see get_cos_sin_table).
+			  Integer codes need an integer (or float) dtype with enough range for the number of photons of each pixel
+	'''
+	def __init__(self, n_pixels: int, n_tbins: int, coding_scheme: str='zero_mean_gray', n_freqs: int=None, include_zeroth_harmonic: bool=False, dtype=np.float32, code_dtype=None, gray_mode: str='balanced'):
+		assert(coding_scheme in CODING_SCHEMES), "coding_scheme should be one of {}".format(CODING_SCHEMES)
+		assert(n_pixels >= 1), "invalid n_pixels"
+		self.n_pixels = n_pixels
+		self.n_tbins = n_tbins
+		self.coding_scheme = coding_scheme
+		self.include_zeroth_harmonic = include_zeroth_harmonic
+		self.dtype = np.dtype(dtype)
+		self.code_dtype = self.dtype if(code_dtype is None) else np.dtype(code_dtype)
+		if(np.issubdtype(self.dtype, np.integer)):
+			assert(np.issubdtype(self.code_dtype, np.integer)), "integer coded sums need integer codes"
+		self.gray_mode = gray_mode
+		if('gray' in coding_scheme):
+			assert(gray_mode in GRAY_CODE_MODES), "gray_mode should be one of {}".format(GRAY_CODE_MODES)
+			self.n_codes = get_gray_code_len(n_tbins)
+			self.n_freqs = None
+		else:
+			assert(n_freqs is not None), "n_freqs is needed for trunc_fourier coding"
+			self.n_freqs = n_freqs
+			self.n_codes = 2*n_freqs
+		self.coded_hist = np.zeros((n_pixels, self.n_codes), dtype=self.dtype)
+		self.n_photons = np.zeros((n_pixels,), dtype=np.int64)
+
+	def encode(self, tstamps: np.ndarray) -> np.ndarray:
+		'''
+			Encode an array of timestamps with this histogram's coding scheme. Returns a (..., n_codes) array
+		'''
+		if(self.coding_scheme == 'gray'):
+			return tbin_to_gray_code_batch(tstamps, self.n_tbins, mode=self.gray_mode, dtype=self.code_dtype)
+		elif(self.coding_scheme == 'zero_mean_gray'):
+			return tbin_to_zero_mean_gray_code_batch(tstamps, self.n_tbins, mode=self.gray_mode, dtype=self.code_dtype)
+		else:
+			return uint_to_trunc_fourier_code_batch(tstamps, self.n_tbins, self.n_freqs, self.include_zeroth_harmonic, dtype=self.code_dtype)
+
+	@property
+	def code_scale(self) -> float:
+		'''
+			Ratio between the stored codes and the float codes (the max value of code_dtype for integer fourier codes, else 1)
+		'''
+		if((self.coding_scheme == 'trunc_fourier') and np.issubdtype(self.code_dtype, np.integer)):
+			return float(np.iinfo(self.code_dtype).max)
+		return 1.
+
+	def get_coding_matrix(self, quantized: bool=False) -> np.ndarray:
+		'''
+			Returns the (n_tbins, n_codes) coding matrix that matches the codes accumulated here. Use it for decoding.
+			If quantized is True the matrix is made of the code_dtype codes that were actually accumulated, which removes
+			the mismatch between the quantized codes and the float64 matrix
+		'''
+		if(quantized): return self.encode(np.arange(0, self.n_tbins))
+		if(('gray' in self.coding_scheme) and (2**self.n_codes == self.n_tbins)):
+			return get_coding_matrix(self.coding_scheme, k_bits=self.n_codes)
+		elif('gray' in self.coding_scheme):
+			return get_coding_matrix('n_tbins_' + self.coding_scheme, n_tbins=self.n_tbins, mode=self.gray_mode)
+		else:
+			return get_coding_matrix(self.coding_scheme, domain_len=self.n_tbins, n_freqs=self.n_freqs, include_zeroth_harmonic=self.include_zeroth_harmonic)
+
+	def update(self, pixel_ids: np.ndarray, tstamps: np.ndarray):
+		'''
+			Encode a chunk of timestamps and add them to the coded sum of their pixels.
+			Arguments:
+				* pixel_ids: array with the pixel index of each timestamp
+				* tstamps: array of timestamps with the same shape as pixel_ids
+		'''
+		self.update_codes(pixel_ids, self.encode(tstamps))
+
+	def update_codes(self, pixel_ids: np.ndarray, codes: np.ndarray):
+		'''
+			Add already encoded timestamps to the coded sum of their pixels.
+			Arguments:
+				* pixel_ids: array with the pixel index of each code
+				* codes: (..., n_codes) array of codes
+		'''
+		pixel_ids = np.asarray(pixel_ids).ravel()
+		codes = codes.reshape((-1, self.n_codes))
+		assert(pixel_ids.shape[0] == codes.shape[0]), "need one pixel id per timestamp"
+		if(pixel_ids.size == 0): return
+		assert((pixel_ids.min() >= 0) and (pixel_ids.max() < self.n_pixels)), "pixel ids out of range"
+		n_photons = self.n_photons + np.bincount(pixel_ids, minlength=self.n_pixels)
+		self._check_overflow(n_photons)
+		self.n_photons = n_photons
+		## bincount is much faster than np.add.at for scattered adds. Its float64 sums are exact for integer codes
+		for i in range(self.n_codes):
+			self.coded_hist[:, i] += np.bincount(pixel_ids, weights=codes[:, i], minlength=self.n_pixels).astype(self.dtype)
+
+	def remove_codes(self, pixel_ids: np.ndarray, codes: np.ndarray):
+		'''
+			Subtract codes that were added with update_codes (e.g., when they leave a sliding window).
+			The sums are exact with integer codes. With float codes the rounding errors of the adds and subtracts can build up
+			Arguments:
+				* pixel_ids: array with the pixel index of each code
+				* codes: (..., n_codes) array of codes
+		'''
+		pixel_ids = np.asarray(pixel_ids).ravel()
+		codes = codes.reshape((-1, self.n_codes))
+		assert(pixel_ids.shape[0] == codes.shape[0]), "need one pixel id per timestamp"
+		if(pixel_ids.size == 0): return
+		n_photons = self.n_photons - np.bincount(pixel_ids, minlength=self.n_pixels)
+		assert(n_photons.min() >= 0), "removing more photons than were added"
+		self.n_photons = n_photons
+		for i in range(self.n_codes):
+			self.coded_hist[:, i] -= np.bincount(pixel_ids, weights=codes[:, i], minlength=self.n_pixels).astype(self.dtype)
+
+	def _check_overflow(self, n_photons):
+		'''
+			Integer coded sums are bounded by the number of photons of a pixel times the largest code (code_scale)
+		'''
+		if(np.issubdtype(self.dtype, np.integer)):
+			assert((int(n_photons.max())*self.code_scale) <= np.iinfo(self.dtype).max), "{} coded sums can overflow. Use a wider dtype or a narrower code_dtype".format(self.dtype.name)
+
+	def is_compatible(self, other) -> bool:
+		return (self.n_pixels == other.n_pixels) and (self.n_tbins == other.n_tbins) and (self.coding_scheme == other.coding_scheme) \
+			and (self.n_freqs == other.n_freqs) and (self.include_zeroth_harmonic == other.include_zeroth_harmonic) and (self.code_scale == other.code_scale) \
+			and (self.gray_mode == other.gray_mode)
+
+	def merge(self, other):
+		'''
+			Add the coded sums of another CompressiveHistogram (e.g., built by a different worker) to this one
+		'''
+		assert(self.is_compatible(other)), "can only merge histograms with the same pixels and coding scheme"
+		self._check_overflow(self.n_photons + other.n_photons)
+		self.coded_hist += other.coded_hist.astype(self.dtype)
+		self.n_photons += other.n_photons
+		return self
+
+	def reset(self):
+		'''
+			Set all coded sums back to zero
+		'''
+		self.coded_hist[:] = 0
+		self.n_photons[:] = 0
+
+	@property
+	def nbytes(self) -> int:
+		return self.coded_hist.nbytes
+
+if __name__=='__main__':
+	from decoding import zncc_decoding
+
+	## Set parameters
+	n_pixels = 1000
+	n_tbins = 1024
+	n_photons_per_chunk = 100000
+	n_chunks = 10
+
+	## Ground truth timestamp for each pixel
+	gt_tstamps = np.random.randint(0, n_tbins, size=(n_pixels,))
+
+	gray_hist = CompressiveHistogram(n_pixels, n_tbins, coding_scheme='zero_mean_gray')
+	fourier_hist = CompressiveHistogram(n_pixels, n_tbins, coding_scheme='trunc_fourier', n_freqs=5)
+	for _ in range(n_chunks):
+		## half the photons are from the signal and half from the background
+		pixel_ids = np.random.randint(0, n_pixels, size=(n_photons_per_chunk,))
+		tstamps = np.random.randint(0, n_tbins, size=(n_photons_per_chunk,))
+		is_signal = np.random.rand(n_photons_per_chunk) < 0.5
+		tstamps[is_signal] = gt_tstamps[pixel_ids[is_signal]]
+		gray_hist.update(pixel_ids, tstamps)
+		fourier_hist.update(pixel_ids, tstamps)
+
+	for hist in [gray_hist, fourier_hist]:
+		decoded_tstamps = zncc_decoding(hist.coded_hist.T, hist.get_coding_matrix())
+		print("{} coding: {} bytes instead of {} bytes for the full histograms. Mean absolute error = {:.2f} bins".format(hist.coding_scheme, hist.nbytes, n_pixels*n_tbins*hist.dtype.itemsize, np.mean(np.abs(decoded_tstamps - gt_tstamps))))
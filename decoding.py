@@ -2,11 +2,15 @@
 	Functions to estimate depths given coded ToF values
 '''
 ## Standard Library Imports
+import functools
 
 ## Library Imports
 import numpy as np
 
 ## Local Imports
+from coding_gray import gray_code_to_uint_batch, uint_to_zero_mean_gray_code_batch, pack_code_bits, get_gray_code_len, get_gray_code_offset
+from coding_trunc_fourier import get_trunc_fourier_freqs
+from coding_cache import LRUCache
 
 
 def norm_t(C, axis=-1):
@@ -68,4 +72,647 @@ def ncc_decoding(x, C):
     ## Build lookup table
     ncc_lookup = ncc(x,C)
     ## Find maximum
-    return np.argmax(ncc_lookup, axis=0)
\ No newline at end of file
+    return np.argmax(ncc_lookup, axis=0)
+
+def zncc_decoding_chunked(x, C, max_bytes=2**27, return_max=False):
+	'''
+		Same as zncc_decoding, but it never builds the full NxM correlation table.
+		The pixels and the rows of C are processed in tiles whose correlation table uses at most max_bytes.
+		* x is a Kx1 vector or a KxM matrix
+		* C is a NxK matrix
+		* return_max: also return the max zncc value of each pixel
+		float32 inputs stay float32.
+	'''
+	dtype = get_decoding_dtype(x, C)
+	zero_norm_x = zero_norm_t(x.reshape((x.shape[0], -1)).astype(dtype, copy=False), axis=0)
+	zero_norm_C = zero_norm_t(C.astype(dtype, copy=False), axis=1)
+	return _squeeze_decoded(x, correlation_argmax_chunked(zero_norm_x, zero_norm_C, max_bytes=max_bytes), return_max)
+
+def ncc_decoding_chunked(x, C, max_bytes=2**27, return_max=False):
+	'''
+		Same as ncc_decoding, but it never builds the full NxM correlation table (see zncc_decoding_chunked)
+	'''
+	dtype = get_decoding_dtype(x, C)
+	norm_x = norm_t(x.reshape((x.shape[0], -1)).astype(dtype, copy=False), axis=0)
+	norm_C = norm_t(C.astype(dtype, copy=False), axis=1)
+	return _squeeze_decoded(x, correlation_argmax_chunked(norm_x, norm_C, max_bytes=max_bytes), return_max)
+
+def get_decoding_dtype(x, C):
+	'''
+		Float type used for decoding: float32 only if both inputs are float32 (or smaller floats), float64 otherwise
+	'''
+	return np.result_type(x.dtype, C.dtype, np.float32)
+
+def correlation_argmax_chunked(norm_x, norm_C, max_bytes=2**27):
+	'''
+		Running argmax of np.matmul(norm_C, norm_x) along the rows of C, computed tile by tile
+		* norm_x is a KxM matrix
+		* norm_C is a NxK matrix
+		Returns (argmax, max), each an M-dim array
+	'''
+	assert(norm_x.shape[0] == norm_C.shape[-1])
+	## Each tile is computed as a (pixels x rows) table so that the argmax runs over contiguous memory
+	return _correlation_argmax_chunked(np.ascontiguousarray(norm_x.T), np.ascontiguousarray(norm_C.T), max_bytes=max_bytes)
+
+def _correlation_argmax_chunked(norm_x_t, norm_C_t, max_bytes=2**27):
+	'''
+		Same as correlation_argmax_chunked but with transposed inputs (norm_x_t is MxK, norm_C_t is KxN)
+	'''
+	(n_pixels, n_rows) = (norm_x_t.shape[0], norm_C_t.shape[1])
+	dtype = np.result_type(norm_x_t.dtype, norm_C_t.dtype)
+	## Use as many rows per tile as possible while keeping at least 256 pixels per tile
+	rows_per_tile = int(max(1, min(n_rows, max_bytes // (dtype.itemsize*min(n_pixels, 256)))))
+	pixels_per_tile = int(max(1, min(n_pixels, max_bytes // (dtype.itemsize*rows_per_tile))))
+	best_indeces = np.zeros((n_pixels,), dtype=np.int64)
+	best_vals = np.full((n_pixels,), -np.inf, dtype=dtype)
+	for start_pixel in range(0, n_pixels, pixels_per_tile):
+		end_pixel = min(start_pixel + pixels_per_tile, n_pixels)
+		x_tile = norm_x_t[start_pixel:end_pixel]
+		tile_best_indeces = best_indeces[start_pixel:end_pixel]
+		tile_best_vals = best_vals[start_pixel:end_pixel]
+		for start_row in range(0, n_rows, rows_per_tile):
+			corr = np.matmul(x_tile, norm_C_t[:, start_row:start_row+rows_per_tile])
+			corr_argmax = np.argmax(corr, axis=1)
+			corr_max = np.take_along_axis(corr, corr_argmax[:, np.newaxis], axis=1)[:, 0]
+			## strict inequality keeps the first maximum, like np.argmax
+			is_better = corr_max > tile_best_vals
+			tile_best_indeces[is_better] = corr_argmax[is_better] + start_row
+			tile_best_vals[is_better] = corr_max[is_better]
+	return (best_indeces, best_vals)
+
+def get_topk_n_candidates(n_peaks, min_separation):
+	'''
+		Number of best rows per pixel that always contain the n_peaks found by greedy non-maximum suppression.
+		Each selected peak suppresses at most 2*(min_separation-1) other rows, so the n-th peak is among the best
+		n + (n-1)*2*(min_separation-1) rows. A min_separation below 1 is the same as 1 (peaks only need to be different rows)
+	'''
+	min_separation = max(min_separation, 1)
+	return n_peaks + (n_peaks - 1)*2*(min_separation - 1)
+
+def _correlation_topk_chunked(norm_x_t, norm_C_t, n_peaks, min_separation=1, circular=True, max_bytes=2**27):
+	'''
+		Top n_peaks rows of np.matmul(norm_x_t, norm_C_t) for each pixel, at least min_separation rows apart (greedy
+		non-maximum suppression), computed tile by tile without building the full (pixels x rows) table.
+		* If a tile has all the rows, the peaks are found with n_peaks argmax calls, masking the rows around each peak
+		* Otherwise the best rows of each row tile are found with argpartition and merged with the running best rows,
+		  and the suppression runs on the few candidates that are left (see get_topk_n_candidates)
+		Both give the same peak values, but ties (e.g., the plateaus of equal correlation of Hamiltonian codes) may resolve
+		to different rows, since argpartition can drop any of the tied rows at the candidate cutoff. Returns (indeces, vals), each a (n_pixels, n_peaks) array sorted by decreasing value.
+		Pixels with fewer peaks than n_peaks get -1 indeces and -inf values
+	'''
+	(n_pixels, n_rows) = (norm_x_t.shape[0], norm_C_t.shape[1])
+	dtype = np.result_type(norm_x_t.dtype, norm_C_t.dtype)
+	n_candidates = min(n_rows, get_topk_n_candidates(n_peaks, min_separation))
+	## same tiling as _correlation_argmax_chunked, but each row tile should have more rows than candidates
+	rows_per_tile = int(max(n_candidates, min(n_rows, max_bytes // (dtype.itemsize*min(n_pixels, 256)))))
+	pixels_per_tile = int(max(1, min(n_pixels, max_bytes // (dtype.itemsize*rows_per_tile))))
+	peak_indeces = np.zeros((n_pixels, n_peaks), dtype=np.int64)
+	peak_vals = np.zeros((n_pixels, n_peaks), dtype=dtype)
+	for start_pixel in range(0, n_pixels, pixels_per_tile):
+		end_pixel = min(start_pixel + pixels_per_tile, n_pixels)
+		x_tile = norm_x_t[start_pixel:end_pixel]
+		if(rows_per_tile >= n_rows):
+			(peak_indeces[start_pixel:end_pixel], peak_vals[start_pixel:end_pixel]) = _masked_argmax_peaks(np.matmul(x_tile, norm_C_t), n_peaks, min_separation, circular)
+			continue
+		(tile_indeces, tile_vals) = (None, None)
+		for start_row in range(0, n_rows, rows_per_tile):
+			corr = np.matmul(x_tile, norm_C_t[:, start_row:start_row+rows_per_tile])
+			if(corr.shape[1] > n_candidates):
+				corr_indeces = np.argpartition(corr, -n_candidates, axis=1)[:, -n_candidates:]
+				corr = np.take_along_axis(corr, corr_indeces, axis=1)
+			else:
+				corr_indeces = np.broadcast_to(np.arange(corr.shape[1]), corr.shape)
+			corr_indeces = corr_indeces + start_row
+			if(tile_indeces is None):
+				(tile_indeces, tile_vals) = (corr_indeces, corr)
+				continue
+			## merge with the best rows of the previous row tiles
+			merged_indeces = np.concatenate((tile_indeces, corr_indeces), axis=1)
+			merged_vals = np.concatenate((tile_vals, corr), axis=1)
+			keep = np.argpartition(merged_vals, -n_candidates, axis=1)[:, -n_candidates:]
+			tile_indeces = np.take_along_axis(merged_indeces, keep, axis=1)
+			tile_vals = np.take_along_axis(merged_vals, keep, axis=1)
+		## sort by decreasing value, and by increasing row for ties, like np.argmax
+		order = np.lexsort((tile_indeces, -tile_vals), axis=1)
+		(peak_indeces[start_pixel:end_pixel], peak_vals[start_pixel:end_pixel]) = non_maximum_suppression(
+			np.take_along_axis(tile_indeces, order, axis=1), np.take_along_axis(tile_vals, order, axis=1), n_peaks, min_separation, n_rows=(n_rows if(circular) else None))
+	return (peak_indeces, peak_vals)
+
+def _masked_argmax_peaks(corr, n_peaks, min_separation, circular=True):
+	'''
+		Greedy non-maximum suppression on a full (pixels x rows) correlation table: take the argmax, set the rows closer
+		than min_separation to it to -inf, and repeat. corr is overwritten
+	'''
+	(n_pixels, n_rows) = corr.shape
+	pixels = np.arange(n_pixels)[:, np.newaxis]
+	offsets = np.arange(-(max(min_separation, 1) - 1), max(min_separation, 1))
+	peak_indeces = np.zeros((n_pixels, n_peaks), dtype=np.int64)
+	peak_vals = np.zeros((n_pixels, n_peaks), dtype=corr.dtype)
+	for i in range(n_peaks):
+		peak_indeces[:, i] = np.argmax(corr, axis=1)
+		peak_vals[:, i] = corr[pixels[:, 0], peak_indeces[:, i]]
+		if(i == n_peaks - 1): break
+		masked_rows = peak_indeces[:, i:i+1] + offsets
+		masked_rows = np.mod(masked_rows, n_rows) if(circular) else np.clip(masked_rows, 0, n_rows - 1)
+		corr[pixels, masked_rows] = -np.inf
+	## every row was suppressed before finding n_peaks peaks
+	peak_indeces[peak_vals == -np.inf] = -1
+	return (peak_indeces, peak_vals)
+
+def non_maximum_suppression(indeces, vals, n_peaks, min_separation, n_rows=None):
+	'''
+		Greedy non-maximum suppression of the candidate rows of each pixel.
+		Arguments:
+			* indeces, vals: (n_pixels, n_candidates) candidate rows and their values, sorted by decreasing value
+			* n_peaks: number of peaks kept per pixel
+			* min_separation: rows closer than this to a selected peak are suppressed
+			* n_rows: number of rows of the coding matrix if the rows are circular (the first and last rows are neighbors), else None
+		Returns (peak_indeces, peak_vals), each a (n_pixels, n_peaks) array. Missing peaks get -1 indeces and -inf values
+	'''
+	n_pixels = indeces.shape[0]
+	peak_indeces = np.full((n_pixels, n_peaks), -1, dtype=np.int64)
+	peak_vals = np.full((n_pixels, n_peaks), -np.inf, dtype=vals.dtype)
+	is_valid = np.ones(indeces.shape, dtype=bool)
+	pixels = np.arange(n_pixels)
+	for i in range(n_peaks):
+		## candidates are sorted, so the first valid one is the best one
+		first_valid = np.argmax(is_valid, axis=1)
+		has_peak = is_valid[pixels, first_valid]
+		selected_indeces = indeces[pixels, first_valid]
+		peak_indeces[has_peak, i] = selected_indeces[has_peak]
+		peak_vals[has_peak, i] = vals[pixels, first_valid][has_peak]
+		distances = np.abs(indeces - selected_indeces[:, np.newaxis])
+		if(n_rows is not None): distances = np.minimum(distances, n_rows - distances)
+		is_valid &= distances >= max(min_separation, 1)
+	return (peak_indeces, peak_vals)
+
+def _squeeze_decoded(x, decoded, return_max):
+	(best_indeces, best_vals) = decoded
+	best_indeces = best_indeces.reshape(x.shape[1:])[()]
+	if(return_max): return (best_indeces, best_vals.reshape(x.shape[1:])[()])
+	return best_indeces
+
+## Normalized coding matrices shared by the Decoder objects built with a cache_key. Empty until a budget is set
+_prepared_coding_matrices = LRUCache(max_bytes=0)
+
+def set_prepared_cache_budget(max_bytes: int):
+	'''
+		Byte budget of the cache of prepared coding matrices (see prepare_coding_matrix). It is 0 (no caching) by default
+	'''
+	_prepared_coding_matrices.max_bytes = max_bytes
+	_prepared_coding_matrices.evict()
+
+def clear_prepared_cache():
+	_prepared_coding_matrices.clear()
+
+def prepare_coding_matrix(C, zero_mean=True, dtype=np.float64, cache_key=None):
+	'''
+		Normalize the rows of C (zero_norm_t if zero_mean else norm_t), cast them to dtype, and return the transposed KxN
+		matrix as a contiguous read-only array.
+		The result is only cached when the caller names the matrix with cache_key (e.g., the key of coding_cache.get_cache_key)
+		and set_prepared_cache_budget was called. The content of C is not hashed, so the caller is responsible for using
+		a different key for a different matrix.
+	'''
+	dtype = np.dtype(dtype)
+	if(cache_key is not None):
+		key = (cache_key, C.shape, bool(zero_mean), dtype.str)
+		norm_C_t = _prepared_coding_matrices.get(key)
+		if(norm_C_t is not None): return norm_C_t
+	C = np.asarray(C).astype(dtype, copy=False)
+	if(zero_mean): norm_C = zero_norm_t(C, axis=1)
+	else: norm_C = norm_t(C, axis=1)
+	norm_C_t = np.ascontiguousarray(norm_C.T)
+	norm_C_t.flags.writeable = False
+	if(cache_key is not None): _prepared_coding_matrices.put(key, norm_C_t)
+	return norm_C_t
+
+class Decoder:
+	'''
+		Decoder for a fixed coding matrix. The normalized (and transposed) coding matrix is computed once when the decoder
+		is built, instead of on every call like zncc and ncc. Decoder objects can be pickled and sent to worker processes.
+		Arguments:
+			* C: NxK coding matrix
+			* zero_mean: use zncc if True, else ncc. Use ncc if all the codes/columns in C are zero-mean
+			* dtype: float type used for decoding (e.g., np.float32). Defaults to the dtype of C (float64 for integer matrices)
+			* max_bytes: max size of the correlation table tiles used by decode
+			* cache_key: name of C in the cache of prepared matrices, so that decoders of the same matrix share one
+			  normalized copy (see prepare_coding_matrix). By default every decoder prepares its own copy
+	'''
+	def __init__(self, C, zero_mean=True, dtype=None, max_bytes=2**27, cache_key=None):
+		assert(C.ndim == 2), "C should be a a matrix"
+		if(dtype is None): dtype = np.result_type(C.dtype, np.float32) if np.issubdtype(C.dtype, np.floating) else np.float64
+		self.zero_mean = zero_mean
+		self.dtype = np.dtype(dtype)
+		self.max_bytes = max_bytes
+		self.norm_C_t = prepare_coding_matrix(C, zero_mean=zero_mean, dtype=self.dtype, cache_key=cache_key)
+
+	@classmethod
+	def from_prepared_matrix(cls, norm_C_t, zero_mean=True, max_bytes=2**27):
+		'''
+			Build a decoder from a matrix that was already prepared with prepare_coding_matrix (e.g., one in shared memory).
+			The caller owns norm_C_t, so it can share it between decoders without the cache of prepared matrices
+		'''
+		decoder = cls.__new__(cls)
+		decoder.__setstate__({'zero_mean': zero_mean, 'dtype': norm_C_t.dtype.str, 'max_bytes': max_bytes, 'norm_C_t': norm_C_t})
+		return decoder
+
+	@property
+	def n_rows(self):
+		return self.norm_C_t.shape[1]
+
+	@property
+	def n_codes(self):
+		return self.norm_C_t.shape[0]
+
+	def normalize(self, x):
+		'''
+			Normalize x (Kx1 vector or KxM matrix) the same way as the rows of the coding matrix. Returns a KxM matrix
+		'''
+		assert(x.ndim <= 2), "x should be a vector or a matrix"
+		assert(x.shape[0] == self.n_codes), "x should have {} codes".format(self.n_codes)
+		x = x.reshape((x.shape[0], -1)).astype(self.dtype, copy=False)
+		if(self.zero_mean): return zero_norm_t(x, axis=0)
+		return norm_t(x, axis=0)
+
+	def correlate(self, x):
+		'''
+			Correlation table between x and every row of the coding matrix. Same output as zncc(x, C) or ncc(x, C)
+		'''
+		return np.matmul(self.norm_C_t.T, self.normalize(x)).reshape((self.n_rows,) + x.shape[1:])
+
+	def decode(self, x, return_max=False):
+		'''
+			Index of the row of the coding matrix that best matches x. Same output as zncc_decoding(x, C) or ncc_decoding(x, C)
+			but computed in tiles (see zncc_decoding_chunked)
+		'''
+		norm_x_t = np.ascontiguousarray(self.normalize(x).T)
+		return _squeeze_decoded(x, _correlation_argmax_chunked(norm_x_t, self.norm_C_t, max_bytes=self.max_bytes), return_max)
+
+	def decode_subbin(self, x, method='parabola', circular=True):
+		'''
+			Decode x and refine each argmax with the correlation values of its two neighboring rows.
+			Only 3 rows are correlated per pixel on top of decode, so a coarse coding matrix can give sub-bin estimates.
+			* method: one of SUBBIN_METHODS (see subbin_offset)
+			* circular: the first and last rows of C are neighbors (e.g., fourier and iToF codes). If False, peaks at the
+			  first or last row are not refined
+			Returns fractional rows of C in [0, N)
+		'''
+		norm_x = self.normalize(x)
+		norm_x_t = np.ascontiguousarray(norm_x.T)
+		(peak_indeces, peak_vals) = _correlation_argmax_chunked(norm_x_t, self.norm_C_t, max_bytes=self.max_bytes)
+		y_left = np.sum(self.norm_C_t[:, (peak_indeces - 1) % self.n_rows]*norm_x, axis=0)
+		y_right = np.sum(self.norm_C_t[:, (peak_indeces + 1) % self.n_rows]*norm_x, axis=0)
+		offsets = subbin_offset(y_left, peak_vals, y_right, method=method)
+		if(circular):
+			decoded = np.mod(peak_indeces + offsets, self.n_rows)
+		else:
+			at_edge = (peak_indeces == 0) | (peak_indeces == (self.n_rows - 1))
+			decoded = peak_indeces + np.where(at_edge, 0., offsets)
+		return decoded.reshape(x.shape[1:])[()]
+
+	def decode_topk(self, x, n_peaks=2, min_separation=1, circular=True):
+		'''
+			Best n_peaks rows of the coding matrix for each pixel (e.g., the direct and the second return with multipath or
+			transparent surfaces), computed in tiles without building the full correlation table (see _correlation_topk_chunked).
+			* min_separation: min number of rows between two peaks. Use about the width of the correlation peak so that
+			  the neighbors of the best row are not returned as other peaks. Values below 1 are the same as 1
+			* circular: the first and last rows of C are neighbors when measuring the separation
+			Returns (peak_indeces, peak_vals), each with shape x.shape[1:] + (n_peaks,) and sorted by decreasing correlation.
+			The first peak is the same as decode. Missing peaks (e.g., n_peaks*min_separation > N) get -1 indeces and -inf values
+		'''
+		assert(n_peaks >= 1), "n_peaks should be positive"
+		min_separation = max(int(min_separation), 1)
+		norm_x_t = np.ascontiguousarray(self.normalize(x).T)
+		(peak_indeces, peak_vals) = _correlation_topk_chunked(norm_x_t, self.norm_C_t, n_peaks, min_separation=min_separation, circular=circular, max_bytes=self.max_bytes)
+		out_shape = x.shape[1:] + (n_peaks,)
+		return (peak_indeces.reshape(out_shape), peak_vals.reshape(out_shape))
+
+	def decode_coarse_to_fine(self, x, decimation=8, n_candidates=4, window=None):
+		'''
+			Hierarchical decoding. x is first correlated with every decimation-th row of the coding matrix, and then with
+			all the rows in a window around the n_candidates best coarse rows. This is much cheaper than decode when the
+			correlation functions are smooth along the rows (e.g., fourier and hamiltonian codes), but it can miss narrow peaks.
+			* decimation: step between the rows used in the coarse search
+			* n_candidates: number of coarse rows that are refined at full resolution
+			* window: number of rows refined on each side of each candidate. Defaults to decimation
+			Returns the same as decode
+		'''
+		if(window is None): window = decimation
+		coarse_rows = np.arange(0, self.n_rows, decimation)
+		n_candidates = min(n_candidates, coarse_rows.size)
+		norm_x_t = np.ascontiguousarray(self.normalize(x).T)
+		n_pixels = norm_x_t.shape[0]
+		coarse_norm_C_t = np.ascontiguousarray(self.norm_C_t[:, coarse_rows])
+		norm_C = self._get_row_major_norm_C()
+		offsets = np.arange(-window, window+1)
+		n_fine_rows = n_candidates*offsets.size
+		decoded = np.zeros((n_pixels,), dtype=np.int64)
+		## each block of pixels needs a (pixels x coarse rows) table and a (pixels x fine rows x K) gather
+		pixels_per_block = int(max(1, self.max_bytes // (self.dtype.itemsize*max(coarse_rows.size, n_fine_rows*self.n_codes))))
+		for start_pixel in range(0, n_pixels, pixels_per_block):
+			x_block = norm_x_t[start_pixel:start_pixel+pixels_per_block]
+			coarse_corr = np.matmul(x_block, coarse_norm_C_t)
+			if(n_candidates < coarse_rows.size):
+				candidates = np.argpartition(coarse_corr, -n_candidates, axis=1)[:, -n_candidates:]
+			else:
+				candidates = np.broadcast_to(np.arange(coarse_rows.size), coarse_corr.shape)
+			## full resolution rows around each candidate (the rows of the coding matrix are circular)
+			fine_rows = ((coarse_rows[candidates][:, :, np.newaxis] + offsets).reshape((x_block.shape[0], n_fine_rows))) % self.n_rows
+			fine_corr = np.einsum('mjk,mk->mj', norm_C[fine_rows], x_block)
+			## break ties with the smallest row, like np.argmax does in decode
+			is_max = fine_corr == fine_corr.max(axis=1, keepdims=True)
+			decoded[start_pixel:start_pixel+pixels_per_block] = np.where(is_max, fine_rows, self.n_rows).min(axis=1)
+		return decoded.reshape(x.shape[1:])[()]
+
+	def _get_row_major_norm_C(self):
+		'''
+			Normalized coding matrix with one row per time bin (NxK), used to gather a few rows per pixel
+		'''
+		if(getattr(self, '_norm_C', None) is None): self._norm_C = np.ascontiguousarray(self.norm_C_t.T)
+		return self._norm_C
+
+	def __getstate__(self):
+		## Only the normalized matrix is needed. It is shipped as a regular array so that it stays read-only after unpickling
+		return {'zero_mean': self.zero_mean, 'dtype': self.dtype.str, 'max_bytes': self.max_bytes, 'norm_C_t': np.asarray(self.norm_C_t)}
+
+	def __setstate__(self, state):
+		self.zero_mean = state['zero_mean']
+		self.dtype = np.dtype(state['dtype'])
+		self.max_bytes = state['max_bytes']
+		self.norm_C_t = state['norm_C_t']
+		self.norm_C_t.flags.writeable = False
+
+def gray_decode(x, threshold=0., min_confidence=0.5, n_soft_bits=2, pulse_sigma=1., return_confidence=False):
+	'''
+		Closed-form decoding for gray coded measurements. Each bit is thresholded and the gray code is converted back
+		to an integer with a prefix XOR, so the cost is O(K) per pixel instead of O(2^K x K) for zncc_decoding.
+		Pixels where some bit is close to the threshold (e.g., the pulse falls on a bit boundary) go through a soft path
+		that flips the n_soft_bits least confident bits and picks the candidate whose pulse-smoothed code has the highest
+		normalized correlation with the measurements (maximum likelihood for a gaussian pulse and gaussian noise).
+		* x is a Kx1 vector or a KxM matrix of coded measurements
+		* threshold: scalar or M-dim array. Use 0 for zero-mean gray codes and half the photon counts for 0/1 gray codes
+		* min_confidence: pixels with a confidence below this value go through the soft path
+		* n_soft_bits: number of bits considered in the soft path (2^n_soft_bits candidates per pixel). 0 disables it
+		* pulse_sigma: standard deviation of the pulse in time bins, used to smooth the candidate codes
+		* return_confidence: also return the confidence of each pixel
+		The confidence of a pixel is the smallest bit margin |x - threshold| divided by the RMS of all its margins (between 0 and 1)
+	'''
+	assert(x.ndim <= 2), "x should be a vector or a matrix"
+	k = x.shape[0]
+	centered_x = x.reshape((k, -1)) - np.asarray(threshold)
+	## Hard decoding
+	bits = centered_x > 0
+	decoded = gray_code_to_uint_batch(bits.T).astype(np.int64)
+	## Per-pixel confidence
+	margins = np.abs(centered_x)
+	rms_margins = np.sqrt(np.mean(np.square(centered_x), axis=0))
+	confidence = margins.min(axis=0) / (rms_margins + 1e-6)
+	## Soft decoding for low confidence pixels
+	n_soft_bits = min(n_soft_bits, k)
+	low_conf_pixels = np.flatnonzero(confidence < min_confidence)
+	if((low_conf_pixels.size > 0) and (n_soft_bits > 0)):
+		n_candidates = 2**n_soft_bits
+		pixel_range = np.arange(low_conf_pixels.size)
+		weak_bits = np.argsort(margins[:, low_conf_pixels], axis=0)[0:n_soft_bits]
+		flips = ((np.arange(n_candidates)[:, np.newaxis] >> np.arange(n_soft_bits)) & 1).astype(bool)
+		candidates = np.repeat(bits[:, low_conf_pixels].T[np.newaxis, :, :], n_candidates, axis=0)
+		for i in range(n_soft_bits):
+			candidates[:, pixel_range, weak_bits[i]] ^= flips[:, i:i+1]
+		candidate_tbins = gray_code_to_uint_batch(candidates).astype(np.int64)
+		## NCC between the smoothed code of each candidate and the measurements
+		norm_candidate_codes = norm_t(_smoothed_zero_mean_gray_codes(candidate_tbins, k, pulse_sigma), axis=-1)
+		scores = np.sum(norm_candidate_codes*centered_x[:, low_conf_pixels].T[np.newaxis, :, :], axis=-1)
+		best_candidates = np.argmax(scores, axis=0)
+		decoded[low_conf_pixels] = candidate_tbins[best_candidates, pixel_range]
+	decoded = decoded.reshape(x.shape[1:])[()]
+	if(return_confidence):
+		return (decoded, confidence.reshape(x.shape[1:])[()])
+	return decoded
+
+def gray_decode_n_tbins(x, n_tbins, mode='balanced', **kwargs):
+	'''
+		gray_decode for the gray codes of any number of time bins (see coding_gray.tbin_to_gray_code_batch).
+		Codes that are not used by any time bin are mapped to the closest end of [0, n_tbins).
+		* x is a Kx1 vector or a KxM matrix with K = ceil(log2(n_tbins))
+		* mode: one of coding_gray.GRAY_CODE_MODES. Should match the one used for encoding
+		* kwargs are passed to gray_decode
+	'''
+	assert(x.shape[0] == get_gray_code_len(n_tbins)), "gray codes for {} time bins have {} bits".format(n_tbins, get_gray_code_len(n_tbins))
+	decoded = gray_decode(x, **kwargs)
+	if(kwargs.get('return_confidence', False)):
+		return (np.clip(decoded[0] - get_gray_code_offset(n_tbins, mode), 0, n_tbins - 1), decoded[1])
+	return np.clip(decoded - get_gray_code_offset(n_tbins, mode), 0, n_tbins - 1)
+
+## Number of 1 bits of each byte, used by popcount when np.bitwise_count is not available
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def popcount(arr):
+	'''
+		Number of 1 bits in each element of an unsigned integer array
+	'''
+	if(hasattr(np, 'bitwise_count')): return np.bitwise_count(arr)
+	## numpy < 2.0: look up the count of each byte and add them
+	flat_arr = np.ascontiguousarray(arr).reshape((-1,))
+	byte_counts = _POPCOUNT_TABLE[flat_arr.view(np.uint8)].reshape((flat_arr.size, flat_arr.dtype.itemsize))
+	return byte_counts.sum(axis=-1, dtype=np.uint8).reshape(np.shape(arr))
+
+def pack_sign_bits(x, threshold=0.):
+	'''
+		Sign-quantize coded measurements and pack them into bitfields.
+		* x is a Kx1 vector or a KxM matrix (K <= 64)
+		* threshold: scalar or M-dim array. Bits are 1 where x > threshold
+		Returns a (M,) array of bitfields where the first code is the MSB (same layout as coding_gray.pack_code_bits)
+	'''
+	assert(x.ndim <= 2), "x should be a vector or a matrix"
+	assert(x.shape[0] <= 64), "can only pack up to 64 codes"
+	bits = x.reshape((x.shape[0], -1)) > np.asarray(threshold)
+	return pack_code_bits(bits.T).reshape(x.shape[1:])[()]
+
+def pack_binary_coding_matrix(C, threshold=None):
+	'''
+		Pack an NxK binary coding matrix (0/1 or +-1 values) into N bitfields. threshold defaults to the midpoint between
+		the min and max values of C
+	'''
+	assert(C.ndim == 2), "C should be a a matrix"
+	assert(C.shape[-1] <= 64), "can only pack up to 64 codes"
+	if(threshold is None): threshold = 0.5*(C.min() + C.max())
+	return pack_code_bits(C > threshold)
+
+def hamming_decoding(x, packed_C, threshold=0., max_bytes=2**26, return_distance=False):
+	'''
+		Decoding of sign-quantized measurements against a packed binary coding matrix. Each row is scored with an XOR and a
+		popcount (the Hamming distance between bitfields) instead of a floating point dot product.
+		For +-1 codes the NCC between sign(x - threshold) and a row is 1 - 2*distance/K, so this gives the same result as
+		ncc_decoding(np.where(x > threshold, 1, -1), C), except that exact ties always go to the first row.
+		* x is a Kx1 vector or a KxM matrix of coded measurements
+		* packed_C: (N,) bitfields (e.g., coding_gray.generate_packed_gray_coding_matrix or pack_binary_coding_matrix)
+		* threshold: see pack_sign_bits. Use 0 for zero-mean codes and half the photon counts for 0/1 codes
+		* max_bytes: max size of the distance table tiles
+		* return_distance: also return the Hamming distance of the best row
+	'''
+	packed_x = np.asarray(pack_sign_bits(x, threshold)).reshape((-1,))
+	packed_C = np.asarray(packed_C)
+	assert(packed_C.ndim == 1), "packed_C should be a 1D array of bitfields"
+	dtype = np.promote_types(packed_x.dtype, packed_C.dtype)
+	(packed_x, packed_C) = (packed_x.astype(dtype, copy=False), packed_C.astype(dtype, copy=False))
+	(n_pixels, n_rows) = (packed_x.size, packed_C.size)
+	## Same tiling as _correlation_argmax_chunked. Distances are uint8, but the XOR table has the width of dtype
+	rows_per_tile = int(max(1, min(n_rows, max_bytes // (dtype.itemsize*min(n_pixels, 256)))))
+	pixels_per_tile = int(max(1, min(n_pixels, max_bytes // (dtype.itemsize*rows_per_tile))))
+	best_indeces = np.zeros((n_pixels,), dtype=np.int64)
+	best_distances = np.full((n_pixels,), 255, dtype=np.uint8)
+	for start_pixel in range(0, n_pixels, pixels_per_tile):
+		end_pixel = min(start_pixel + pixels_per_tile, n_pixels)
+		x_tile = packed_x[start_pixel:end_pixel, np.newaxis]
+		tile_best_indeces = best_indeces[start_pixel:end_pixel]
+		tile_best_distances = best_distances[start_pixel:end_pixel]
+		for start_row in range(0, n_rows, rows_per_tile):
+			distances = popcount(x_tile ^ packed_C[np.newaxis, start_row:start_row+rows_per_tile])
+			distances_argmin = np.argmin(distances, axis=1)
+			distances_min = np.take_along_axis(distances, distances_argmin[:, np.newaxis], axis=1)[:, 0]
+			## strict inequality keeps the first minimum, like np.argmin
+			is_better = distances_min < tile_best_distances
+			tile_best_indeces[is_better] = distances_argmin[is_better] + start_row
+			tile_best_distances[is_better] = distances_min[is_better]
+	return _squeeze_decoded(x, (best_indeces, best_distances), return_distance)
+
+def fourier_decode(x, n_tbins, n_freqs, upsample=4, include_zeroth_harmonic=False, zero_mean=None, max_bytes=2**26):
+	'''
+		Decoding for truncated fourier coded measurements without building the coding matrix.
+		The measurements are the DFT coefficients of the histogram at n_freqs frequencies, so the correlation with every
+		row of the coding matrix is a zero-padded irfft (O(N log N) per pixel). The peak is refined with a parabola fit.
+		* x is a 2Fx1 vector or a 2FxM matrix with interleaved [cos, -sin] measurements (see uint_to_trunc_fourier_code)
+		* n_tbins: number of time bins in the domain
+		* n_freqs: number of frequencies F
+		* upsample: the correlation is evaluated at n_tbins*upsample points
+		* include_zeroth_harmonic: should match the value used for encoding
+		* zero_mean: if True the scores match zncc, if False they match ncc. By default zncc is only used when the codes
+		  include the zeroth harmonic (i.e., when the codes are not zero-mean), following zncc_decoding and ncc_decoding
+		* max_bytes: pixels are decoded in blocks so that each block's irfft output uses at most this many bytes
+		Returns fractional time bins in [0, n_tbins)
+	'''
+	assert(x.ndim <= 2), "x should be a vector or a matrix"
+	assert(x.shape[0] == 2*n_freqs), "x should have 2*n_freqs measurements"
+	assert(upsample >= 1), "upsample should be a positive integer"
+	if(zero_mean is None): zero_mean = include_zeroth_harmonic
+	freqs = get_trunc_fourier_freqs(n_freqs, include_zeroth_harmonic)
+	n_samples = n_tbins*int(upsample)
+	assert(freqs.max() < (n_samples / 2)), "n_freqs is too large for n_tbins*upsample samples"
+	## irfft weights the zeroth harmonic by 1/n and every other one by 2/n. Undo it so that the output is exactly C @ x
+	spectrum_scale = np.where(freqs == 0, n_samples, n_samples / 2.)
+	x_2d = x.reshape((x.shape[0], -1))
+	n_pixels = x_2d.shape[1]
+	if(zero_mean):
+		## correlating the zero-mean x with C is the same as correlating x with the zero-mean rows of C
+		x_2d = x_2d - x_2d.mean(axis=0, keepdims=True)
+		## the zero-mean rows are normalized by their norms, which only depend on the sum of each row
+		row_sums = np.fft.irfft(_place_in_spectrum((1 + 1j)*spectrum_scale, freqs, n_samples), n=n_samples, axis=-1)
+		inv_row_norms = 1. / (np.sqrt(np.maximum(n_freqs - (np.square(row_sums) / x.shape[0]), 0)) + 1e-6)
+	## pixels along the first axis so that each irfft runs over contiguous memory
+	phasors = (x_2d[0::2] + 1j*x_2d[1::2]).T*spectrum_scale
+	decoded = np.zeros((n_pixels,))
+	block_size = max(1, max_bytes // (n_samples*np.dtype(np.complex128).itemsize))
+	for start_pixel in range(0, n_pixels, block_size):
+		end_pixel = min(start_pixel + block_size, n_pixels)
+		scores = np.fft.irfft(_place_in_spectrum(phasors[start_pixel:end_pixel], freqs, n_samples), n=n_samples, axis=-1)
+		if(zero_mean): scores *= inv_row_norms
+		decoded[start_pixel:end_pixel] = refine_peak(scores, np.argmax(scores, axis=-1), axis=-1) / upsample
+	return np.mod(decoded, n_tbins).reshape(x.shape[1:])[()]
+
+def _place_in_spectrum(phasors, freqs, n_samples):
+	spectrum = np.zeros(phasors.shape[:-1] + ((n_samples // 2) + 1,), dtype=np.complex128)
+	spectrum[..., freqs] = phasors
+	return spectrum
+
+SUBBIN_METHODS = ['parabola', 'gaussian', 'centroid']
+
+def subbin_offset(y_left, y_center, y_right, method='parabola'):
+	'''
+		Fractional offset (between -0.5 and 0.5) of a peak given the values at the peak and at its left and right neighbors.
+		* method: 'parabola' fits a parabola, 'gaussian' fits a parabola to the log of the values (falls back to the
+		  parabola fit when some values are not positive), 'centroid' computes the center of mass of the three values
+	'''
+	assert(method in SUBBIN_METHODS), "method should be one of {}".format(SUBBIN_METHODS)
+	if(method == 'centroid'):
+		## shift the values so that the smallest one has zero weight
+		min_vals = np.minimum(np.minimum(y_left, y_center), y_right)
+		(w_left, w_center, w_right) = (y_left - min_vals, y_center - min_vals, y_right - min_vals)
+		total_weights = w_left + w_center + w_right
+		has_weights = total_weights > 1e-12
+		delta = np.where(has_weights, (w_right - w_left) / np.where(has_weights, total_weights, 1.), 0.)
+		return np.clip(delta, -0.5, 0.5)
+	if(method == 'gaussian'):
+		is_positive = (y_left > 0) & (y_center > 0) & (y_right > 0)
+		(log_left, log_center, log_right) = (np.log(np.where(is_positive, y, 1.)) for y in (y_left, y_center, y_right))
+		return np.where(is_positive, subbin_offset(log_left, log_center, log_right, 'parabola'), subbin_offset(y_left, y_center, y_right, 'parabola'))
+	denominator = y_left - (2*y_center) + y_right
+	## flat neighborhoods have no curvature to fit
+	has_curvature = np.abs(denominator) > 1e-12
+	delta = np.where(has_curvature, 0.5*(y_left - y_right) / np.where(has_curvature, denominator, 1.), 0.)
+	return np.clip(delta, -0.5, 0.5)
+
+def refine_peak(y, peak_indeces, axis=0, method='parabola'):
+	'''
+		Return the fractional location of each peak using its (circular) neighbors
+		* y is a NxM matrix (or MxN if axis=-1)
+		* peak_indeces is an M-dim array with the index of the peak along the given axis of y
+		* method: one of SUBBIN_METHODS (see subbin_offset)
+	'''
+	n = y.shape[axis]
+	neighbor_indeces = np.expand_dims(peak_indeces, axis=axis)
+	y_left = np.take_along_axis(y, (neighbor_indeces - 1) % n, axis=axis).squeeze(axis=axis)
+	y_center = np.take_along_axis(y, neighbor_indeces, axis=axis).squeeze(axis=axis)
+	y_right = np.take_along_axis(y, (neighbor_indeces + 1) % n, axis=axis).squeeze(axis=axis)
+	return peak_indeces + subbin_offset(y_left, y_center, y_right, method=method)
+
+def zncc_decoding_subbin(x, C, method='parabola', circular=True):
+	'''
+		Same as zncc_decoding but returns fractional rows of C (see Decoder.decode_subbin)
+	'''
+	return Decoder(C, zero_mean=True).decode_subbin(x, method=method, circular=circular)
+
+def zncc_decoding_coarse_to_fine(x, C, decimation=8, n_candidates=4, window=None):
+	'''
+		Approximation of zncc_decoding that only evaluates a subset of the rows of C (see Decoder.decode_coarse_to_fine)
+	'''
+	return Decoder(C, zero_mean=True).decode_coarse_to_fine(x, decimation=decimation, n_candidates=n_candidates, window=window)
+
+def ncc_decoding_subbin(x, C, method='parabola', circular=True):
+	'''
+		Same as ncc_decoding but returns fractional rows of C (see Decoder.decode_subbin)
+	'''
+	return Decoder(C, zero_mean=False).decode_subbin(x, method=method, circular=circular)
+
+def zncc_decoding_topk(x, C, n_peaks=2, min_separation=1, circular=True):
+	'''
+		Same as zncc_decoding but returns the best n_peaks rows of C and their correlation (see Decoder.decode_topk)
+	'''
+	return Decoder(C, zero_mean=True).decode_topk(x, n_peaks=n_peaks, min_separation=min_separation, circular=circular)
+
+def ncc_decoding_topk(x, C, n_peaks=2, min_separation=1, circular=True):
+	'''
+		Same as ncc_decoding but returns the best n_peaks rows of C and their correlation (see Decoder.decode_topk)
+	'''
+	return Decoder(C, zero_mean=False).decode_topk(x, n_peaks=n_peaks, min_separation=min_separation, circular=circular)
+
+def _smoothed_zero_mean_gray_codes(tbins, k_bits, pulse_sigma):
+	'''
+		Zero-mean gray codes of each time bin convolved with a gaussian pulse of std pulse_sigma (in time bins)
+		Returns a (..., k_bits) array
+	'''
+	if(k_bits <= 16): return _smoothed_zero_mean_gray_coding_matrix(k_bits, pulse_sigma)[tbins]
+	return _smooth_zero_mean_gray_codes(tbins, k_bits, pulse_sigma)
+
+@functools.lru_cache(maxsize=8)
+def _smoothed_zero_mean_gray_coding_matrix(k_bits, pulse_sigma):
+	return _smooth_zero_mean_gray_codes(np.arange(0, 2**k_bits), k_bits, pulse_sigma)
+
+def _smooth_zero_mean_gray_codes(tbins, k_bits, pulse_sigma):
+	if(pulse_sigma <= 0): return uint_to_zero_mean_gray_code_batch(tbins, k_bits, dtype=np.float64)
+	half_width = int(np.ceil(3*pulse_sigma))
+	offsets = np.arange(-half_width, half_width+1)
+	weights = np.exp(-0.5*np.square(offsets / pulse_sigma))
+	weights /= weights.sum()
+	## gray codes are cyclic, so the neighbors of the first and last bins wrap around
+	neighbor_codes = uint_to_zero_mean_gray_code_batch((tbins[..., np.newaxis] + offsets) % (2**k_bits), k_bits, dtype=np.float64)
+	return np.sum(neighbor_codes*weights[:, np.newaxis], axis=-2)
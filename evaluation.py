@@ -0,0 +1,291 @@
+'''
+	Depth accuracy vs. compute evaluation of the iToF coding schemes.
+
+	For every cell of the (coding scheme) x (photon count) x (signal-to-background ratio) grid we:
+	* Simulate noisy (Poisson) measurements of random depths
+	* Decode them with every decoder that applies to the scheme (zncc, coarse-to-fine zncc, and the closed-form
+	  gray_decode/fourier_decode for complementary gray/fourier codes)
+	* Pick the fastest decoder whose depth error is within a tolerance of the full zncc search
+	* Report the mean absolute depth error, the decode time and the bytes per pixel of the measurements
+	The cells run in parallel and each result is saved in an on-disk cache, so rerunning with a larger grid only
+	evaluates the new cells. get_pareto_front returns the schemes that are not beaten in both error and cost.
+
+	With several workers the cells are timed concurrently. Use workers=1 for the most accurate decode times.
+
+	Run `python evaluation.py --help` to see the options.
+'''
+## Standard Library Imports
+import os
+import glob
+import json
+import time
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+## Library Imports
+import numpy as np
+
+## Local Imports
+from itof import ITOF_CODING_FUNCTIONS_DIR, get_itof_coding_functions_fname, generate_coding_functions
+from decoding import Decoder, gray_decode, fourier_decode
+from coding_cache import get_cache_key, get_cache_dir, save_atomic
+from tof_utils import bin2depth
+
+## Bump this when the simulation or the decoders change so that old cached cells are not used
+EVALUATION_VERSION = 1
+## Generated schemes that are evaluated in addition to the files in itof_coding_functions/
+GENERATED_SCHEMES = [
+	{'coding': 'fourier', 'k': 4, 'n': 64, 'complementary': False},
+	{'coding': 'fourier', 'k': 4, 'n': 64, 'complementary': True},
+	{'coding': 'fourier', 'k': 8, 'n': 128, 'complementary': False},
+	{'coding': 'fourier', 'k': 8, 'n': 128, 'complementary': True},
+]
+
+def parse_itof_coding_functions_fname(fname: str) -> dict:
+	'''
+		Inverse of itof.get_itof_coding_functions_fname (e.g., k-4-8_n-64_hamilt-complementary.npz)
+	'''
+	(k_str, n_str, coding_str) = os.path.basename(fname).replace('.npz', '').split('_')
+	complementary = coding_str.endswith('-complementary')
+	return {
+		'coding': coding_str.replace('-complementary', ''),
+		'k': int(k_str.split('-')[1]),
+		'n': int(n_str.split('-')[1]),
+		'complementary': complementary,
+	}
+
+def get_scheme_name(scheme: dict) -> str:
+	return get_itof_coding_functions_fname(scheme['coding'], scheme['k'], scheme['n'], scheme['complementary'])
+
+def get_default_schemes(coding_functions_dir: str=ITOF_CODING_FUNCTIONS_DIR) -> list:
+	'''
+		The schemes in coding_functions_dir plus GENERATED_SCHEMES
+	'''
+	schemes = [parse_itof_coding_functions_fname(fpath) for fpath in sorted(glob.glob(os.path.join(coding_functions_dir, '*.npz')))]
+	scheme_names = set([get_scheme_name(scheme) for scheme in schemes])
+	return schemes + [scheme for scheme in GENERATED_SCHEMES if get_scheme_name(scheme) not in scheme_names]
+
+def load_scheme(scheme: dict, coding_functions_dir: str=ITOF_CODING_FUNCTIONS_DIR) -> dict:
+	'''
+		Coding functions (modfs, demodfs, corrfs) of a scheme. They are loaded from coding_functions_dir if they are there
+	'''
+	fpath = os.path.join(coding_functions_dir, get_scheme_name(scheme) + '.npz')
+	if(os.path.exists(fpath)):
+		with np.load(fpath) as data:
+			return {key: data[key] for key in data.files}
+	return generate_coding_functions(scheme['coding'], scheme['k'], scheme['n'], scheme['complementary'])
+
+def get_scheme_sha256(scheme: dict, coding_functions_dir: str=ITOF_CODING_FUNCTIONS_DIR) -> str:
+	'''
+		Hash of the file the coding functions of a scheme are loaded from, or None if they are generated
+	'''
+	fpath = os.path.join(coding_functions_dir, get_scheme_name(scheme) + '.npz')
+	if(not os.path.exists(fpath)): return None
+	with open(fpath, 'rb') as f:
+		return hashlib.sha256(f.read()).hexdigest()
+
+def simulate_measurements(coding_functions: dict, gt_tbins, n_photons, sbr, rng, dtype=np.float32):
+	'''
+		Simulate noisy iToF measurements with a fixed photon budget, so schemes with different K are compared fairly.
+		Arguments:
+			* coding_functions: dict with the NxK corrfs and demodfs
+			* gt_tbins: (M,) ground truth (fractional) time bins. corrfs is linearly interpolated between bins
+			* n_photons: mean number of signal photons summed over the K measurements
+			* sbr: signal-to-background ratio. The background photons (n_photons / sbr) are split across the measurements
+			  proportionally to the mean of each demodulation function
+			* rng: numpy random generator
+		Returns a KxM matrix
+	'''
+	corrfs = coding_functions['corrfs']
+	demodf_means = coding_functions['demodfs'].mean(axis=0)
+	n_tbins = corrfs.shape[0]
+	left_tbins = np.floor(gt_tbins).astype(np.int64) % n_tbins
+	weights = (gt_tbins - np.floor(gt_tbins))[:, np.newaxis]
+	gt_corrfs = (1. - weights)*corrfs[left_tbins] + weights*corrfs[(left_tbins + 1) % n_tbins]
+	signal = n_photons*gt_corrfs / corrfs.mean(axis=0).sum()
+	ambient = (n_photons / sbr)*demodf_means / demodf_means.sum()
+	return rng.poisson(signal + ambient).T.astype(dtype)
+
+def get_candidate_decoders(scheme: dict, coding_functions: dict) -> dict:
+	'''
+		All the decoders that apply to a scheme. Each one maps the KxM measurements to (possibly fractional) time bins.
+		'zncc' (the full search) is always included and is used as the reference
+	'''
+	(n, k) = (scheme['n'], scheme['k'])
+	decoder = Decoder(coding_functions['corrfs'].astype(np.float32), zero_mean=True)
+	candidates = {'zncc': decoder.decode}
+	if(n >= 64):
+		candidates['zncc_coarse_to_fine'] = lambda x: decoder.decode_coarse_to_fine(x, decimation=4, n_candidates=2)
+	## The difference between each measurement and its complement is a scaled zero-mean gray or fourier code
+	if(scheme['complementary'] and (scheme['coding'] == 'gray')):
+		candidates['gray_decode'] = lambda x: gray_decode(x[0:k] - x[k:]) * (n // 2**k)
+	if(scheme['complementary'] and (scheme['coding'] == 'fourier')):
+		candidates['fourier_decode'] = lambda x: fourier_decode(x[0:k] - x[k:], n, k // 2, upsample=1)
+	return candidates
+
+def get_depth_errors(decoded_tbins, gt_tbins, n_tbins, repetition_tau):
+	'''
+		Absolute depth errors taking into account that depths wrap around at the end of the period
+	'''
+	bin_errors = np.abs(decoded_tbins - gt_tbins)
+	bin_errors = np.minimum(bin_errors, n_tbins - bin_errors)
+	return bin2depth(bin_errors, n_tbins, repetition_tau)
+
+def get_cell_key(cell: dict) -> str:
+	'''
+		Key of the cached result of a cell. It covers everything the result depends on: the simulation parameters, the
+		hash of the coding functions file, the tolerance and the names of the candidate decoders
+	'''
+	return get_cache_key('evaluation', dict(cell, version=EVALUATION_VERSION))
+
+def get_cell_seed(cell: dict) -> int:
+	'''
+		Seed of the simulated inputs of a cell. It only depends on the simulation parameters, so changing the tolerance
+		or the decoders does not change the inputs
+	'''
+	inputs = {key: cell[key] for key in ['scheme', 'scheme_sha256', 'n_photons', 'sbr', 'n_pixels']}
+	return int(get_cache_key('evaluation_inputs', dict(inputs, version=EVALUATION_VERSION))[0:16], 16)
+
+def make_cell(scheme: dict, n_photons, sbr, n_pixels: int, repetition_tau: float, n_repeats: int, tolerance: float=0.05, coding_functions_dir: str=ITOF_CODING_FUNCTIONS_DIR) -> dict:
+	'''
+		Description of one cell of the grid (see evaluate_cell)
+	'''
+	decoder_names = list(get_candidate_decoders(scheme, load_scheme(scheme, coding_functions_dir)).keys())
+	return {'scheme': scheme, 'scheme_sha256': get_scheme_sha256(scheme, coding_functions_dir), 'n_photons': n_photons, 'sbr': sbr, 'n_pixels': n_pixels,
+		'repetition_tau': repetition_tau, 'n_repeats': n_repeats, 'tolerance': tolerance, 'decoder_names': decoder_names}
+
+def evaluate_cell(cell: dict, coding_functions_dir: str=ITOF_CODING_FUNCTIONS_DIR) -> dict:
+	'''
+		Evaluate one scheme at one noise level.
+		Arguments:
+			* cell: dict with the scheme, n_photons, sbr, n_pixels, repetition_tau, n_repeats and tolerance (see make_cell).
+			  A decoder can be picked as the fastest one if its depth error is at most (1 + tolerance) times the zncc error
+		Returns the cell with the results of every decoder and the best one
+	'''
+	scheme = cell['scheme']
+	tolerance = cell['tolerance']
+	coding_functions = load_scheme(scheme, coding_functions_dir)
+	n_tbins = coding_functions['corrfs'].shape[0]
+	## Same inputs for the same cell, independently of the order in which the cells are run
+	rng = np.random.default_rng(get_cell_seed(cell))
+	## Continuous depths, so that schemes with fewer bins also pay for their quantization error
+	gt_tbins = n_tbins*rng.random((cell['n_pixels'],))
+	x = simulate_measurements(coding_functions, gt_tbins, cell['n_photons'], cell['sbr'], rng)
+	decoder_results = {}
+	for (name, decode) in get_candidate_decoders(scheme, coding_functions).items():
+		decoded_tbins = decode(x)
+		seconds = np.inf
+		for _ in range(cell['n_repeats']):
+			start_time = time.perf_counter()
+			decode(x)
+			seconds = min(seconds, time.perf_counter() - start_time)
+		depth_errors = get_depth_errors(decoded_tbins, gt_tbins, n_tbins, cell['repetition_tau'])
+		decoder_results[name] = {
+			'depth_mae': float(depth_errors.mean()),
+			'seconds_per_pixel': seconds / cell['n_pixels'],
+			'pixels_per_sec': cell['n_pixels'] / seconds,
+		}
+	max_mae = (1. + tolerance)*decoder_results['zncc']['depth_mae'] + 1e-12
+	valid_decoders = [name for (name, result) in decoder_results.items() if(result['depth_mae'] <= max_mae)]
+	best_decoder = min(valid_decoders, key=lambda name: decoder_results[name]['seconds_per_pixel'])
+	return dict(cell,
+		scheme_name=get_scheme_name(scheme),
+		n_codes=x.shape[0],
+		bytes_per_pixel=x.shape[0]*x.dtype.itemsize,
+		decoders=decoder_results,
+		best_decoder=best_decoder,
+		depth_mae=decoder_results[best_decoder]['depth_mae'],
+		seconds_per_pixel=decoder_results[best_decoder]['seconds_per_pixel'],
+	)
+
+def run_evaluation(schemes=None, n_photons=(100, 1000, 10000), sbrs=(0.1, 1., 10.), n_pixels=20000, repetition_tau=50e-9, n_repeats=3, tolerance=0.05, workers=None, cache_dir=None, use_cache=True, coding_functions_dir: str=ITOF_CODING_FUNCTIONS_DIR) -> list:
+	'''
+		Evaluate every (scheme, n_photons, sbr) cell of the grid. Cells found in the cache are not evaluated again.
+		Arguments:
+			* schemes: list of dicts with coding, k, n and complementary. Defaults to get_default_schemes()
+			* n_photons: mean signal photons per pixel (summed over all measurements)
+			* sbrs: signal-to-background ratios
+			* n_pixels: number of simulated pixels per cell
+			* repetition_tau: period of the modulation (in seconds). It sets the depth range
+			* n_repeats: number of timings of each decoder. The best one is reported
+			* tolerance: relative depth error over zncc allowed for the fastest decoder (see evaluate_cell)
+			* workers: number of worker processes. Defaults to the number of CPUs
+			* cache_dir: where the cell results are saved. Defaults to an evaluation/ folder in coding_cache.get_cache_dir()
+		Returns the list of cell results (see evaluate_cell)
+	'''
+	if(schemes is None): schemes = get_default_schemes(coding_functions_dir)
+	if(cache_dir is None): cache_dir = os.path.join(get_cache_dir(), 'evaluation')
+	cells = []
+	for (scheme, cell_n_photons, sbr) in itertools.product(schemes, n_photons, sbrs):
+		cells.append(make_cell(scheme, cell_n_photons, sbr, n_pixels, repetition_tau, n_repeats, tolerance, coding_functions_dir))
+	results = [None]*len(cells)
+	cell_fpaths = [os.path.join(cache_dir, get_cell_key(cell) + '.json') for cell in cells]
+	missing_indeces = []
+	for (i, fpath) in enumerate(cell_fpaths):
+		if(use_cache and os.path.exists(fpath)):
+			with open(fpath, 'r') as f:
+				results[i] = json.load(f)
+		else:
+			missing_indeces.append(i)
+	if(use_cache): os.makedirs(cache_dir, exist_ok=True)
+	if(len(missing_indeces) > 0):
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			futures = [executor.submit(evaluate_cell, cells[i], coding_functions_dir) for i in missing_indeces]
+			for (i, future) in zip(missing_indeces, futures):
+				results[i] = future.result()
+				if(use_cache): save_atomic(cell_fpaths[i], lambda f: json.dump(results[i], f), mode='w')
+	return results
+
+def get_pareto_front(results: list, cost_key: str='seconds_per_pixel', error_key: str='depth_mae') -> list:
+	'''
+		Results that are not dominated, i.e., no other result has both a lower (or equal) error and a lower (or equal) cost
+		and is strictly better in one of them. Pass the results of a single noise level.
+	'''
+	pareto_front = []
+	for result in results:
+		is_dominated = any([(other[error_key] <= result[error_key]) and (other[cost_key] <= result[cost_key]) and ((other[error_key] < result[error_key]) or (other[cost_key] < result[cost_key])) for other in results])
+		if(not is_dominated): pareto_front.append(result)
+	return sorted(pareto_front, key=lambda result: result[cost_key])
+
+def print_summary(results: list, cost_key: str='seconds_per_pixel'):
+	'''
+		One table per noise level sorted by depth error. Schemes on the pareto front are marked with *
+	'''
+	noise_levels = sorted(set([(result['n_photons'], result['sbr']) for result in results]))
+	for (n_photons, sbr) in noise_levels:
+		level_results = [result for result in results if((result['n_photons'] == n_photons) and (result['sbr'] == sbr))]
+		pareto_names = set([result['scheme_name'] for result in get_pareto_front(level_results, cost_key=cost_key)])
+		print("n_photons = {}, SBR = {}".format(n_photons, sbr))
+		for result in sorted(level_results, key=lambda result: result['depth_mae']):
+			print("    {} {:<35} depth MAE = {:>8.4f} m  {:>12.0f} pixels/s  {:>4} bytes/pixel  ({})".format(
+				'*' if(result['scheme_name'] in pareto_names) else ' ', result['scheme_name'], result['depth_mae'],
+				1. / result['seconds_per_pixel'], result['bytes_per_pixel'], result['best_decoder']))
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Depth accuracy vs. compute evaluation of the iToF coding schemes')
+	parser.add_argument('--n-photons', nargs='+', type=float, default=[100, 1000, 10000], help='mean signal photons per pixel')
+	parser.add_argument('--sbr', nargs='+', type=float, default=[0.1, 1., 10.], help='signal-to-background ratios')
+	parser.add_argument('--schemes', nargs='+', default=None, help='scheme names (e.g., k-4_n-64_hamilt). Defaults to all')
+	parser.add_argument('--n-pixels', type=int, default=20000, help='simulated pixels per cell')
+	parser.add_argument('--repetition-tau', type=float, default=50e-9, help='modulation period in seconds')
+	parser.add_argument('--tolerance', type=float, default=0.05, help='relative depth error over zncc allowed for the fastest decoder')
+	parser.add_argument('--workers', type=int, default=None, help='number of worker processes (defaults to the number of CPUs)')
+	parser.add_argument('--cache-dir', default=None, help='where the results of each cell are saved')
+	parser.add_argument('--no-cache', action='store_true', help='evaluate every cell again and do not save the results')
+	parser.add_argument('--cost', choices=['seconds_per_pixel', 'bytes_per_pixel'], default='seconds_per_pixel', help='cost used for the pareto front')
+	parser.add_argument('--json', default=None, help='save all the results to this JSON file')
+	args = parser.parse_args(argv)
+	schemes = None
+	if(args.schemes is not None): schemes = [parse_itof_coding_functions_fname(name) for name in args.schemes]
+	results = run_evaluation(schemes=schemes, n_photons=args.n_photons, sbrs=args.sbr, n_pixels=args.n_pixels,
+		repetition_tau=args.repetition_tau, tolerance=args.tolerance, workers=args.workers, cache_dir=args.cache_dir, use_cache=(not args.no_cache))
+	print_summary(results, cost_key=args.cost)
+	if(args.json is not None):
+		with open(args.json, 'w') as f:
+			json.dump(results, f, indent=1)
+		print("Saved results to {}".format(args.json))
+
+if __name__=='__main__':
+	main()
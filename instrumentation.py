@@ -0,0 +1,318 @@
+'''
+	Opt-in instrumentation of the encode/decode hot paths.
+
+	enable() replaces the functions in DEFAULT_TARGETS (normalization, correlation, argmax, coding matrix generation,
+	and the encoders) with wrappers that record, for every call:
+	* wall time, thread, and nesting (so the time of zncc_decoding includes the zncc and zero_norm_t inside it)
+	* shapes, dtypes and bytes of the array arguments and of the returned arrays
+	* optionally, the peak of the memory allocated during the call (with tracemalloc, which slows everything down)
+	The wrappers are also placed in every module that imported the functions by name (e.g., the CODING_MATRIX_BUILDERS of
+	coding_cache). disable() puts the original functions back, so nothing is slowed down when instrumentation is off.
+
+	The calls can be exported as a summary table (get_summary / print_summary) or as a Chrome trace JSON
+	(export_chrome_trace) that can be opened in chrome://tracing or https://ui.perfetto.dev
+
+	Look at the main script here to see how it is used
+'''
+## Standard Library Imports
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import importlib
+import tracemalloc
+
+## Library Imports
+import numpy as np
+
+## Local Imports
+
+## module:qualname of the instrumented functions
+DEFAULT_TARGETS = [
+	'decoding:norm_t',
+	'decoding:zero_norm_t',
+	'decoding:zncc',
+	'decoding:ncc',
+	'decoding:zncc_decoding',
+	'decoding:ncc_decoding',
+	'decoding:prepare_coding_matrix',
+	## tiled matmul + argmax used by the chunked decoders and Decoder.decode
+	'decoding:_correlation_argmax_chunked',
+	'decoding:Decoder.normalize',
+	'decoding:Decoder.decode',
+	'decoding:Decoder.decode_subbin',
+	'decoding:Decoder.decode_coarse_to_fine',
+	'decoding:gray_decode',
+	'decoding:hamming_decoding',
+	'decoding:fourier_decode',
+	'tof_utils:zero_norm_t',
+	'tof_utils:circular_corr',
+	'tof_utils:circular_conv',
+	'coding_gray:generate_gray_coding_matrix',
+	'coding_gray:generate_zero_mean_gray_coding_matrix',
+	'coding_gray:generate_n_tbins_gray_coding_matrix',
+	'coding_gray:generate_n_tbins_zero_mean_gray_coding_matrix',
+	'coding_gray:generate_packed_gray_coding_matrix',
+	'coding_gray:uint_to_gray_code_batch',
+	'coding_gray:uint_to_zero_mean_gray_code_batch',
+	'coding_gray:tbin_to_gray_code_batch',
+	'coding_gray:tbin_to_zero_mean_gray_code_batch',
+	'coding_trunc_fourier:generate_trunc_fourier_coding_matrix',
+	'coding_trunc_fourier:uint_to_trunc_fourier_code_batch',
+	'coding_cache:get_coding_matrix',
+]
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+## Instrumentation state. originals maps each target to (owner, attribute name, original function, instrumented function)
+_state = {
+	'enabled': False,
+	'originals': {},
+	'track_allocations': False,
+	'max_events': 0,
+	'events': [],
+	'n_dropped_events': 0,
+	'summary': {},
+	'start_time': 0.,
+	'lock': threading.Lock(),
+}
+## Per-thread call stack, used for the nesting depth and to combine tracemalloc peaks of nested calls
+_local = threading.local()
+
+def _describe_arrays(values) -> tuple:
+	'''
+		(shapes, dtypes, total bytes) of the numpy arrays in values (tuples of arrays are expanded, e.g., decoders that return (argmax, max))
+	'''
+	(shapes, dtypes, n_bytes) = ([], [], 0)
+	for value in values:
+		for arr in (value if(isinstance(value, tuple)) else (value,)):
+			if(isinstance(arr, np.ndarray)):
+				shapes.append(list(arr.shape))
+				dtypes.append(arr.dtype.name)
+				n_bytes += arr.nbytes
+	return (shapes, dtypes, n_bytes)
+
+def _get_stack() -> list:
+	if(not hasattr(_local, 'stack')): _local.stack = []
+	return _local.stack
+
+def _record(name, start_time, seconds, depth, args, kwargs, result, alloc_bytes):
+	(in_shapes, in_dtypes, in_bytes) = _describe_arrays(list(args) + list(kwargs.values()))
+	(out_shapes, _, out_bytes) = _describe_arrays([result])
+	with _state['lock']:
+		summary = _state['summary'].setdefault(name, {'n_calls': 0, 'total_seconds': 0., 'max_seconds': 0., 'in_bytes': 0, 'out_bytes': 0, 'max_alloc_bytes': 0, 'shapes': {}})
+		summary['n_calls'] += 1
+		summary['total_seconds'] += seconds
+		summary['max_seconds'] = max(summary['max_seconds'], seconds)
+		summary['in_bytes'] += in_bytes
+		summary['out_bytes'] += out_bytes
+		if(alloc_bytes is not None): summary['max_alloc_bytes'] = max(summary['max_alloc_bytes'], alloc_bytes)
+		shapes_key = str(in_shapes)
+		summary['shapes'][shapes_key] = summary['shapes'].get(shapes_key, 0) + 1
+		if(len(_state['events']) < _state['max_events']):
+			_state['events'].append({
+				'name': name, 'start_time': start_time, 'seconds': seconds, 'depth': depth, 'tid': threading.get_ident(),
+				'in_shapes': in_shapes, 'in_dtypes': in_dtypes, 'in_bytes': in_bytes, 'out_shapes': out_shapes, 'out_bytes': out_bytes,
+				'alloc_bytes': alloc_bytes,
+			})
+		else:
+			_state['n_dropped_events'] += 1
+
+def _wrap(name, func):
+	'''
+		Wrapper of func that records each call
+	'''
+	@functools.wraps(func)
+	def instrumented(*args, **kwargs):
+		stack = _get_stack()
+		track_allocations = _state['track_allocations'] and tracemalloc.is_tracing()
+		if(track_allocations):
+			(current_bytes, peak_bytes) = tracemalloc.get_traced_memory()
+			## keep the peak of the caller before resetting it for this call
+			if(len(stack) > 0): stack[-1][1] = max(stack[-1][1], peak_bytes)
+			tracemalloc.reset_peak()
+			stack.append([current_bytes, 0])
+		else:
+			stack.append(None)
+		start_time = time.perf_counter()
+		try:
+			result = func(*args, **kwargs)
+		finally:
+			seconds = time.perf_counter() - start_time
+			frame = stack.pop()
+			alloc_bytes = None
+			if(frame is not None):
+				peak_bytes = max(frame[1], tracemalloc.get_traced_memory()[1])
+				alloc_bytes = peak_bytes - frame[0]
+				if(len(stack) > 0 and (stack[-1] is not None)): stack[-1][1] = max(stack[-1][1], peak_bytes)
+		_record(name, start_time, seconds, len(stack), args, kwargs, result, alloc_bytes)
+		return result
+	instrumented.__wrapped_original__ = func
+	return instrumented
+
+def _resolve(target):
+	'''
+		(owner, attribute name) of a module:qualname target. The owner is the module or the class of a method
+	'''
+	(module_name, qualname) = target.split(':')
+	owner = importlib.import_module(module_name)
+	parts = qualname.split('.')
+	for part in parts[:-1]:
+		owner = getattr(owner, part)
+	return (owner, parts[-1])
+
+def _get_repo_modules() -> list:
+	return [module for module in list(sys.modules.values()) if(os.path.dirname(os.path.abspath(getattr(module, '__file__', None) or '/')) == REPO_DIR)]
+
+def _replace_references(original, replacement, name):
+	'''
+		Replace original by replacement in the globals (and module-level dicts) of the loaded modules of this repository,
+		so that functions imported with `from module import name` are also instrumented. Other aliases are left as they are
+	'''
+	for module in _get_repo_modules():
+		for (attr_name, value) in list(vars(module).items()):
+			if((value is original) and (attr_name == name)):
+				setattr(module, attr_name, replacement)
+			elif(isinstance(value, dict) and (not attr_name.startswith('__'))):
+				for (key, dict_value) in list(value.items()):
+					if(dict_value is original): value[key] = replacement
+
+def enable(targets=None, track_allocations: bool=False, max_events: int=10**6):
+	'''
+		Start recording the calls to targets.
+		Arguments:
+			* targets: list of module:qualname strings (e.g., 'decoding:zncc' or 'decoding:Decoder.decode'). Defaults to DEFAULT_TARGETS
+			* track_allocations: record the peak allocated bytes of each call with tracemalloc. It makes numpy code several times slower.
+			  It needs tracemalloc.reset_peak (python >= 3.9). On older versions the allocations are not reported
+			* max_events: max number of calls kept for the Chrome trace. The summary counts every call
+	'''
+	if(_state['enabled']): disable()
+	if(targets is None): targets = DEFAULT_TARGETS
+	reset()
+	## the peak of each call is measured by resetting the peak of tracemalloc, which python 3.8 can not do
+	if(track_allocations and not hasattr(tracemalloc, 'reset_peak')):
+		print("instrumentation: tracemalloc.reset_peak needs python >= 3.9, so allocations are not tracked")
+		track_allocations = False
+	_state['track_allocations'] = track_allocations
+	_state['max_events'] = max_events
+	if(track_allocations and not tracemalloc.is_tracing()):
+		tracemalloc.start()
+		_state['started_tracemalloc'] = True
+	for target in targets:
+		(owner, attr_name) = _resolve(target)
+		original = getattr(owner, attr_name)
+		## keyed by the full target, so that functions with the same name in different modules (e.g., decoding:zero_norm_t
+		## and tof_utils:zero_norm_t) are counted separately
+		instrumented = _wrap(target, original)
+		setattr(owner, attr_name, instrumented)
+		if(not isinstance(owner, type)): _replace_references(original, instrumented, attr_name)
+		_state['originals'][target] = (owner, attr_name, original, instrumented)
+	_state['enabled'] = True
+
+def disable():
+	'''
+		Put the original functions back. The recorded calls are kept until reset() or the next enable()
+	'''
+	for (owner, attr_name, original, instrumented) in _state['originals'].values():
+		setattr(owner, attr_name, original)
+		if(not isinstance(owner, type)): _replace_references(instrumented, original, attr_name)
+	_state['originals'] = {}
+	if(_state.pop('started_tracemalloc', False)): tracemalloc.stop()
+	_state['enabled'] = False
+
+def reset():
+	'''
+		Clear the recorded calls
+	'''
+	with _state['lock']:
+		_state['events'] = []
+		_state['n_dropped_events'] = 0
+		_state['summary'] = {}
+		_state['start_time'] = time.perf_counter()
+
+def is_enabled() -> bool:
+	return _state['enabled']
+
+class instrument:
+	'''
+		Context manager that enables instrumentation inside a with block. Takes the same arguments as enable
+	'''
+	def __init__(self, targets=None, track_allocations: bool=False, max_events: int=10**6):
+		self.kwargs = {'targets': targets, 'track_allocations': track_allocations, 'max_events': max_events}
+
+	def __enter__(self):
+		enable(**self.kwargs)
+		return self
+
+	def __exit__(self, *args):
+		disable()
+
+def get_summary() -> list:
+	'''
+		One dict per instrumented function that was called (named module:qualname), sorted by total time. Nested calls are
+		also counted in their callers (e.g., the decoding:zncc time is part of the decoding:zncc_decoding time)
+	'''
+	with _state['lock']:
+		summary = [dict(stats, name=name) for (name, stats) in _state['summary'].items()]
+	for stats in summary:
+		stats['mean_seconds'] = stats['total_seconds'] / stats['n_calls']
+		stats['bytes_per_sec'] = stats['in_bytes'] / max(stats['total_seconds'], 1e-12)
+		stats['most_common_shapes'] = max(stats['shapes'].items(), key=lambda item: item[1])[0]
+	return sorted(summary, key=lambda stats: stats['total_seconds'], reverse=True)
+
+def print_summary():
+	summary = get_summary()
+	name_width = max([len('function')] + [len(stats['name']) for stats in summary])
+	print("{:<{}} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}  {}".format('function', name_width, 'calls', 'total (s)', 'mean (ms)', 'max (ms)', 'in MB', 'alloc MB', 'most common input shapes'))
+	for stats in summary:
+		print("{:<{}} {:>8} {:>10.4f} {:>10.3f} {:>10.3f} {:>10.1f} {:>10.1f}  {}".format(
+			stats['name'], name_width, stats['n_calls'], stats['total_seconds'], 1e3*stats['mean_seconds'], 1e3*stats['max_seconds'],
+			stats['in_bytes'] / 2**20, stats['max_alloc_bytes'] / 2**20, stats['most_common_shapes']))
+	if(_state['n_dropped_events'] > 0): print("{} calls were not kept for the trace (max_events)".format(_state['n_dropped_events']))
+
+def get_chrome_trace() -> dict:
+	'''
+		Recorded calls in the Chrome trace event format (complete events with microsecond timestamps)
+	'''
+	pid = os.getpid()
+	with _state['lock']:
+		events = list(_state['events'])
+	trace_events = []
+	for event in events:
+		args = {key: event[key] for key in ['in_shapes', 'in_dtypes', 'in_bytes', 'out_shapes', 'out_bytes', 'alloc_bytes']}
+		trace_events.append({
+			'name': event['name'], 'cat': 'tof_coding', 'ph': 'X', 'pid': pid, 'tid': event['tid'],
+			'ts': 1e6*(event['start_time'] - _state['start_time']), 'dur': 1e6*event['seconds'], 'args': args,
+		})
+	return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+def export_chrome_trace(fpath: str):
+	'''
+		Save the recorded calls as a Chrome trace JSON file
+	'''
+	with open(fpath, 'w') as f:
+		json.dump(get_chrome_trace(), f)
+
+if __name__=='__main__':
+	import tempfile
+	import coding_cache
+	from decoding import zncc_decoding, Decoder
+	from compressive_histogram import CompressiveHistogram
+
+	## Set parameters
+	n_pixels = 20000
+	n_tbins = 1024
+	tstamps = np.random.randint(0, n_tbins, size=(n_pixels,))
+
+	with instrument(track_allocations=True):
+		coding_cache.clear_memory_cache()
+		hist = CompressiveHistogram(n_pixels, n_tbins, coding_scheme='trunc_fourier', n_freqs=8)
+		hist.update(np.arange(n_pixels), tstamps)
+		C = hist.get_coding_matrix()
+		decoded = zncc_decoding(hist.coded_hist.T, C)
+		decoded = Decoder(C).decode(hist.coded_hist.T)
+	print_summary()
+	trace_fpath = os.path.join(tempfile.gettempdir(), 'instrumentation_trace.json')
+	export_chrome_trace(trace_fpath)
+	print("Saved {}. Open it in chrome://tracing or https://ui.perfetto.dev".format(trace_fpath))
@@ -0,0 +1,225 @@
+'''
+	Generation of the coding functions used in indirect ToF (iToF).
+
+	Each coding scheme is made of K modulation functions (modfs), K demodulation functions (demodfs), and the K
+	correlation functions between them (corrfs). All of them are stored as NxK matrices.
+	The supported schemes are:
+	* gray: the modulation function is a perfect pulse and the demodulation functions are gray codes
+	* hamilt: hamiltonian codes for K=3,4,5. The modulation functions are square pulses with a small duty cycle and the
+	  demodulation functions are binary functions made of on/off segments
+	* fourier: the modulation function is a perfect pulse and the demodulation functions are sinusoids (truncated fourier codes scaled to [0,1])
+	* Any other binary demodulation functions can be described by their duty segments (see generate_segment_coding_functions)
+
+	"Complementary" codes add, for each demodulation function, its negated (180 degrees shifted) version.
+
+	Run `python itof.py --help` to see how to generate a parameter sweep of .npz files from the command line.
+'''
+## Standard Library Imports
+import os
+import math
+
+## Library Imports
+import numpy as np
+
+## Local Imports
+from coding_gray import generate_gray_coding_matrix
+from coding_trunc_fourier import generate_trunc_fourier_coding_matrix
+from tof_utils import circular_corr
+
+CODING_SCHEMES = ['gray', 'hamilt', 'fourier']
+ITOF_CODING_FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'itof_coding_functions')
+
+## Duty segments of the hamiltonian codes. Each demodulation function is a list of segment durations (as fractions of
+## the period) that alternate between on and off, starting with on, and a circular shift (also as a fraction of the period).
+## end_trim is the number of samples removed from the end of each on segment.
+HAMILTONIAN_SPECS = {
+	3: {
+		'mod_duty': 1./6.,
+		'demod_durations': [[1./2., 1./2.]]*3,
+		'demod_shifts': [0., 1./3., 2./3.],
+		'end_trim': 0,
+	},
+	4: {
+		'mod_duty': 1./12.,
+		'demod_durations': [[6./12., 6./12.], [6./12., 6./12.], [3./12., 4./12., 3./12., 2./12.], [2./12., 3./12, 4./12., 3./12.]],
+		'demod_shifts': [5./12., 2./12., 0./12., 4./12.],
+		'end_trim': 1,
+	},
+	5: {
+		'mod_duty': 1./30.,
+		'demod_durations': [
+			[15./30., 15./30.],
+			[15./30., 15./30.],
+			[8./30., 8./30., 7./30., 7./30.],
+			[4./30., 4./30., 4./30., 4./30., 3./30., 4./30., 4./30., 3./30.],
+			[2./30., 2./30., 2./30., 2./30., 2./30., 2./30., 2./30., 3./30., 2./30., 2./30., 2./30., 2./30., 3./30., 2./30],
+		],
+		'demod_shifts': [15./30., 7./30., 3./30., 1./30., 4./30.],
+		'end_trim': 1,
+	},
+}
+
+def get_itof_coding_functions_fname(coding: str, k: int, n: int, complementary: bool=False) -> str:
+	'''
+		Name of the .npz file for a set of iToF coding functions (e.g., k-4_n-64_hamilt or k-4-8_n-64_hamilt-complementary)
+	'''
+	if(complementary): return 'k-{}-{}_n-{}_{}-complementary'.format(k, 2*k, n, coding)
+	return 'k-{}_n-{}_{}'.format(k, n, coding)
+
+def variable_duty_cycle_functions(n: int, k: int, duty_cycle: float) -> np.ndarray:
+	'''
+		NxK square pulses that are on for the first duty_cycle fraction of the period. Their area is (approximately) n
+	'''
+	assert(duty_cycle <= 1.), "duty cycle should be smaller than 1"
+	X = np.zeros((n, k))
+	X[0:math.floor(duty_cycle*n), :] = 1. / duty_cycle
+	return X
+
+def pulse_functions(n: int, k: int) -> np.ndarray:
+	'''
+		NxK perfect pulses with area n
+	'''
+	X = np.zeros((n, k))
+	X[0, :] = 1.*n
+	return X
+
+def rasterize_duty_segments(n: int, demod_durations, demod_shifts, end_trim: int=1) -> np.ndarray:
+	'''
+		Rasterize binary demodulation functions described by their duty segments into an NxK matrix.
+		Arguments:
+			* n: number of samples per period
+			* demod_durations: list with K lists of segment durations (fractions of the period). Segments alternate
+			  between on and off, starting with on
+			* demod_shifts: list with the K circular shifts (fractions of the period)
+			* end_trim: number of samples removed from the end of each on segment
+	'''
+	assert(len(demod_durations) == len(demod_shifts)), "need one shift per demodulation function"
+	k = len(demod_durations)
+	samples = np.arange(0, n)
+	unshifted_demodfs = np.zeros((n, k))
+	for (i, durations) in enumerate(demod_durations):
+		durations = np.asarray(durations, dtype=np.float64)
+		## every other segment is on
+		start_indeces = np.floor((np.cumsum(durations) - durations)*n)[0::2]
+		end_indeces = (start_indeces + np.floor(durations*n)[0::2]) - end_trim
+		is_on = (samples[:, np.newaxis] >= start_indeces) & (samples[:, np.newaxis] < end_indeces)
+		unshifted_demodfs[:, i] = np.any(is_on, axis=1)
+	## Circular shift of each column (same as np.roll)
+	shifts = np.array([int(round(shift*n)) for shift in demod_shifts])
+	return unshifted_demodfs[(samples[:, np.newaxis] - shifts[np.newaxis, :]) % n, np.arange(k)]
+
+def generate_segment_coding_functions(n: int, mod_duty: float, demod_durations, demod_shifts, end_trim: int=1):
+	'''
+		Modulation and demodulation functions for a user-supplied duty-segment spec (see rasterize_duty_segments)
+		Returns (modfs, demodfs), each an NxK matrix
+	'''
+	demodfs = rasterize_duty_segments(n, demod_durations, demod_shifts, end_trim=end_trim)
+	modfs = variable_duty_cycle_functions(n=n, k=demodfs.shape[-1], duty_cycle=mod_duty)
+	return (modfs, demodfs)
+
+def generate_hamiltonian_functions(k: int, n: int):
+	'''
+		Modulation and demodulation functions for the hamiltonian codes with K=3,4,5
+		Returns (modfs, demodfs), each an NxK matrix
+	'''
+	assert(k in HAMILTONIAN_SPECS), "Hamiltonian codes are only defined for K={}".format(list(HAMILTONIAN_SPECS.keys()))
+	return generate_segment_coding_functions(n, **HAMILTONIAN_SPECS[k])
+
+def generate_gray_functions(k: int, n: int):
+	'''
+		Pulse modulation and k-bit gray code demodulation functions. n should be a multiple of 2^k
+		Returns (modfs, demodfs), each an NxK matrix
+	'''
+	assert((n % (2**k)) == 0), "n should be a multiple of 2^k"
+	## each gray code is held for n / 2^k samples
+	demodfs = np.repeat(generate_gray_coding_matrix(k), n // (2**k), axis=0)
+	return (pulse_functions(n, k), demodfs)
+
+def generate_fourier_functions(k: int, n: int):
+	'''
+		Pulse modulation and sinusoidal demodulation functions (k/2 frequencies with a cos and a sin each) in [0,1]
+		Returns (modfs, demodfs), each an NxK matrix
+	'''
+	assert((k % 2) == 0), "fourier codes need an even number of codes"
+	demodfs = 0.5*(1. + generate_trunc_fourier_coding_matrix(n, k // 2, include_zeroth_harmonic=False))
+	return (pulse_functions(n, k), demodfs)
+
+FUNCTION_GENERATORS = {
+	'gray': generate_gray_functions,
+	'hamilt': generate_hamiltonian_functions,
+	'fourier': generate_fourier_functions,
+}
+
+def make_complementary(modfs, demodfs):
+	'''
+		Append the negated version of each binary demodulation function (and a copy of its modulation function)
+	'''
+	complementary_demodfs = np.concatenate((demodfs, 1. - demodfs), axis=1)
+	complementary_modfs = np.concatenate((modfs, modfs), axis=1)
+	return (complementary_modfs, complementary_demodfs)
+
+def compute_corrfs(modfs, demodfs):
+	'''
+		Correlation functions for all K columns at once, normalized by the number of samples
+	'''
+	return circular_corr(modfs, demodfs, axis=0) / modfs.shape[0]
+
+def generate_coding_functions(coding: str, k: int, n: int, complementary: bool=False) -> dict:
+	'''
+		Generate the modulation, demodulation and correlation functions for one of the CODING_SCHEMES
+		Returns a dict with the modfs, demodfs and corrfs NxK matrices (Nx2K if complementary)
+	'''
+	assert(coding in FUNCTION_GENERATORS), "coding should be one of {}".format(list(FUNCTION_GENERATORS.keys()))
+	(modfs, demodfs) = FUNCTION_GENERATORS[coding](k, n)
+	if(complementary): (modfs, demodfs) = make_complementary(modfs, demodfs)
+	return {'modfs': modfs, 'demodfs': demodfs, 'corrfs': compute_corrfs(modfs, demodfs)}
+
+def save_coding_functions(out_dir: str, coding: str, k: int, n: int, complementary: bool=False) -> str:
+	'''
+		Generate a set of coding functions and save them in out_dir with the k-*_n-* naming. Returns the path of the file
+	'''
+	coding_functions = generate_coding_functions(coding, k, n, complementary)
+	os.makedirs(out_dir, exist_ok=True)
+	fpath = os.path.join(out_dir, get_itof_coding_functions_fname(coding, k, n, complementary) + '.npz')
+	np.savez(fpath, **coding_functions)
+	return fpath
+
+def load_coding_functions(coding: str, k: int, n: int, complementary: bool=False, coding_functions_dir: str=ITOF_CODING_FUNCTIONS_DIR) -> dict:
+	'''
+		Load a set of coding functions saved with save_coding_functions
+	'''
+	fpath = os.path.join(coding_functions_dir, get_itof_coding_functions_fname(coding, k, n, complementary) + '.npz')
+	with np.load(fpath) as data:
+		return {key: data[key] for key in data.files}
+
+def _save_coding_functions_star(args):
+	return save_coding_functions(*args)
+
+def main(argv=None):
+	## Only needed by the command line tool, so importing itof stays cheap
+	import argparse
+	import itertools
+	from concurrent.futures import ProcessPoolExecutor
+
+	parser = argparse.ArgumentParser(description='Generate a parameter sweep of iToF coding functions as .npz files')
+	parser.add_argument('--coding', nargs='+', default=['hamilt'], choices=CODING_SCHEMES, help='coding schemes to generate')
+	parser.add_argument('--k', nargs='+', type=int, default=[3, 4, 5], help='number of codes (K)')
+	parser.add_argument('--n', nargs='+', type=int, default=[64, 128], help='number of samples per period (N)')
+	parser.add_argument('--complementary', choices=['no', 'yes', 'both'], default='both', help='generate the complementary codes')
+	parser.add_argument('--out-dir', default=ITOF_CODING_FUNCTIONS_DIR, help='output directory')
+	parser.add_argument('--workers', type=int, default=None, help='number of worker processes (defaults to the number of CPUs)')
+	args = parser.parse_args(argv)
+	complementary_options = {'no': [False], 'yes': [True], 'both': [False, True]}[args.complementary]
+	sweep = []
+	for (coding, k, n, complementary) in itertools.product(args.coding, args.k, args.n, complementary_options):
+		## skip the combinations that a scheme does not support
+		if((coding == 'hamilt') and (k not in HAMILTONIAN_SPECS)): continue
+		if((coding == 'gray') and ((n % (2**k)) != 0)): continue
+		if((coding == 'fourier') and (((k % 2) != 0) or (k >= n))): continue
+		sweep.append((args.out_dir, coding, k, n, complementary))
+	with ProcessPoolExecutor(max_workers=args.workers) as executor:
+		for fpath in executor.map(_save_coding_functions_star, sweep):
+			print("Saved {}".format(fpath))
+
+if __name__=='__main__':
+	main()
@@ -0,0 +1,136 @@
+'''
+	Decode coded frames on multiple cores.
+
+	The pixels of all the frames are split into blocks that are decoded by a pool of threads or processes.
+	* With threads, all workers read the same arrays (numpy releases the GIL in the matmul and argmax)
+	* With processes, the frames, the normalized coding matrix, and the output are placed in shared memory,
+	  so only the block indeces are pickled
+	When using many workers, limit the threads used by BLAS in each worker (e.g., OMP_NUM_THREADS=1) to avoid oversubscription.
+'''
+## Standard Library Imports
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+## Library Imports
+import numpy as np
+
+## Local Imports
+from decoding import Decoder
+
+BACKENDS = ['thread', 'process']
+
+## Arrays attached to shared memory in each worker process (set by _init_process_worker)
+_worker_state = {}
+
+def _decode_block(decoder, frames_2d, out, start_pixel, end_pixel):
+	'''
+		Decode the pixels [start_pixel, end_pixel) of the (n_pixels, K) frames and write them to out.
+		Returns (worker_id, n_pixels, seconds)
+	'''
+	start_time = time.perf_counter()
+	out[start_pixel:end_pixel] = decoder.decode(frames_2d[start_pixel:end_pixel].T)
+	worker_id = '{}-{}'.format(os.getpid(), threading.current_thread().name)
+	return (worker_id, end_pixel - start_pixel, time.perf_counter() - start_time)
+
+def _attach_shared_array(shm_name, shape, dtype):
+	shm = shared_memory.SharedMemory(name=shm_name)
+	return (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+def _init_process_worker(frames_spec, norm_C_t_spec, out_spec, zero_mean, max_bytes):
+	'''
+		Attach the shared frames, coding matrix and output in a worker process
+	'''
+	(frames_shm, frames_2d) = _attach_shared_array(*frames_spec)
+	(norm_C_t_shm, norm_C_t) = _attach_shared_array(*norm_C_t_spec)
+	(out_shm, out) = _attach_shared_array(*out_spec)
+	## Keep a reference to the SharedMemory objects, otherwise the buffers get closed
+	_worker_state['shms'] = [frames_shm, norm_C_t_shm, out_shm]
+	_worker_state['frames_2d'] = frames_2d
+	_worker_state['out'] = out
+	_worker_state['decoder'] = Decoder.from_prepared_matrix(norm_C_t, zero_mean=zero_mean, max_bytes=max_bytes)
+
+def _decode_block_in_process(start_pixel, end_pixel):
+	return _decode_block(_worker_state['decoder'], _worker_state['frames_2d'], _worker_state['out'], start_pixel, end_pixel)
+
+def _to_shared_memory(arr):
+	'''
+		Copy arr into a new shared memory block. Returns (shm, shared_arr, spec) where spec is what workers need to attach to it
+	'''
+	shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+	shared_arr = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+	shared_arr[...] = arr
+	return (shm, shared_arr, (shm.name, arr.shape, arr.dtype.str))
+
+def decode_frames(frames, C, workers=None, backend='thread', zero_mean=True, dtype=None, block_size=16384, max_bytes=2**25, return_stats=False):
+	'''
+		Decode every pixel of a stack of coded frames in parallel.
+		Arguments:
+			* frames: (..., K) array of coded values (e.g., (n_frames, H, W, K))
+			* C: NxK coding matrix
+			* workers: number of threads or processes. Defaults to the number of CPUs
+			* backend: 'thread' or 'process'
+			* zero_mean: use zncc if True, else ncc (see Decoder)
+			* dtype: float type used for decoding (see Decoder)
+			* block_size: number of pixels decoded by each task
+			* max_bytes: max size of the correlation table tiles used by each worker
+			* return_stats: also return the throughput of each worker
+		Returns:
+			* decoded: (...) array with the decoded row of C for each pixel
+			* stats (only if return_stats): dict with the total pixels/s and the pixels, seconds and pixels/s of each worker
+	'''
+	assert(backend in BACKENDS), "backend should be one of {}".format(BACKENDS)
+	assert(frames.shape[-1] == C.shape[-1]), "the last dimension of frames should have the K codes"
+	if(workers is None): workers = os.cpu_count()
+	start_time = time.perf_counter()
+	decoder = Decoder(C, zero_mean=zero_mean, dtype=dtype, max_bytes=max_bytes)
+	frames_2d = frames.reshape((-1, frames.shape[-1]))
+	n_pixels = frames_2d.shape[0]
+	blocks = [(start_pixel, min(start_pixel + block_size, n_pixels)) for start_pixel in range(0, n_pixels, block_size)]
+	if(backend == 'thread'):
+		out = np.zeros((n_pixels,), dtype=np.int64)
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			block_stats = list(executor.map(lambda block: _decode_block(decoder, frames_2d, out, *block), blocks))
+	else:
+		shms = []
+		try:
+			(frames_shm, _, frames_spec) = _to_shared_memory(np.ascontiguousarray(frames_2d))
+			shms.append(frames_shm)
+			(norm_C_t_shm, _, norm_C_t_spec) = _to_shared_memory(decoder.norm_C_t)
+			shms.append(norm_C_t_shm)
+			(out_shm, shared_out, out_spec) = _to_shared_memory(np.zeros((n_pixels,), dtype=np.int64))
+			shms.append(out_shm)
+			with ProcessPoolExecutor(max_workers=workers, initializer=_init_process_worker, initargs=(frames_spec, norm_C_t_spec, out_spec, zero_mean, max_bytes)) as executor:
+				block_stats = list(executor.map(_decode_block_in_process, *zip(*blocks)))
+			out = shared_out.copy()
+		finally:
+			for shm in shms:
+				shm.close()
+				shm.unlink()
+	total_seconds = time.perf_counter() - start_time
+	decoded = out.reshape(frames.shape[:-1])
+	if(not return_stats): return decoded
+	worker_stats = {}
+	for (worker_id, n_block_pixels, seconds) in block_stats:
+		stats = worker_stats.setdefault(worker_id, {'n_pixels': 0, 'seconds': 0.})
+		stats['n_pixels'] += n_block_pixels
+		stats['seconds'] += seconds
+	for stats in worker_stats.values():
+		stats['pixels_per_sec'] = stats['n_pixels'] / max(stats['seconds'], 1e-12)
+	return (decoded, {'n_pixels': n_pixels, 'seconds': total_seconds, 'pixels_per_sec': n_pixels / total_seconds, 'workers': worker_stats})
+
+if __name__=='__main__':
+	from coding_cache import get_coding_matrix
+
+	## Decode a short depth video coded with truncated fourier codes
+	(n_frames, height, width) = (8, 120, 160)
+	n_tbins = 2048
+	n_freqs = 8
+	C = get_coding_matrix('trunc_fourier', domain_len=n_tbins, n_freqs=n_freqs, include_zeroth_harmonic=False)
+	frames = np.random.rand(n_frames, height, width, 2*n_freqs).astype(np.float32)
+	for backend in BACKENDS:
+		for workers in [1, 2, 4]:
+			(decoded, stats) = decode_frames(frames, C.astype(np.float32), workers=workers, backend=backend, return_stats=True)
+			print("backend = {:<8} workers = {}: {:>10.0f} pixels/s".format(backend, workers, stats['pixels_per_sec']))
@@ -0,0 +1,267 @@
+'''
+	Streaming depth pipeline: SPAD timestamps -> coded histograms -> depth maps.
+
+	Each stage runs in its own thread and the stages are connected by bounded queues:
+	* ingest: pulls (pixel_ids, tstamps) chunks from the photon stream (e.g., spad_simulator.simulate_photon_stream)
+	* encode: encodes each chunk of timestamps (see CompressiveHistogram.encode)
+	* accumulate: adds the codes to the coded sums of their pixels. A frame is emitted when the stream yields END_OF_FRAME
+	* decode: decodes the coded sums of each frame (Decoder.decode by default)
+	* depth: converts the decoded time bins to depth (see tof_utils.bin2depth)
+	Every END_OF_FRAME gives one depth map, so the outputs stay aligned with the input frames. Pixels that got no photons
+	in a frame (or every pixel of a frame without photons) are not decoded and get NaN depths.
+	When a stage is slower than the ones before it, their queues fill up and they block (backpressure), so memory stays
+	bounded by queue_size items per stage. numpy releases the GIL in the heavy operations, so the stages overlap.
+
+	Each stage counts its items, its units (photons or pixels), the time it is busy, and the time it waits for input
+	and for space in its output queue. The stage with the most busy time is the bottleneck.
+
+	Look at the main script here to see how it is used
+'''
+## Standard Library Imports
+import time
+import queue
+import threading
+
+## Library Imports
+import numpy as np
+
+## Local Imports
+from compressive_histogram import CompressiveHistogram
+from decoding import Decoder
+from tof_utils import bin2depth
+
+STAGE_NAMES = ['ingest', 'encode', 'accumulate', 'decode', 'depth']
+## Yield this from the photon stream to close the current frame
+END_OF_FRAME = None
+
+## Marks the end of the stream in the queues
+_END_OF_STREAM = object()
+
+class _StageError:
+	'''
+		Exception raised by a stage. It is passed down the queues so that the consumer re-raises it
+	'''
+	def __init__(self, stage_name, exception):
+		self.stage_name = stage_name
+		self.exception = exception
+
+class StageStats:
+	'''
+		Counters of one pipeline stage. They are only written by the thread of the stage, so they can be read while it runs
+	'''
+	def __init__(self, name: str, unit: str):
+		self.name = name
+		self.unit = unit
+		self.n_items = 0
+		self.n_units = 0
+		self.busy_seconds = 0.
+		self.wait_input_seconds = 0.
+		self.wait_output_seconds = 0.
+
+	def as_dict(self) -> dict:
+		return {
+			'name': self.name,
+			'unit': self.unit,
+			'n_items': self.n_items,
+			'n_units': self.n_units,
+			'busy_seconds': self.busy_seconds,
+			'wait_input_seconds': self.wait_input_seconds,
+			'wait_output_seconds': self.wait_output_seconds,
+			'units_per_sec': self.n_units / max(self.busy_seconds, 1e-12),
+			'mean_latency_ms': 1e3*self.busy_seconds / max(self.n_items, 1),
+		}
+
+class StreamingDepthPipeline:
+	'''
+		Threaded pipeline that turns a stream of photon chunks into a stream of depth maps.
+		Arguments:
+			* frame_shape: shape of each depth map (e.g., (H, W)). The pixel ids of the stream index the flattened frame
+			* n_tbins, coding_scheme, n_freqs, dtype: see CompressiveHistogram
+			* repetition_tau: duration of each laser cycle (in seconds)
+			* decode_fn: function that maps the KxM coded sums of a frame to M (fractional) time bins. Defaults to
+			  Decoder(C).decode with the coding matrix of the histogram (use Decoder(C).decode_subbin for sub-bin depths)
+			* queue_size: max number of items waiting between two stages
+	'''
+	def __init__(self, frame_shape, n_tbins: int, repetition_tau: float, coding_scheme: str='zero_mean_gray', n_freqs: int=None, dtype=np.float32, decode_fn=None, queue_size: int=4):
+		assert(queue_size >= 1), "queue_size should be positive"
+		self.frame_shape = tuple(frame_shape)
+		self.n_pixels = int(np.prod(self.frame_shape))
+		self.n_tbins = n_tbins
+		self.repetition_tau = repetition_tau
+		self.queue_size = queue_size
+		self.hist = CompressiveHistogram(self.n_pixels, n_tbins, coding_scheme=coding_scheme, n_freqs=n_freqs, dtype=dtype)
+		if(decode_fn is None): decode_fn = Decoder(self.hist.get_coding_matrix()).decode
+		self.decode_fn = decode_fn
+		self.stats = {name: StageStats(name, 'photons' if(name in STAGE_NAMES[:3]) else 'pixels') for name in STAGE_NAMES}
+		## chunks were accumulated since the last frame was emitted
+		self._is_frame_open = False
+
+	def _encode(self, chunk):
+		if(chunk is END_OF_FRAME): return [END_OF_FRAME]
+		(pixel_ids, tstamps) = chunk
+		return [(pixel_ids, self.hist.encode(tstamps))]
+
+	def _accumulate(self, chunk):
+		if(chunk is END_OF_FRAME): return self._flush_frame()
+		self.hist.update_codes(*chunk)
+		self._is_frame_open = True
+		return []
+
+	def _flush_frame(self):
+		'''
+			Emit the coded sums of the current frame and which pixels got photons, and start a new one
+		'''
+		has_photons = self.hist.n_photons > 0
+		coded_hist = self.hist.coded_hist.copy()
+		self.hist.reset()
+		self._is_frame_open = False
+		return [(coded_hist, has_photons)]
+
+	def _decode(self, frame):
+		(coded_hist, has_photons) = frame
+		if(has_photons.all()): return [self.decode_fn(coded_hist.T)]
+		decoded_tbins = np.full((self.n_pixels,), np.nan)
+		if(has_photons.any()): decoded_tbins[has_photons] = self.decode_fn(coded_hist[has_photons].T)
+		return [decoded_tbins]
+
+	def _depth(self, decoded_tbins):
+		return [bin2depth(np.asarray(decoded_tbins, dtype=np.float64), self.n_tbins, self.repetition_tau).reshape(self.frame_shape)]
+
+	def _count_units(self, stage_name, item):
+		if(item is END_OF_FRAME): return 0
+		if(stage_name in STAGE_NAMES[:3]): return len(item[0])
+		return self.n_pixels
+
+	def _put(self, out_queue, item, stop_event, stats):
+		start_time = time.perf_counter()
+		while(not stop_event.is_set()):
+			try:
+				out_queue.put(item, timeout=0.1)
+				break
+			except queue.Full:
+				continue
+		stats.wait_output_seconds += time.perf_counter() - start_time
+
+	def _run_source(self, photon_stream, out_queue, stop_event):
+		stats = self.stats['ingest']
+		try:
+			iterator = iter(photon_stream)
+			while(not stop_event.is_set()):
+				start_time = time.perf_counter()
+				chunk = next(iterator, _END_OF_STREAM)
+				if(chunk is _END_OF_STREAM): break
+				stats.busy_seconds += time.perf_counter() - start_time
+				stats.n_items += int(chunk is not END_OF_FRAME)
+				stats.n_units += self._count_units('ingest', chunk)
+				self._put(out_queue, chunk, stop_event, stats)
+			self._put(out_queue, _END_OF_STREAM, stop_event, stats)
+		except Exception as e:
+			self._put(out_queue, _StageError('ingest', e), stop_event, stats)
+
+	def _run_stage(self, stage_name, stage_fn, in_queue, out_queue, stop_event):
+		stats = self.stats[stage_name]
+		try:
+			while(not stop_event.is_set()):
+				start_time = time.perf_counter()
+				try:
+					item = in_queue.get(timeout=0.1)
+				except queue.Empty:
+					stats.wait_input_seconds += time.perf_counter() - start_time
+					continue
+				stats.wait_input_seconds += time.perf_counter() - start_time
+				if(isinstance(item, _StageError)):
+					self._put(out_queue, item, stop_event, stats)
+					return
+				start_time = time.perf_counter()
+				if(item is _END_OF_STREAM):
+					## the last frame does not need an END_OF_FRAME, but a stream that ends with one has no frame left
+					outputs = self._flush_frame() if((stage_name == 'accumulate') and self._is_frame_open) else []
+				else:
+					outputs = stage_fn(item)
+					stats.n_items += int(item is not END_OF_FRAME)
+					stats.n_units += self._count_units(stage_name, item)
+				stats.busy_seconds += time.perf_counter() - start_time
+				for output in outputs + ([item] if(item is _END_OF_STREAM) else []):
+					self._put(out_queue, output, stop_event, stats)
+				if(item is _END_OF_STREAM): return
+		except Exception as e:
+			self._put(out_queue, _StageError(stage_name, e), stop_event, stats)
+
+	def run(self, photon_stream):
+		'''
+			Generator of the depth map (with shape frame_shape, in meters) of each frame of photon_stream.
+			photon_stream yields (pixel_ids, tstamps) chunks, and END_OF_FRAME after the last chunk of each frame.
+			Each END_OF_FRAME gives one depth map, even if the frame got no photons (then all its depths are NaN).
+			Closing the generator early stops all the stages
+		'''
+		for stats in self.stats.values():
+			stats.__init__(stats.name, stats.unit)
+		self.hist.reset()
+		self._is_frame_open = False
+		stop_event = threading.Event()
+		queues = [queue.Queue(maxsize=self.queue_size) for _ in STAGE_NAMES]
+		stage_fns = [self._encode, self._accumulate, self._decode, self._depth]
+		threads = [threading.Thread(target=self._run_source, args=(photon_stream, queues[0], stop_event), name='ingest', daemon=True)]
+		for (i, (stage_name, stage_fn)) in enumerate(zip(STAGE_NAMES[1:], stage_fns)):
+			threads.append(threading.Thread(target=self._run_stage, args=(stage_name, stage_fn, queues[i], queues[i+1], stop_event), name=stage_name, daemon=True))
+		for thread in threads:
+			thread.start()
+		try:
+			while(True):
+				item = queues[-1].get()
+				if(item is _END_OF_STREAM): break
+				if(isinstance(item, _StageError)):
+					raise RuntimeError("the {} stage failed".format(item.stage_name)) from item.exception
+				yield item
+		finally:
+			stop_event.set()
+			for thread in threads:
+				thread.join()
+
+	def get_stats(self) -> list:
+		'''
+			Counters of each stage as a list of dicts (see StageStats.as_dict)
+		'''
+		return [self.stats[name].as_dict() for name in STAGE_NAMES]
+
+	def get_bottleneck(self) -> str:
+		'''
+			Name of the stage that was busy the longest
+		'''
+		return max(STAGE_NAMES, key=lambda name: self.stats[name].busy_seconds)
+
+	def print_stats(self):
+		print("{:<12} {:>8} {:>12} {:>10} {:>12} {:>10} {:>10} {:>16}".format('stage', 'items', 'units', 'busy (s)', 'latency (ms)', 'wait in', 'wait out', 'throughput'))
+		for stats in self.get_stats():
+			print("{:<12} {:>8} {:>12} {:>10.3f} {:>12.3f} {:>10.3f} {:>10.3f} {:>9.2e} {}/s".format(
+				stats['name'], stats['n_items'], stats['n_units'], stats['busy_seconds'], stats['mean_latency_ms'],
+				stats['wait_input_seconds'], stats['wait_output_seconds'], stats['units_per_sec'], stats['unit']))
+		print("bottleneck: {}".format(self.get_bottleneck()))
+
+if __name__=='__main__':
+	from spad_simulator import simulate_photon_stream
+
+	## Set parameters
+	(height, width) = (64, 64)
+	n_tbins = 1024
+	repetition_tau = 100e-9
+	n_frames = 8
+	n_cycles_per_frame = 5000
+	max_depth = bin2depth(n_tbins, n_tbins, repetition_tau)
+
+	## A plane that moves away from the camera
+	def get_frame_depths(frame_id):
+		return np.full((height, width), (0.1 + 0.8*frame_id / n_frames)*max_depth)
+
+	def photon_stream():
+		for frame_id in range(n_frames):
+			yield from simulate_photon_stream(get_frame_depths(frame_id), n_cycles_per_frame, n_tbins, repetition_tau, signal_flux=0.01, ambient_flux=0.05, pulse_width=2., max_photons_per_chunk=2**16, seed=frame_id)
+			yield END_OF_FRAME
+
+	for (coding_scheme, n_freqs) in [('zero_mean_gray', None), ('trunc_fourier', 8)]:
+		pipeline = StreamingDepthPipeline((height, width), n_tbins, repetition_tau, coding_scheme=coding_scheme, n_freqs=n_freqs)
+		start_time = time.perf_counter()
+		for (frame_id, depths) in enumerate(pipeline.run(photon_stream())):
+			print("    frame {}: mean absolute depth error = {:.3f} m".format(frame_id, np.abs(depths - get_frame_depths(frame_id)).mean()))
+		print("{} coding: {} frames in {:.2f} s".format(coding_scheme, n_frames, time.perf_counter() - start_time))
+		pipeline.print_stats()
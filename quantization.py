@@ -0,0 +1,145 @@
+'''
+	Low-precision accumulation and decoding of coded histograms.
+
+	Each mode in QUANTIZATION_MODES sets the dtype of the codes of each timestamp and the dtype of the coded sums of a
+	CompressiveHistogram:
+	* Zero-mean gray codes are exactly +-1, so with integer modes every photon is a +-1 add on int32 (or int16)
+	* Fourier codes are quantized cos/sin tables (see coding_trunc_fourier.get_cos_sin_table) scaled to int16 or int8
+	* Decoding uses the quantized coding matrix (the codes that were actually accumulated) cast to a low-precision float.
+	  We also decode with that matrix stored as int16 (see quantize_coding_matrix), to check if it can be kept in 16 bits
+	evaluate_quantization accumulates the same photons with every mode and reports the error against the float64 reference,
+	so we can pick the smallest mode that does not change the decoded depths.
+
+	Look at the main script here to see how it is used
+'''
+## Standard Library Imports
+import time
+
+## Library Imports
+import numpy as np
+
+## Local Imports
+from compressive_histogram import CompressiveHistogram
+from decoding import Decoder
+
+QUANTIZATION_MODES = {
+	'float64': {'dtype': np.float64, 'code_dtype': np.float64},
+	'float32': {'dtype': np.float32, 'code_dtype': np.float32},
+	'float16': {'dtype': np.float16, 'code_dtype': np.float16},
+	'int32': {'dtype': np.int32, 'code_dtype': np.int16},
+	'int32_int8_codes': {'dtype': np.int32, 'code_dtype': np.int8},
+	'int16': {'dtype': np.int16, 'code_dtype': np.int8},
+}
+
+def quantize_coding_matrix(C, dtype=np.int16):
+	'''
+		Scale C so that its largest absolute value is the max value of the integer dtype and round it.
+		Returns (quantized_C, scale) where C ~= quantized_C / scale
+	'''
+	## scaled in float64, so that low-precision float matrices do not round past the max value of dtype
+	C = np.asarray(C, dtype=np.float64)
+	scale = np.iinfo(dtype).max / np.abs(C).max()
+	return (np.round(C*scale).astype(dtype), scale)
+
+def get_max_photons_per_pixel(hist: CompressiveHistogram) -> int:
+	'''
+		Number of photons per pixel that the coded sums of hist can hold exactly: before integer sums overflow, or before
+		float sums of integer codes start to round (e.g., 2048 for float16)
+	'''
+	if(np.issubdtype(hist.dtype, np.integer)):
+		return int(np.iinfo(hist.dtype).max // hist.code_scale)
+	return int(2**(np.finfo(hist.dtype).nmant + 1) // hist.code_scale)
+
+def get_float_coded_hist(hist: CompressiveHistogram) -> np.ndarray:
+	'''
+		Coded sums of hist as float64 in the units of the float codes (i.e., divided by code_scale)
+	'''
+	return hist.coded_hist.astype(np.float64) / hist.code_scale
+
+def get_decoded_errors(decoded, reference_decoded, n_tbins):
+	'''
+		Absolute difference in time bins, taking into account that the time bins wrap around
+	'''
+	decoded_errors = np.abs(decoded - reference_decoded)
+	return np.minimum(decoded_errors, n_tbins - decoded_errors)
+
+def evaluate_quantization(photon_stream, n_pixels: int, n_tbins: int, coding_scheme: str='zero_mean_gray', n_freqs: int=None, modes=None, decode_dtype=np.float32) -> dict:
+	'''
+		Accumulate the same photons with each quantization mode and compare them against float64.
+		Arguments:
+			* photon_stream: iterable of (pixel_ids, tstamps) chunks (e.g., spad_simulator.simulate_photon_stream)
+			* n_pixels, n_tbins, coding_scheme, n_freqs: see CompressiveHistogram
+			* modes: list of keys of QUANTIZATION_MODES. Defaults to all of them
+			* decode_dtype: float type used to decode the low-precision modes
+		Returns a dict with, for each mode:
+			* coded_hist_rel_error: relative L2 error of the coded sums
+			* decoded_match: fraction of pixels decoded to the same time bin as float64
+			* decoded_mae_bins: mean absolute difference with the float64 decoded time bins
+			* decoded_match_int16_matrix, decoded_mae_bins_int16_matrix: the same when decoding with the coding matrix
+			  quantized to int16 (see quantize_coding_matrix)
+			* nbytes and bytes_ratio: size of the coded sums and how many times smaller they are than float64
+			* accumulate_seconds: time spent encoding and accumulating
+			* overflow: True if a pixel got more photons than the mode can hold (see get_max_photons_per_pixel). The
+			  accumulation of that mode stops at the chunk where it happens, and its errors are not meaningful
+	'''
+	if(modes is None): modes = list(QUANTIZATION_MODES.keys())
+	hists = {'reference': CompressiveHistogram(n_pixels, n_tbins, coding_scheme=coding_scheme, n_freqs=n_freqs, dtype=np.float64)}
+	for mode in modes:
+		hists[mode] = CompressiveHistogram(n_pixels, n_tbins, coding_scheme=coding_scheme, n_freqs=n_freqs, **QUANTIZATION_MODES[mode])
+	max_photons = {name: get_max_photons_per_pixel(hist) for (name, hist) in hists.items()}
+	accumulate_seconds = {name: 0. for name in hists.keys()}
+	overflow = {name: False for name in hists.keys()}
+	for (pixel_ids, tstamps) in photon_stream:
+		chunk_n_photons = np.bincount(pixel_ids, minlength=n_pixels)
+		for (name, hist) in hists.items():
+			if(overflow[name]): continue
+			if((name != 'reference') and ((hist.n_photons + chunk_n_photons).max() > max_photons[name])):
+				overflow[name] = True
+				continue
+			start_time = time.perf_counter()
+			hist.update(pixel_ids, tstamps)
+			accumulate_seconds[name] += time.perf_counter() - start_time
+	reference = hists['reference']
+	reference_coded_hist = get_float_coded_hist(reference)
+	reference_decoded = Decoder(reference.get_coding_matrix(), zero_mean=True).decode(reference_coded_hist.T)
+	results = {}
+	for mode in modes:
+		hist = hists[mode]
+		coded_hist_error = np.linalg.norm(get_float_coded_hist(hist) - reference_coded_hist) / (np.linalg.norm(reference_coded_hist) + 1e-12)
+		C = hist.get_coding_matrix(quantized=True)
+		decoded_errors = get_decoded_errors(Decoder(C, zero_mean=True, dtype=decode_dtype).decode(hist.coded_hist.T), reference_decoded, n_tbins)
+		(int16_C, _) = quantize_coding_matrix(C, dtype=np.int16)
+		int16_decoded_errors = get_decoded_errors(Decoder(int16_C, zero_mean=True, dtype=decode_dtype).decode(hist.coded_hist.T), reference_decoded, n_tbins)
+		results[mode] = {
+			'coded_hist_rel_error': float(coded_hist_error),
+			'decoded_match': float(np.mean(decoded_errors == 0)),
+			'decoded_mae_bins': float(decoded_errors.mean()),
+			'decoded_match_int16_matrix': float(np.mean(int16_decoded_errors == 0)),
+			'decoded_mae_bins_int16_matrix': float(int16_decoded_errors.mean()),
+			'nbytes': hist.nbytes,
+			'bytes_ratio': reference.nbytes / hist.nbytes,
+			'accumulate_seconds': accumulate_seconds[mode],
+			'overflow': overflow[mode],
+		}
+	return results
+
+if __name__=='__main__':
+	from spad_simulator import simulate_photon_stream
+	from tof_utils import bin2depth
+
+	## Set parameters
+	(height, width) = (64, 64)
+	n_tbins = 1024
+	repetition_tau = 100e-9
+	n_cycles = 20000
+	max_depth = bin2depth(n_tbins, n_tbins, repetition_tau)
+	depths = np.tile(np.linspace(0.1*max_depth, 0.9*max_depth, width), (height, 1))
+
+	for (coding_scheme, n_freqs) in [('zero_mean_gray', None), ('trunc_fourier', 8)]:
+		stream = simulate_photon_stream(depths, n_cycles, n_tbins, repetition_tau, signal_flux=0.01, ambient_flux=0.05, pulse_width=2., seed=0)
+		results = evaluate_quantization(stream, height*width, n_tbins, coding_scheme=coding_scheme, n_freqs=n_freqs)
+		print("{} coding".format(coding_scheme))
+		for (mode, result) in results.items():
+			print("    {:<18} coded sums error = {:.2e}  decoded match = {:>7.2%} (int16 matrix {:>7.2%})  MAE = {:>6.3f} bins  {:>4.1f}x smaller  {:.3f} s{}".format(
+				mode, result['coded_hist_rel_error'], result['decoded_match'], result['decoded_match_int16_matrix'], result['decoded_mae_bins'], result['bytes_ratio'],
+				result['accumulate_seconds'], '  (overflow)' if(result['overflow']) else ''))
@@ -0,0 +1,208 @@
+'''
+	Incremental decoding of a sliding window of photons, for video-rate depth.
+
+	SlidingWindowDecoder keeps the coded sums of the last window_len chunks of photons:
+	* push adds the codes of a new chunk to the coded sums, and subtracts the codes of the chunk that leaves the window
+	  (see CompressiveHistogram.update_codes and remove_codes). Only the codes of the chunks in the window are kept
+	* decode only re-decodes the pixels whose normalized coded vector moved more than the Poisson noise explains since
+	  the last time they were decoded. The other pixels reuse their cached decoded time bin
+	The photons that entered or left the window of a pixel since its last decode move its normalized coded vector by
+	about sqrt(n_changed_photons) * (rms norm of the codes) / (norm of the coded sums) even if the scene is static,
+	while a change in the scene moves it proportionally to n_changed_photons (see get_n_changed_photons). A pixel is
+	re-decoded when the move is larger than change_threshold times that expected noise move. This is the expected length
+	of the move, not a per-code standard deviation, so static pixels can still go over a threshold of 2 now and then,
+	more often at low photon counts. Pixels that get no photons in or out of the window are not even checked, so the decode work of
+	each frame follows how much of the scene changed. With change_threshold=0 every pixel whose coded sums changed is
+	re-decoded, which gives the same result as decoding all the pixels.
+
+	Look at the main script here to see how it is used
+'''
+## Standard Library Imports
+import time
+import collections
+
+## Library Imports
+import numpy as np
+
+## Local Imports
+from compressive_histogram import CompressiveHistogram
+from decoding import Decoder, norm_t
+
+class SlidingWindowDecoder:
+	'''
+		Arguments:
+			* hist: CompressiveHistogram used to encode and accumulate the photons. Its coding scheme sets the coding matrix.
+			  Use integer codes (e.g., dtype=np.int32 with zero_mean_gray) or float64 sums so that the subtractions are exact
+			* window_len: number of chunks in the window
+			* decode_fn: function that maps a KxM matrix of coded sums to M decoded time bins. Defaults to
+			  Decoder(hist.get_coding_matrix(quantized=True)).decode
+			* change_threshold: a pixel is re-decoded when the L2 distance between its normalized coded vectors (now and
+			  when it was last decoded) is above change_threshold times the expected noise move (see get_noise_level)
+			* zero_mean: normalize the coded vectors like zncc (True) or ncc (False) when measuring the change
+	'''
+	def __init__(self, hist: CompressiveHistogram, window_len: int, decode_fn=None, change_threshold: float=2., zero_mean: bool=True):
+		assert(window_len >= 1), "window_len should be positive"
+		self.hist = hist
+		self.window_len = window_len
+		if(decode_fn is None): decode_fn = Decoder(hist.get_coding_matrix(quantized=True), zero_mean=zero_mean).decode
+		self.decode_fn = decode_fn
+		self.change_threshold = change_threshold
+		self.zero_mean = zero_mean
+		## rms norm of the (zero-mean) code of one photon, which sets the noise of the coded sums
+		C = hist.get_coding_matrix(quantized=True).astype(np.float64)
+		if(zero_mean): C = C - C.mean(axis=-1, keepdims=True)
+		self.code_rms_norm = np.sqrt(np.mean(np.sum(C**2, axis=-1)))
+		## (pixel_ids, codes) of each chunk in the window, oldest first
+		self.chunks = collections.deque()
+		self.decoded = np.zeros((hist.n_pixels,), dtype=np.float64)
+		## normalized coded vector of each pixel when it was last decoded
+		self.decoded_norm_codes = np.zeros((hist.n_pixels, hist.n_codes), dtype=np.float64)
+		## pixels whose coded sums changed since they were last checked. Every pixel is decoded the first time
+		self.is_dirty = np.ones((hist.n_pixels,), dtype=bool)
+		self.is_decoded = np.zeros((hist.n_pixels,), dtype=bool)
+		## number of pushes, and the number of pushes and photons in the window of each pixel when it was last decoded
+		self.n_pushes = 0
+		self.decoded_n_pushes = np.zeros((hist.n_pixels,), dtype=np.int64)
+		self.decoded_n_photons = np.zeros((hist.n_pixels,), dtype=np.int64)
+		## photons pushed to each pixel since it was last decoded
+		self.n_added_photons = np.zeros((hist.n_pixels,), dtype=np.int64)
+		self.stats = {'n_frames': 0, 'n_checked_pixels': 0, 'n_decoded_pixels': 0, 'decode_seconds': 0.}
+
+	def push(self, pixel_ids: np.ndarray, tstamps: np.ndarray):
+		'''
+			Add a chunk of timestamps to the window (see CompressiveHistogram.update)
+		'''
+		self.push_codes(pixel_ids, self.hist.encode(tstamps))
+
+	def push_codes(self, pixel_ids: np.ndarray, codes: np.ndarray):
+		'''
+			Add a chunk of already encoded timestamps to the window. If the window is full, its oldest chunk is removed
+		'''
+		## copies, because the caller may reuse its buffers before the chunk leaves the window
+		pixel_ids = np.array(pixel_ids).ravel()
+		codes = np.array(codes).reshape((-1, self.hist.n_codes))
+		self.hist.update_codes(pixel_ids, codes)
+		self.is_dirty[pixel_ids] = True
+		self.n_added_photons += np.bincount(pixel_ids, minlength=self.hist.n_pixels)
+		self.n_pushes += 1
+		self.chunks.append((pixel_ids, codes))
+		while(len(self.chunks) > self.window_len):
+			(old_pixel_ids, old_codes) = self.chunks.popleft()
+			self.hist.remove_codes(old_pixel_ids, old_codes)
+			self.is_dirty[old_pixel_ids] = True
+
+	def _normalize(self, coded_hist):
+		'''
+			Normalized coded vectors and the norm of the (zero-mean) coded sums
+		'''
+		coded_hist = coded_hist.astype(np.float64)
+		if(self.zero_mean): coded_hist = coded_hist - coded_hist.mean(axis=-1, keepdims=True)
+		norms = np.linalg.norm(coded_hist, axis=-1)
+		return (norm_t(coded_hist, axis=-1), norms)
+
+	def get_n_changed_photons(self, pixel_ids) -> np.ndarray:
+		'''
+			Photons that are in the window of each pixel now but were not when it was last decoded, plus the ones that were
+			and are not anymore. Chunks leave the window in order, so the photons pushed since the last decode are all
+			still in the window until window_len chunks have been pushed, and after that the whole window was replaced
+		'''
+		n_photons = self.hist.n_photons[pixel_ids]
+		is_replaced = (self.n_pushes - self.decoded_n_pushes[pixel_ids]) >= self.window_len
+		n_new_photons = np.where(is_replaced, n_photons, self.n_added_photons[pixel_ids])
+		n_removed_photons = self.decoded_n_photons[pixel_ids] - (n_photons - n_new_photons)
+		return n_new_photons + n_removed_photons
+
+	def get_noise_level(self, pixel_ids, norms) -> np.ndarray:
+		'''
+			Expected L2 distance between the normalized coded vectors of static pixels, now and at their last decode
+		'''
+		return self.code_rms_norm*np.sqrt(self.get_n_changed_photons(pixel_ids)) / np.maximum(norms, 1e-12)
+
+	def decode(self) -> np.ndarray:
+		'''
+			Decoded time bin of every pixel for the current window. Only the pixels that changed are re-decoded
+		'''
+		start_time = time.perf_counter()
+		checked_pixels = np.flatnonzero(self.is_dirty)
+		(norm_codes, norms) = self._normalize(self.hist.coded_hist[checked_pixels])
+		changes = np.linalg.norm(norm_codes - self.decoded_norm_codes[checked_pixels], axis=-1)
+		## while the window fills up the photon counts grow, so the earlier decodes are noisier than the new ones
+		change_threshold = self.change_threshold if(len(self.chunks) >= self.window_len) else 0.
+		is_changed = (changes > change_threshold*self.get_noise_level(checked_pixels, norms)) | np.logical_not(self.is_decoded[checked_pixels])
+		changed_pixels = checked_pixels[is_changed]
+		if(changed_pixels.size > 0):
+			self.decoded[changed_pixels] = self.decode_fn(self.hist.coded_hist[changed_pixels].T)
+			self.decoded_norm_codes[changed_pixels] = norm_codes[is_changed]
+			self.is_decoded[changed_pixels] = True
+			self.decoded_n_pushes[changed_pixels] = self.n_pushes
+			self.decoded_n_photons[changed_pixels] = self.hist.n_photons[changed_pixels]
+			self.n_added_photons[changed_pixels] = 0
+		## pixels under the threshold stay dirty only if they change again
+		self.is_dirty[checked_pixels] = False
+		self.stats['n_frames'] += 1
+		self.stats['n_checked_pixels'] += checked_pixels.size
+		self.stats['n_decoded_pixels'] += changed_pixels.size
+		self.stats['decode_seconds'] += time.perf_counter() - start_time
+		return self.decoded.copy()
+
+	def get_decoded_fraction(self) -> float:
+		'''
+			Fraction of the pixels that were re-decoded per frame (1 means the same work as decoding every frame from scratch)
+		'''
+		return self.stats['n_decoded_pixels'] / max(1, self.stats['n_frames']*self.hist.n_pixels)
+
+	def reset(self):
+		self.hist.reset()
+		self.chunks.clear()
+		self.decoded[:] = 0
+		self.decoded_norm_codes[:] = 0
+		self.is_dirty[:] = True
+		self.is_decoded[:] = False
+		self.n_pushes = 0
+		self.decoded_n_pushes[:] = 0
+		self.decoded_n_photons[:] = 0
+		self.n_added_photons[:] = 0
+		self.stats = {'n_frames': 0, 'n_checked_pixels': 0, 'n_decoded_pixels': 0, 'decode_seconds': 0.}
+
+if __name__=='__main__':
+	from spad_simulator import simulate_photon_stream
+	from tof_utils import bin2depth
+
+	## Set parameters
+	(height, width) = (64, 64)
+	n_tbins = 1024
+	repetition_tau = 100e-9
+	n_frames = 20
+	n_cycles_per_chunk = 8000
+	window_len = 5
+	max_depth = bin2depth(n_tbins, n_tbins, repetition_tau)
+
+	## A static background with a small square that moves across it (speed in pixels per frame)
+	def get_frame_depths(frame_id, speed):
+		depths = np.full((height, width), 0.7*max_depth)
+		start = speed*frame_id
+		depths[24:40, start:start+16] = 0.3*max_depth
+		return depths
+
+	for speed in [0, 2]:
+		## pixels whose depth changed within the last window, i.e., the ones that should be re-decoded
+		changed_fraction = np.mean([np.mean(get_frame_depths(frame_id, speed) != get_frame_depths(frame_id - 1, speed)) for frame_id in range(window_len, n_frames)])*window_len
+		print("square moving {} pixels per frame ({:.2%} of the pixels change depth within a window):".format(speed, changed_fraction))
+		for change_threshold in [0., 2., 4.]:
+			hist = CompressiveHistogram(height*width, n_tbins, coding_scheme='zero_mean_gray', dtype=np.int32, code_dtype=np.int8)
+			sliding_decoder = SlidingWindowDecoder(hist, window_len, change_threshold=change_threshold)
+			full_decoder = Decoder(hist.get_coding_matrix(quantized=True))
+			(full_seconds, depth_errors, full_depth_errors) = (0., [], [])
+			for frame_id in range(n_frames):
+				for (pixel_ids, tstamps) in simulate_photon_stream(get_frame_depths(frame_id, speed), n_cycles_per_chunk, n_tbins, repetition_tau, signal_flux=0.01, ambient_flux=0.01, pulse_width=2., seed=frame_id):
+					sliding_decoder.push(pixel_ids, tstamps)
+				## the window is full after window_len frames. Before that every pixel is re-decoded
+				if(frame_id == window_len): sliding_decoder.stats.update({'n_frames': 0, 'n_checked_pixels': 0, 'n_decoded_pixels': 0})
+				decoded = sliding_decoder.decode()
+				start_time = time.perf_counter()
+				full_decoded = full_decoder.decode(hist.coded_hist.T)
+				full_seconds += time.perf_counter() - start_time
+				depth_errors.append(np.abs(bin2depth(decoded, n_tbins, repetition_tau) - get_frame_depths(frame_id, speed).ravel()).mean())
+				full_depth_errors.append(np.abs(bin2depth(full_decoded, n_tbins, repetition_tau) - get_frame_depths(frame_id, speed).ravel()).mean())
+			print("    change threshold = {:.1f}: re-decoded {:>6.2%} of the pixels per frame once the window is full, decode time {:.3f} s (full decoding {:.3f} s), mean absolute depth error = {:.3f} m (full decoding {:.3f} m)".format(
+				change_threshold, sliding_decoder.get_decoded_fraction(), sliding_decoder.stats['decode_seconds'], full_seconds, np.mean(depth_errors), np.mean(full_depth_errors)))
@@ -0,0 +1,145 @@
+'''
+	Photon-level simulation of a SPAD pixel array.
+
+	Each laser cycle, each pixel receives:
+	* Signal photons: Poisson with mean albedo*signal_flux, arriving at the round-trip time of the pixel depth
+	  plus a gaussian jitter with std pulse_width
+	* Ambient photons: Poisson with mean ambient_flux, uniformly distributed over the n_tbins time bins
+	After a photon arrives the SPAD is blind for dead_time bins. We use a paralyzable model within each cycle, i.e., photons
+	that arrive during the dead time are lost and also restart it. The detector is reset at the start of each cycle.
+
+	The detected photons are returned as a generator of (pixel_ids, tstamps) chunks, so arbitrarily many photons can be
+	simulated without holding them in memory. The chunks can be passed directly to CompressiveHistogram.update or to the
+	batch encoders in coding_gray.py and coding_trunc_fourier.py.
+
+	Look at the main script here to see how it is used
+'''
+## Standard Library Imports
+
+## Library Imports
+import numpy as np
+
+## Local Imports
+from tof_utils import depth2time
+
+def depth2bin(depths, n_tbins, repetition_tau):
+	'''
+		Fractional time bin of the round-trip time for each depth (in meters), wrapped into [0, n_tbins)
+	'''
+	return np.mod(depth2time(np.asarray(depths, dtype=np.float64))*(n_tbins / repetition_tau), n_tbins)
+
+def apply_dead_time(group_ids, times, dead_time):
+	'''
+		Mask of the photons that are detected when the SPAD is blind for dead_time bins after each photon (paralyzable).
+		Arguments:
+			* group_ids: integer id of the (cycle, pixel) of each photon. Only photons in the same group interact
+			* times: arrival time of each photon (in bins)
+			* dead_time: dead time in bins
+		Returns:
+			* (is_detected, order): boolean mask and the indeces that sort the photons by (group, time). is_detected is in sorted order
+	'''
+	order = np.lexsort((times, group_ids))
+	sorted_group_ids = group_ids[order]
+	sorted_times = times[order]
+	is_detected = np.ones(order.shape, dtype=bool)
+	is_same_group = sorted_group_ids[1:] == sorted_group_ids[:-1]
+	is_detected[1:] = np.logical_not(is_same_group) | ((sorted_times[1:] - sorted_times[:-1]) >= dead_time)
+	return (is_detected, order)
+
+def simulate_photon_stream(depths, n_cycles, n_tbins, repetition_tau, albedos=None, signal_flux=0.01, ambient_flux=0.01, pulse_width=1., dead_time=0., max_photons_per_chunk=2**22, seed=None):
+	'''
+		Generator of the photons detected by each pixel over n_cycles laser cycles.
+		Arguments:
+			* depths: array of any shape with the depth of each pixel (in meters)
+			* n_cycles: number of laser cycles
+			* n_tbins: number of time bins in each cycle
+			* repetition_tau: duration of each cycle (in seconds)
+			* albedos: array with the same shape as depths. Defaults to 1
+			* signal_flux: mean number of signal photons per cycle for a pixel with albedo 1
+			* ambient_flux: mean number of ambient photons per cycle per pixel
+			* pulse_width: std of the gaussian laser pulse and jitter (in bins)
+			* dead_time: dead time of the SPAD (in bins). 0 means no dead time
+			* max_photons_per_chunk: the cycles are split into chunks with (approximately) at most this many photons
+			* seed: seed of the random number generator. The same seed gives the same stream
+		Yields:
+			* (pixel_ids, tstamps): int64 arrays with the flat pixel index and the time bin of each detected photon
+	'''
+	rng = np.random.default_rng(seed)
+	gt_tbins = depth2bin(depths, n_tbins, repetition_tau).ravel()
+	n_pixels = gt_tbins.size
+	if(albedos is None): albedos = np.ones((n_pixels,))
+	albedos = np.asarray(albedos, dtype=np.float64).ravel()
+	assert(albedos.size == n_pixels), "albedos should have the same shape as depths"
+	assert((signal_flux >= 0) and (ambient_flux >= 0)), "fluxes should be non-negative"
+	signal_lams = albedos*signal_flux
+	ambient_lams = np.full((n_pixels,), float(ambient_flux))
+	## With dead time photons interact within each cycle, so we draw the counts of each (cycle, pixel).
+	## Without it, the counts of all the cycles of a chunk are drawn at once
+	photons_per_cycle = signal_lams.sum() + ambient_lams.sum()
+	if(dead_time > 0): photons_per_cycle = max(photons_per_cycle, n_pixels)
+	cycles_per_chunk = int(max(1, min(n_cycles, max_photons_per_chunk // max(photons_per_cycle, 1))))
+	for start_cycle in range(0, n_cycles, cycles_per_chunk):
+		n_chunk_cycles = min(cycles_per_chunk, n_cycles - start_cycle)
+		if(dead_time > 0):
+			n_signal = rng.poisson(signal_lams, size=(n_chunk_cycles, n_pixels)).ravel()
+			n_ambient = rng.poisson(ambient_lams, size=(n_chunk_cycles, n_pixels)).ravel()
+			## id of each (cycle, pixel)
+			group_ids = np.arange(n_chunk_cycles*n_pixels)
+		else:
+			n_signal = rng.poisson(signal_lams*n_chunk_cycles)
+			n_ambient = rng.poisson(ambient_lams*n_chunk_cycles)
+			group_ids = np.arange(n_pixels)
+		signal_group_ids = np.repeat(group_ids, n_signal)
+		ambient_group_ids = np.repeat(group_ids, n_ambient)
+		signal_pixel_ids = signal_group_ids % n_pixels
+		signal_times = gt_tbins[signal_pixel_ids] + pulse_width*rng.standard_normal(signal_pixel_ids.shape)
+		ambient_times = n_tbins*rng.random(ambient_group_ids.shape)
+		group_ids = np.concatenate((signal_group_ids, ambient_group_ids))
+		## The pulse is periodic so the jitter wraps around the cycle
+		times = np.mod(np.concatenate((signal_times, ambient_times)), n_tbins)
+		if(dead_time > 0):
+			(is_detected, order) = apply_dead_time(group_ids, times, dead_time)
+			group_ids = group_ids[order[is_detected]]
+			times = times[order[is_detected]]
+		pixel_ids = group_ids % n_pixels
+		## floating point mod can return exactly n_tbins for tiny negative times
+		tstamps = np.minimum(np.floor(times).astype(np.int64), n_tbins - 1)
+		yield (pixel_ids, tstamps)
+
+def simulate_photons(depths, n_cycles, n_tbins, repetition_tau, **kwargs):
+	'''
+		Same as simulate_photon_stream but returns all the photons at once. Only use it for small simulations
+	'''
+	chunks = list(simulate_photon_stream(depths, n_cycles, n_tbins, repetition_tau, **kwargs))
+	if(len(chunks) == 0): return (np.zeros((0,), dtype=np.int64), np.zeros((0,), dtype=np.int64))
+	return (np.concatenate([pixel_ids for (pixel_ids, _) in chunks]), np.concatenate([tstamps for (_, tstamps) in chunks]))
+
+if __name__=='__main__':
+	import time
+	from compressive_histogram import CompressiveHistogram
+	from decoding import zncc_decoding
+	from tof_utils import bin2depth
+
+	## Set parameters
+	(height, width) = (64, 64)
+	n_tbins = 1024
+	repetition_tau = 100e-9
+	n_cycles = 20000
+	max_depth = bin2depth(n_tbins, n_tbins, repetition_tau)
+
+	## A tilted plane with a brighter square in the middle
+	depths = np.tile(np.linspace(0.1*max_depth, 0.9*max_depth, width), (height, 1))
+	albedos = np.full((height, width), 0.5)
+	albedos[16:48, 16:48] = 1.
+
+	for dead_time in [0., 50.]:
+		fourier_hist = CompressiveHistogram(height*width, n_tbins, coding_scheme='trunc_fourier', n_freqs=8)
+		start_time = time.perf_counter()
+		stream = simulate_photon_stream(depths, n_cycles, n_tbins, repetition_tau, albedos=albedos, signal_flux=0.01, ambient_flux=0.05, pulse_width=2., dead_time=dead_time, seed=0)
+		for (pixel_ids, tstamps) in stream:
+			fourier_hist.update(pixel_ids, tstamps)
+		elapsed = time.perf_counter() - start_time
+		n_photons = fourier_hist.n_photons.sum()
+		decoded_tbins = zncc_decoding(fourier_hist.coded_hist.T, fourier_hist.get_coding_matrix())
+		depth_errors = np.abs(bin2depth(decoded_tbins, n_tbins, repetition_tau) - depths.ravel())
+		print("dead time = {:>4} bins: {} photons ({:.2e} photons/s). Mean absolute depth error = {:.3f} m".format(dead_time, n_photons, n_photons / elapsed, depth_errors.mean()))
@@ -6,12 +6,11 @@ import math
 
 ## Library Imports
 import numpy as np
-from IPython.core import debugger
-breakpoint = debugger.set_trace
 
 ## Local Imports
-from coding_gray import uint_to_zero_mean_gray_code, uint_to_gray_code, generate_gray_coding_matrix
-from coding_trunc_fourier import uint_to_trunc_fourier_code, generate_trunc_fourier_coding_matrix
+from coding_gray import uint_to_zero_mean_gray_code, uint_to_gray_code
+from coding_trunc_fourier import uint_to_trunc_fourier_code
+from coding_cache import get_coding_matrix
 from decoding import ncc, zncc, zncc_decoding
 
 if __name__=='__main__':
@@ -32,7 +31,7 @@ if __name__=='__main__':
 	# Encode
 	encoded_tstamp = uint_to_zero_mean_gray_code(test_tstamp, gray_code_len)
 	# Decode with gray coding matrix
-	gray_Cmat = generate_gray_coding_matrix(gray_code_len)
+	gray_Cmat = get_coding_matrix('gray', k_bits=gray_code_len)
 	gray_decoded_tstamp = zncc_decoding(encoded_tstamp, gray_Cmat)
 	print("Gray Decoded Timestamp: {}".format(gray_decoded_tstamp))
 
@@ -43,7 +42,7 @@ if __name__=='__main__':
 	# Encode
 	encoded_tstamp = uint_to_trunc_fourier_code(test_tstamp, n_tbins, n_freqs, include_zeroth_harmonic=False)
 	# Decode with fourier coding matrix
-	fourier_Cmat = generate_trunc_fourier_coding_matrix(n_tbins, n_freqs, include_zeroth_harmonic=False)
+	fourier_Cmat = get_coding_matrix('trunc_fourier', domain_len=n_tbins, n_freqs=n_freqs, include_zeroth_harmonic=False)
 	fourier_decoded_tstamp = zncc_decoding(encoded_tstamp, fourier_Cmat)
 	print("fourier Decoded Timestamp: {}".format(fourier_decoded_tstamp))
 
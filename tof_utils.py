@@ -31,6 +31,15 @@ def time2depth(time):
 def depth2time(depth):
 	return (2*depth /  SPEED_OF_LIGHT)
 
+def bin2time(tbins, n_tbins, repetition_tau):
+	'''
+		Convert (possibly fractional) time bin indeces into time, when the repetition period is split into n_tbins bins
+	'''
+	return tbins*(repetition_tau / n_tbins)
+
+def bin2depth(tbins, n_tbins, repetition_tau):
+	return time2depth(bin2time(tbins, n_tbins, repetition_tau))
+
 def phasor2time(phasor, repetition_tau):
 	phase = np.angle(phasor)
 	return phase2time(phase, repetition_tau)
@@ -41,26 +50,65 @@ def zero_norm_t(C, axis=-1):
 	'''
 	return (C - C.mean(axis=axis, keepdims=True)) / (C.std(axis=axis, keepdims=True) + EPSILON)
 
-def circular_conv( v1, v2, axis=-1 ):
+def get_fft_module(workers=None):
+	'''
+		Returns (fft_module, kwargs). scipy.fft is used when workers is given (and scipy is installed) to run multithreaded FFTs
+	'''
+	if(workers is not None):
+		try:
+			import scipy.fft
+			return (scipy.fft, {'workers': workers})
+		except ImportError:
+			pass
+	return (np.fft, {})
+
+def circular_conv( v1, v2, axis=-1, workers=None ):
 	"""Circular convolution: Calculate the circular convolution for vectors v1 and v2. v1 and v2 are the same size
 	
 	Args:
 		v1 (numpy.ndarray): ...xN vector	
 		v2 (numpy.ndarray): ...xN vector	
+		workers (int): number of threads used by scipy.fft. If None numpy.fft is used
 	Returns:
 		v1convv2 (numpy.ndarray): convolution result. N x 1 vector.
 	"""
-	v1convv2 = np.fft.irfft( np.fft.rfft( v1, axis=axis ) * np.fft.rfft( v2, axis=axis ), axis=axis, n=v1.shape[-1] )
+	(fft, fft_kwargs) = get_fft_module(workers)
+	n = v1.shape[axis]
+	v1convv2 = fft.irfft( fft.rfft( v1, axis=axis, **fft_kwargs ) * fft.rfft( v2, axis=axis, **fft_kwargs ), axis=axis, n=n, **fft_kwargs )
 	return v1convv2
 
-def circular_corr( v1, v2, axis=-1 ):
+def circular_corr( v1, v2, axis=-1, workers=None ):
 	"""Circular correlation: Calculate the circular correlation for vectors v1 and v2. v1 and v2 are the same size
 	
 	Args:
 		v1 (numpy.ndarray): Nx1 vector	
 		v2 (numpy.ndarray): Nx1 vector	
+		workers (int): number of threads used by scipy.fft. If None numpy.fft is used
 	Returns:
 		v1corrv2 (numpy.ndarray): correlation result. N x 1 vector.
 	"""
-	v1corrv2 = np.fft.ifft( np.fft.fft( v1, axis=axis ).conj() * np.fft.fft( v2, axis=axis ), axis=axis ).real
-	return v1corrv2
\ No newline at end of file
+	if(np.iscomplexobj(v1) or np.iscomplexobj(v2)):
+		return np.fft.ifft( np.fft.fft( v1, axis=axis ).conj() * np.fft.fft( v2, axis=axis ), axis=axis ).real
+	return CircularCorrelator(v2, axis=axis, workers=workers)(v1)
+
+class CircularCorrelator:
+	"""Circular correlation with a fixed v2 (e.g., the demodulation functions). The rfft of v2 is computed once and
+	reused by every call, and the real-to-real rfft/irfft path does half the work of a complex fft/ifft.
+
+	Args:
+		v2 (numpy.ndarray): ...xN real vector
+		axis (int): axis along which the correlation is computed
+		workers (int): number of threads used by scipy.fft. If None numpy.fft is used
+	"""
+	def __init__( self, v2, axis=-1, workers=None ):
+		(self.fft, self.fft_kwargs) = get_fft_module(workers)
+		self.axis = axis
+		self.n = v2.shape[axis]
+		self.v2_rfft = self.fft.rfft( v2, axis=axis, **self.fft_kwargs )
+
+	def __call__( self, v1 ):
+		"""Circular correlation between v1 (same size as v2 along axis) and v2
+		"""
+		assert(v1.shape[self.axis] == self.n), "v1 and v2 should have the same size along axis"
+		v1_rfft = self.fft.rfft( v1, axis=self.axis, **self.fft_kwargs )
+		return self.fft.irfft( v1_rfft.conj() * self.v2_rfft, axis=self.axis, n=self.n, **self.fft_kwargs )
@@ -2,10 +2,6 @@
 
 ## Library Imports
 import numpy as np
-import scipy
-from scipy import signal
-from IPython.core import debugger
-breakpoint = debugger.set_trace
 
 ## Local Imports
 